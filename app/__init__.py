@@ -2,9 +2,13 @@ import functools
 import os
 from typing import Optional
 
+from app.calculator.computation.cache import ResultCache, StatusCache
 from app.calculator.computation.database import CalculatorDatabase
 from app.config import ProductionConfig, Config, config_by_env
+from app.util.cancellation import CancellationBoard
+from app.util.completion_notifier import CompletionNotifier
 from app.util.logger import logger
+from app.util.metrics import registry
 from app.util.process_queue_manager import ProcessQueueManager
 
 
@@ -31,8 +35,16 @@ class CalculatorMicroservice:
     def __init__(self, mode):
         logger.info(f"Initializing a CalculatorMicroservice by Process-{os.getpid()}")
         self.config = initialize_config(mode)
+        registry.configure(self.config.METRICS_DIR, self.config.METRICS_FLUSH_INTERVAL, clear=True)
         self.calculator_db = CalculatorDatabase(self.config)
+        self.calculator_cache = ResultCache(self.config, self.calculator_db)
+        self.calculator_notifier = CompletionNotifier(channels=self.config.SERVER_WORKERS)
+        self.calculator_cancellation = CancellationBoard(slots=self.config.CANCELLATION_SLOTS)
+        self.calculator_status_cache = StatusCache(self.config, self.calculator_db, self.calculator_notifier)
         self.calculator_qm = initialize_calculator_process_qm(self.config)
+        # Set once the consumers are started, see run_calculator_qm_task
+        self.calculator_recovery = None
+        self.calculator_retention = None
 
 
 # To be called in every child process
@@ -53,7 +65,30 @@ def initialize_calculator_process_qm(config: Config):
     logger.info(f"Initializing a singleton calculator process qm by Process-{os.getpid()}")
     calculator_qm = CalculatorProcessQueueManager(service='calculator', parallelism=config.CONSUMER_PARALLELISM,
                                                   max_limit=config.QUEUE_SIZE,
-                                                  queue_block_timeout=config.QUEUE_BLOCK_TIMEOUT)
+                                                  queue_block_timeout=config.QUEUE_BLOCK_TIMEOUT,
+                                                  transport=config.QUEUE_TRANSPORT,
+                                                  slot_size=config.QUEUE_SLOT_SIZE,
+                                                  tenant_weights=config.QUEUE_TENANT_WEIGHTS,
+                                                  fair_share=config.QUEUE_FAIR_SHARE,
+                                                  min_parallelism=config.CONSUMER_MIN_PARALLELISM,
+                                                  max_parallelism=config.CONSUMER_MAX_PARALLELISM,
+                                                  autoscale={"interval": config.AUTOSCALE_INTERVAL,
+                                                             "target_wait": config.AUTOSCALE_TARGET_WAIT,
+                                                             "backlog": config.AUTOSCALE_BACKLOG,
+                                                             "idle_delay": config.AUTOSCALE_IDLE_DELAY,
+                                                             "cpu_overcommit": config.AUTOSCALE_CPU_OVERCOMMIT},
+                                                  watchdog={"interval": config.WATCHDOG_INTERVAL,
+                                                            "heartbeat_timeout": config.WATCHDOG_HEARTBEAT_TIMEOUT
+                                                            + config.QUEUE_BLOCK_TIMEOUT,
+                                                            "grace": config.WATCHDOG_GRACE,
+                                                            "slot_size": config.WATCHDOG_SLOT_SIZE}
+                                                  if config.WATCHDOG_ENABLED else None,
+                                                  lease={"database": os.path.join(config.DB_PATH,
+                                                                                  f"{config.LEASE_QUEUE_DB_NAME}.db"),
+                                                         "visibility_timeout": config.LEASE_VISIBILITY_TIMEOUT,
+                                                         "poll_interval": config.LEASE_POLL_INTERVAL,
+                                                         "pragmas": config.SQLITE_PRAGMAS}
+                                                  if config.QUEUE_TRANSPORT == "lease" else None)
     return calculator_qm
 
 
@@ -0,0 +1,238 @@
+import asyncio
+import functools
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Callable, Optional, Tuple
+from urllib.parse import parse_qs
+
+from app import CalculatorMicroservice
+from app.calculator.computation.api import handle_evaluate, handle_status, handle_result, handle_cache_stats, \
+    handle_recovery_status, handle_scheduler_stats, handle_evaluate_batch, handle_status_batch, handle_result_batch, \
+    handle_status_stream, handle_autoscaler_stats, handle_metrics, REQUEST_SECONDS, handle_latency_stats, \
+    handle_kill, handle_watchdog_stats
+from app.calculator.computation.service import run_calculator_qm_task
+from app.util.logger import logger
+
+API_PREFIX = "/v1/calculator"
+
+
+def controller_routes() -> Dict[Tuple[str, str], Tuple[str, Optional[Callable], Optional[Callable]]]:
+    """
+    (method, path) -> (path, request validator, response renderer) of the resources of the Flask controller,
+    flask_restplus is only imported once the ASGI application is created
+    """
+    from flask_restplus import marshal
+    from jsonschema import Draft4Validator, RefResolver
+    from app.calculator.controller.controller import calculator_api
+
+    # Nested models are resolved as flask_restplus does from the swagger definitions
+    resolver = RefResolver.from_schema({"definitions": {name: model.__schema__
+                                                        for name, model in calculator_api.models.items()}})
+
+    def validator(expect):
+        schema = Draft4Validator(expect.__schema__, resolver=resolver)
+        return lambda payload: dict(expect.format_error(error) for error in schema.iter_errors(payload))
+
+    routes = {}
+    for resource, urls, *_ in calculator_api.resources:
+        for method in resource.methods:
+            doc = getattr(getattr(resource, method.lower()), "__apidoc__", {})
+            validate = validator(doc["expect"][0]) if doc.get("validate") else None
+            models = [model for _, model in doc.get("responses", {}).values()]
+            render = functools.partial(marshal, fields=models[0]) if models else None
+            routes.update({(method, url): (url, validate, render) for url in urls})
+    return routes
+
+
+class CalculatorASGI:
+    """
+    Pure ASGI application of the calculator endpoints
+
+    The routes, request and response models are the ones of the Flask controller, and so are the handlers;
+    they block on SQLite and the process queue so they run on a thread pool and never on the event loop;
+    long-polls and event streams get their own pool so that they cannot starve the short requests.
+    """
+
+    def __init__(self, ms: CalculatorMicroservice):
+        self.ms = ms
+        self.executor = ThreadPoolExecutor(max_workers=ms.config.ASGI_EXECUTOR_THREADS, thread_name_prefix="asgi")
+        self.wait_executor = ThreadPoolExecutor(max_workers=ms.config.ASGI_EXECUTOR_THREADS,
+                                                thread_name_prefix="asgi-wait")
+        # Every route of the controller is served by the coroutine named after its path
+        self.routes: Dict[Tuple[str, str], Tuple[Callable, Optional[Callable], Optional[Callable]]] = {
+            key: (getattr(self, path.strip("/")), validate, render)
+            for key, (path, validate, render) in controller_routes().items()}
+        logger.info(f"CalculatorASGI initialized by Process-{os.getpid()}")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+            return
+        if scope["type"] != "http":
+            return
+        start = time.perf_counter()
+        path: str = scope["path"]
+
+        async def send_timed(message):
+            # Event streams are timed until their headers are sent
+            if message["type"] == "http.response.start":
+                REQUEST_SECONDS.observe(time.perf_counter() - start, method=scope["method"],
+                                        endpoint=path if route else "unmatched", status=message["status"])
+            await send(message)
+
+        if path == "/metrics":
+            route = (self.metrics, None, None) if scope["method"] == "GET" else None
+        else:
+            route = self.routes.get((scope["method"], path[len(API_PREFIX):])) if path.startswith(API_PREFIX) \
+                else None
+        if route is None:
+            await self._send_json(send_timed, 404, {"message": "The requested URL was not found on the server."})
+            return
+        handler, validate, render = route
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        payload = None
+        if validate is not None:
+            payload = await self._payload(await self._read_body(receive), validate, send_timed)
+            if payload is None:
+                return
+        result = await handler(payload=payload, query=query, receive=receive, send=send_timed)
+        if render is not None and result is not None:
+            await self._send_json(send_timed, 200, render(result))
+
+    async def _run(self, func, *, executor: Optional[ThreadPoolExecutor] = None, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(executor or self.executor, functools.partial(func, **kwargs))
+
+    async def _payload(self, body: bytes, validate: Callable, send) -> Optional[dict]:
+        try:
+            payload = json.loads(body or b"null")
+        except ValueError:
+            await self._send_json(send, 400, {"message": "Failed to decode JSON object"})
+            return None
+        errors = validate(payload)
+        if errors:
+            await self._send_json(send, 400, {"errors": errors, "message": "Input payload validation failed"})
+            return None
+        return payload
+
+    async def _query_float(self, query: Dict, name: str, default: Optional[float], send) -> Tuple[bool, float]:
+        try:
+            return True, float(query[name][0]) if name in query else default
+        except ValueError:
+            await self._send_json(send, 400, {"errors": {name: "not a valid float"},
+                                              "message": "Input payload validation failed"})
+            return False, default
+
+    async def evaluate(self, payload: Dict, **_):
+        return await self._run(handle_evaluate, data=payload, ms=self.ms)
+
+    async def evaluate_batch(self, payload: Dict, **_):
+        return await self._run(handle_evaluate_batch, data=payload, ms=self.ms)
+
+    async def status(self, payload: Dict, **_):
+        return await self._run(handle_status, task_id=payload["task_id"], ms=self.ms)
+
+    async def status_batch(self, payload: Dict, **_):
+        return await self._run(handle_status_batch, task_ids=payload["task_ids"], ms=self.ms)
+
+    async def result(self, payload: Dict, query: Dict, send, **_):
+        valid, wait = await self._query_float(query, "wait", 0, send)
+        if valid:
+            return await self._run(handle_result, task_id=payload["task_id"], wait=wait, ms=self.ms,
+                                   executor=self.wait_executor if wait > 0 else None)
+
+    async def result_batch(self, payload: Dict, **_):
+        return await self._run(handle_result_batch, task_ids=payload["task_ids"], ms=self.ms)
+
+    async def kill(self, payload: Dict, **_):
+        return await self._run(handle_kill, task_id=payload["task_id"], ms=self.ms)
+
+    async def stream(self, query: Dict, receive, send, **_):
+        events = handle_status_stream(task_ids=query.get("task_id", []), ms=self.ms)
+        disconnected = asyncio.ensure_future(self._wait_disconnect(receive))
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/event-stream; charset=utf-8"),
+                                (b"cache-control", b"no-cache")]})
+        loop = asyncio.get_running_loop()
+        try:
+            while not disconnected.done():
+                event = await loop.run_in_executor(self.wait_executor, next, events, None)
+                if event is None:
+                    break
+                await send({"type": "http.response.body", "body": event.encode("utf-8"), "more_body": True})
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        finally:
+            disconnected.cancel()
+            # Releases the subscription of the stream
+            await loop.run_in_executor(self.wait_executor, events.close)
+
+    async def cache(self, **_):
+        return await self._run(handle_cache_stats, ms=self.ms)
+
+    async def recovery(self, **_):
+        return await self._run(handle_recovery_status, ms=self.ms)
+
+    async def scheduler(self, **_):
+        return await self._run(handle_scheduler_stats, ms=self.ms)
+
+    async def autoscaler(self, **_):
+        return await self._run(handle_autoscaler_stats, ms=self.ms)
+
+    async def watchdog(self, **_):
+        return await self._run(handle_watchdog_stats, ms=self.ms)
+
+    async def latency(self, query: Dict, send, **_):
+        valid, window = await self._query_float(query, "window", None, send)
+        if valid:
+            return await self._run(handle_latency_stats, window=window, ms=self.ms)
+
+    async def metrics(self, send, **_):
+        body = (await self._run(handle_metrics, ms=self.ms)).encode("utf-8")
+        await send({"type": "http.response.start", "status": 200,
+                    "headers": [(b"content-type", b"text/plain; version=0.0.4; charset=utf-8"),
+                                (b"content-length", str(len(body)).encode("latin-1"))]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await self._run(self.ms.calculator_notifier.start)
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                self.executor.shutdown(wait=False)
+                self.wait_executor.shutdown(wait=False)
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        body = b""
+        while True:
+            message = await receive()
+            body += message.get("body", b"")
+            if not message.get("more_body", False):
+                return body
+
+    @staticmethod
+    async def _wait_disconnect(receive) -> None:
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    @staticmethod
+    async def _send_json(send, status: int, content) -> None:
+        body = json.dumps(content).encode("utf-8")
+        await send({"type": "http.response.start", "status": status,
+                    "headers": [(b"content-type", b"application/json"),
+                                (b"content-length", str(len(body)).encode("latin-1"))]})
+        await send({"type": "http.response.body", "body": body})
+
+
+def create_asgi_app(ms: CalculatorMicroservice) -> CalculatorASGI:
+    ms.calculator_db.create_table()
+    ms.calculator_db.migrate()
+    if ms.config.ROLE == "all":
+        run_calculator_qm_task(ms)
+    return CalculatorASGI(ms)
@@ -0,0 +1,44 @@
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Dict, List, Optional
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def latency_summary(latencies: List[float]) -> Dict[str, float]:
+    """Count and p50/p95/p99/max of the latencies in seconds, reported in milliseconds"""
+    if not latencies:
+        return {"count": 0, "p50_ms": None, "p95_ms": None, "p99_ms": None, "max_ms": None}
+    ordered = sorted(latencies)
+
+    def percentile(q: float) -> float:
+        return round(ordered[min(int(len(ordered) * q), len(ordered) - 1)] * 1e3, 3)
+
+    return {"count": len(ordered), "p50_ms": percentile(0.5), "p95_ms": percentile(0.95),
+            "p99_ms": percentile(0.99), "max_ms": round(ordered[-1] * 1e3, 3)}
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip() or None
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict:
+    """Commit and host the results are measured on, saved along with them for comparison"""
+    return {"commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "python": sys.version.split()[0],
+            "platform": platform.platform(), "cpus": os.cpu_count()}
+
+
+def save_results(results: Dict, path: str) -> None:
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
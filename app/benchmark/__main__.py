@@ -0,0 +1,75 @@
+import argparse
+import os
+from typing import Dict
+
+from app.benchmark import environment, save_results
+from app.benchmark.components import benchmark_components
+from app.benchmark.load import LoadTest, start_server, parse_mix
+from app.server import servers
+from app.util.ipc_queue import transports
+from app.util.logger import logger
+
+
+def run_load(args) -> Dict:
+    if args.url:
+        return LoadTest(args.url, requests=args.requests, concurrency=args.concurrency, mix=parse_mix(args.mix),
+                        inputs=args.inputs, seed=args.seed).run()
+    results = {}
+    for server in args.server.split(","):
+        with start_server(server, workers=args.workers) as base_url:
+            results[server] = LoadTest(base_url, requests=args.requests, concurrency=args.concurrency,
+                                       mix=parse_mix(args.mix), inputs=args.inputs, seed=args.seed).run()
+    return results
+
+
+if __name__ == "__main__":
+    usage = """
+    # Load test of the ASGI server and benchmarks of the queue transports, database and models
+    python3 -m app.benchmark
+
+    # Request mix of the load test against every server, 64 concurrent clients
+    python3 -m app.benchmark --suite load --server dev,wsgi,asgi --concurrency 64 --mix evaluate=1,status=4,result=1
+
+    # Load test of a service already running, the settings of the servers started by the benchmark are
+    # taken from the FLASK_MICROSERVICE_* environment variables
+    python3 -m app.benchmark --suite load --url http://localhost:5000/v1/calculator
+    """
+    parser = argparse.ArgumentParser(description='Calculator microservice load test and benchmarks', usage=usage)
+    parser.add_argument('--suite', choices=["all", "load", "components"], default="all",
+                        help='Load test of the HTTP API, benchmarks of the components in isolation or both')
+    parser.add_argument('--server', default="asgi",
+                        help=f'Comma separated servers started for the load test among [{",".join(servers)}]')
+    parser.add_argument('--workers', type=int, default=2, help='Pre-fork workers of the wsgi and asgi servers')
+    parser.add_argument('--url', default=None, help='Base url of a running service to load test instead')
+    parser.add_argument('--requests', type=int, default=2000, help='Requests of the load test')
+    parser.add_argument('--concurrency', type=int, default=32, help='Concurrent clients of the load test')
+    parser.add_argument('--mix', default="evaluate=1,status=3,result=1",
+                        help='Weights of the evaluate, status and result requests')
+    parser.add_argument('--inputs', type=int, default=None,
+                        help='Distinct inputs cycled through by the evaluations, every input distinct by default')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the request mix and inputs')
+    parser.add_argument('--transports', default=",".join(transports),
+                        help='Comma separated queue transports benchmarked')
+    parser.add_argument('--messages', type=int, default=2000, help='Messages per queue transport')
+    parser.add_argument('--iterations', type=int, default=2000, help='Iterations per database statement')
+    parser.add_argument('--model-iterations', type=int, default=10, help='Single input computations per engine')
+    parser.add_argument('--output', default=None,
+                        help='JSON file of the results, benchmark/<commit>.json by default')
+    args = parser.parse_args()
+    for server in args.server.split(","):
+        if server not in servers:
+            parser.error(f"Invalid server - {server}; available servers are [{','.join(servers)}]")
+    try:
+        parse_mix(args.mix)
+    except ValueError as e:
+        parser.error(str(e))
+
+    results = {"environment": environment(), "arguments": vars(args)}
+    if args.suite in ["all", "load"]:
+        results["load"] = run_load(args)
+    if args.suite in ["all", "components"]:
+        results["components"] = benchmark_components(args.transports.split(","), messages=args.messages,
+                                                     iterations=args.iterations, model_iterations=args.model_iterations)
+    output = args.output or os.path.join("benchmark", f"{results['environment']['commit'] or 'local'}.json")
+    save_results(results, output)
+    logger.info(f"Benchmark results are saved to {output}")
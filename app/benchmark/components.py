@@ -0,0 +1,124 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from multiprocessing import Queue
+from queue import Empty, Full
+from typing import Dict, List, Callable
+
+from app.benchmark import latency_summary
+from app.calculator.computation.database import CalculatorDatabase
+from app.calculator.computation.engine import create_engine, available_engines
+from app.calculator.computation.model import Model
+from app.config import Config
+from app.util.logger import logger
+from app.util.process_queue_manager import ProcessQueueManager
+
+
+def consumer(queue: Queue, received: multiprocessing.Value):
+    while queue:
+        try:
+            payload = json.loads(queue.get(block=True, timeout=5))
+        except Empty:
+            break
+        if payload["api"] == "terminate":
+            break
+        with received.get_lock():
+            received.value += 1
+
+
+def _timed(operation: Callable[[int], object], iterations: int) -> Dict:
+    latencies = []
+    start = time.perf_counter()
+    for i in range(iterations):
+        operation_start = time.perf_counter()
+        operation(i)
+        latencies.append(time.perf_counter() - operation_start)
+    elapsed = time.perf_counter() - start
+    return {**latency_summary(latencies), "ops_per_s": round(iterations / elapsed, 1)}
+
+
+def benchmark_queue(transport: str, messages: int = 2000, max_limit: int = 500) -> Dict:
+    """
+    Enqueue latency and throughput of the transport to a single consumer - messages are put without
+    blocking, those rejected by the full queue are counted and not retried
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        lease = {"database": os.path.join(tmp_dir, "queue.db")} if transport == "lease" else None
+        qm = ProcessQueueManager(service=f"benchmark-{transport}", parallelism=1, max_limit=max_limit,
+                                 queue_block_timeout=0, transport=transport, lease=lease)
+        received = multiprocessing.Value('i', 0)
+        latencies, rejected = [], 0
+        try:
+            qm.consumers(consumer, received)
+            message = json.dumps({"task_id": "benchmark", "api": "compute", "model": "sum_math_cos", "number": 0.5})
+            start = time.perf_counter()
+            for _ in range(messages):
+                enqueue_start = time.perf_counter()
+                try:
+                    qm.queue.put_nowait(message)
+                except Full:
+                    rejected += 1
+                    continue
+                latencies.append(time.perf_counter() - enqueue_start)
+            qm.queue.put(json.dumps({"task_id": "benchmark", "api": "terminate"}), block=True, timeout=30)
+            qm.processes[0].join(timeout=60)
+            elapsed = time.perf_counter() - start
+        finally:
+            qm.stop()
+    return {"messages": messages, "max_limit": max_limit, "received": received.value, "rejected": rejected,
+            "rejection_rate": round(rejected / messages, 4), "messages_per_s": round(received.value / elapsed, 1),
+            "enqueue": latency_summary(latencies)}
+
+
+def benchmark_database(iterations: int = 2000) -> Dict:
+    """Latency of the statements of a task lifecycle on a fresh database - insert, status lookup, update, result"""
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        config = Config()
+        config.DB_PATH = tmp_dir
+        db = CalculatorDatabase(config)
+        try:
+            db.create_table()
+            db.migrate()
+            message = json.dumps({"model": "sum_math_cos", "number": 0.5})
+            return {
+                "insert_json_message": _timed(
+                    lambda i: db.insert_json_message(task_id=f"task-{i}", json_message=message), iterations),
+                "get_status": _timed(lambda i: db.get_status(task_id=f"task-{i}"), iterations),
+                "update_status_output_message": _timed(
+                    lambda i: db.update_status_output_message(task_id=f"task-{i}", status="COMPLETED",
+                                                              status_message="COMPLETED", output=float(i)),
+                    iterations),
+                "get_result": _timed(lambda i: db.get_result(task_id=f"task-{i}"), iterations)
+            }
+        finally:
+            db.close()
+
+
+def benchmark_model(iterations: int = 10, batch_size: int = 16, engines: List[str] = None) -> Dict:
+    """Latency of a single input and per-input throughput of a batch, per compute engine"""
+    default_engine = Model.engine
+    results = {}
+    try:
+        for name in engines or available_engines():
+            Model.use_engine(create_engine(name))
+            single = _timed(lambda i: Model.compute_batch("sum_math_cos", [0.5 + i]), iterations)
+            batch = _timed(lambda i: Model.compute_batch("sum_math_cos", [0.5 + i + j for j in range(batch_size)]),
+                           max(iterations // batch_size, 1))
+            results[name] = {"single": single, "batch": {**batch, "batch_size": batch_size,
+                                                         "inputs_per_s": round(batch["ops_per_s"] * batch_size, 1)}}
+    finally:
+        Model.use_engine(default_engine)
+    return results
+
+
+def benchmark_components(transports: List[str], messages: int = 2000, iterations: int = 2000,
+                         model_iterations: int = 10) -> Dict:
+    results = {"queue": {}, "database": benchmark_database(iterations),
+               "model": benchmark_model(iterations=model_iterations)}
+    for transport in transports:
+        results["queue"][transport] = benchmark_queue(transport, messages)
+        logger.info(f"Benchmark queue {transport:>8}: {results['queue'][transport]['messages_per_s']} msg/s, "
+                    f"rejection rate {results['queue'][transport]['rejection_rate']}")
+    return results
@@ -0,0 +1,214 @@
+import json
+import os
+import random
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, List, Iterator, Optional
+
+from app.benchmark import ROOT_DIR, latency_summary
+from app.config import Config
+from app.util.logger import logger
+
+API_PREFIX = "/v1/calculator"
+# Endpoints driven by the load test, weighted by the request mix
+endpoints = ["evaluate", "status", "result"]
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def post(url: str, payload: dict, timeout: float = 30) -> dict:
+    req = urllib.request.Request(url, data=json.dumps(payload).encode(), method="POST",
+                                 headers={"Content-Type": "application/json"})
+    with urllib.request.urlopen(req, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def parse_mix(mix: str) -> Dict[str, int]:
+    """Request mix 'evaluate=1,status=3,result=1' to the weight of every endpoint"""
+    weights = {}
+    for item in mix.split(","):
+        endpoint, _, weight = item.partition("=")
+        endpoint = endpoint.strip()
+        if endpoint not in endpoints:
+            raise ValueError(f"Invalid endpoint - {endpoint}; available endpoints are [{','.join(endpoints)}]")
+        weights[endpoint] = int(weight or 1)
+    if sum(weights.values()) <= 0:
+        raise ValueError(f"Request mix {mix} has no request")
+    return weights
+
+
+@contextmanager
+def start_server(server: str, workers: int = 1, env: Dict[str, str] = None, timeout: float = 60) -> Iterator[str]:
+    """
+    Run manage.py with the server in a temporary directory, yields the base url of the API - the server runs
+    in its own session so that its consumers and manager are stopped along with it
+    """
+    port = free_port()
+    base_url = f"http://localhost:{port}{API_PREFIX}"
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        server_env = {**os.environ, "PYTHONPATH": ROOT_DIR, "FLASK_MICROSERVICE_PORT": str(port),
+                      "FLASK_MICROSERVICE_WORKERS": str(workers),
+                      "FLASK_MICROSERVICE_METRICS_DIR": os.path.join(tmp_dir, "metrics"), **(env or {})}
+        process = subprocess.Popen([sys.executable, os.path.join(ROOT_DIR, "manage.py"), "--server", server],
+                                   cwd=tmp_dir, env=server_env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                   start_new_session=True)
+        try:
+            deadline = time.monotonic() + timeout
+            while True:
+                try:
+                    urllib.request.urlopen(f"{base_url}/cache", timeout=1)
+                    break
+                except OSError:
+                    if process.poll() is not None or time.monotonic() > deadline:
+                        raise RuntimeError(f"{server} server is not started")
+                    time.sleep(0.2)
+            logger.info(f"Benchmark {server} server is started at {base_url}")
+            yield base_url
+        finally:
+            stop_server(process)
+
+
+def stop_server(process: subprocess.Popen) -> None:
+    try:
+        os.killpg(process.pid, signal.SIGTERM)
+        process.wait(timeout=30)
+    except ProcessLookupError:
+        pass
+    except subprocess.TimeoutExpired:
+        os.killpg(process.pid, signal.SIGKILL)
+    process.wait()
+
+
+class LoadTest:
+    """
+    Drive /evaluate, /status and /result of a running service from concurrent clients
+
+    The requests follow the proportions of the weighted mix in an order shuffled by a seeded generator so
+    that runs are reproducible, status and result requests ask for a task submitted earlier in the run.
+    Evaluations get a distinct input each unless inputs is set, then they cycle through that many inputs
+    and hit the result cache. Once the load is over the accepted tasks are polled until they are final, the
+    task throughput includes their computation.
+    """
+
+    def __init__(self, base_url: str, requests: int = 1000, concurrency: int = 16, mix: Dict[str, int] = None,
+                 inputs: Optional[int] = None, seed: int = 0, drain_timeout: float = 120):
+        self.base_url = base_url
+        self.requests = requests
+        self.concurrency = concurrency
+        self.mix = mix or {"evaluate": 1, "status": 3, "result": 1}
+        self.inputs = inputs
+        self.seed = seed
+        self.drain_timeout = drain_timeout
+        self._lock = threading.Lock()
+        self._latencies: Dict[str, List[float]] = {endpoint: [] for endpoint in self.mix}
+        self._errors: Counter = Counter()
+        self._evaluations: Counter = Counter()
+        self._task_ids: List[str] = []
+
+    def _call(self, endpoint: str, payload: dict) -> Optional[dict]:
+        start = time.perf_counter()
+        try:
+            response = post(f"{self.base_url}/{endpoint}", payload)
+        except (OSError, ValueError) as e:
+            logger.error(f"Benchmark request {endpoint} failed - {e}")
+            with self._lock:
+                self._errors[endpoint] += 1
+            return None
+        with self._lock:
+            self._latencies[endpoint].append(time.perf_counter() - start)
+        return response
+
+    def _evaluate(self, i: int) -> None:
+        number = (i % self.inputs) / self.inputs if self.inputs else self.seed + i / self.requests
+        response = self._call("evaluate", {"model": "sum_math_cos", "number": number})
+        if response is None:
+            return
+        if response["response"]["message"] == "queue-full":
+            outcome = "rejected"
+        else:
+            outcome = "accepted" if response["response"]["retcode"] == 0 else "failed"
+        with self._lock:
+            self._evaluations[outcome] += 1
+            if outcome == "accepted":
+                self._task_ids.append(response["task_id"])
+
+    def _request(self, i: int, endpoint: str) -> None:
+        if endpoint == "evaluate":
+            self._evaluate(i)
+            return
+        with self._lock:
+            task_id = random.Random(self.seed + i).choice(self._task_ids)
+        self._call(endpoint, {"task_id": task_id})
+
+    def _drain(self) -> Counter:
+        """Final status of the accepted tasks, polled until none of them is processing or the drain timeout"""
+        deadline = time.monotonic() + self.drain_timeout
+        pending = list(self._task_ids)
+        statuses = Counter()
+        while pending:
+            still_pending = []
+            for offset in range(0, len(pending), Config.BATCH_MAX_ITEMS):
+                response = post(f"{self.base_url}/status_batch",
+                                {"task_ids": pending[offset:offset + Config.BATCH_MAX_ITEMS]})
+                for item in response["responses"]:
+                    if item["response"]["status"] == "PROCESSING":
+                        still_pending.append(item["task_id"])
+                    else:
+                        statuses[item["response"]["status"]] += 1
+            pending = still_pending
+            if pending and time.monotonic() > deadline:
+                logger.warning(f"Benchmark drain timed out with {len(pending)} tasks processing")
+                statuses["PROCESSING"] += len(pending)
+                break
+            if pending:
+                time.sleep(0.1)
+        return statuses
+
+    def run(self) -> Dict:
+        # Warm-up task, the status and result requests ask for it until the first evaluation is accepted
+        warm_up = post(f"{self.base_url}/evaluate", {"model": "sum_math_cos", "number": self.seed - 1})
+        post(f"{self.base_url}/result?wait=10", {"task_id": warm_up["task_id"]})
+        self._task_ids.append(warm_up["task_id"])
+
+        pattern = [endpoint for endpoint, weight in self.mix.items() for _ in range(weight)]
+        schedule = [pattern[i % len(pattern)] for i in range(self.requests)]
+        random.Random(self.seed).shuffle(schedule)
+        start = time.perf_counter()
+        with ThreadPoolExecutor(self.concurrency) as executor:
+            list(executor.map(self._request, range(self.requests), schedule))
+        elapsed = time.perf_counter() - start
+        self._task_ids.remove(warm_up["task_id"])
+        statuses = self._drain()
+        drained = time.perf_counter() - start
+
+        submitted = sum(self._evaluations.values()) + self._errors["evaluate"]
+        completed = statuses["COMPLETED"]
+        results = {
+            "target": self.base_url, "requests": self.requests, "concurrency": self.concurrency, "mix": self.mix,
+            "inputs": self.inputs, "seed": self.seed, "elapsed_s": round(elapsed, 3),
+            "requests_per_s": round(self.requests / elapsed, 1),
+            "endpoints": {endpoint: {**latency_summary(latencies), "errors": self._errors[endpoint]}
+                          for endpoint, latencies in self._latencies.items()},
+            "tasks": {"submitted": submitted, "accepted": self._evaluations["accepted"],
+                      "rejected": self._evaluations["rejected"], "failed": self._evaluations["failed"],
+                      "rejection_rate": round(self._evaluations["rejected"] / submitted, 4) if submitted else 0.0,
+                      "statuses": dict(statuses), "completed": completed, "drain_s": round(drained - elapsed, 3),
+                      "tasks_per_s": round(completed / drained, 1)}
+        }
+        logger.info(f"Benchmark load of {self.requests} requests ({self.concurrency} clients): "
+                    f"{results['requests_per_s']} req/s, {results['tasks']['tasks_per_s']} tasks/s, "
+                    f"rejection rate {results['tasks']['rejection_rate']}")
+        return results
@@ -1,43 +1,194 @@
 import json
+import time
 import uuid
+from queue import Full
 from sqlite3 import Error as SQLiteError
-from typing import Dict
+from typing import Dict, List, Iterator, Optional
 
 import app
 from app import CalculatorMicroservice, ProcessQueueManager
-from app.calculator.model.model import Response, Result, CommonResponse
+from app.calculator.computation.lifecycle import now_ms, wall_ms
+from app.calculator.computation.model import Model
+from app.calculator.model.model import Response, Result, CommonResponse, BatchResponse, BatchResult
+from app.util.ipc_queue import MessageTooLarge
 from app.util.logger import logger
+from app.util.metrics import registry
+
+REQUEST_SECONDS = registry.histogram("http_request_duration_seconds", "Time to serve a request per endpoint",
+                                     ["method", "endpoint", "status"])
+QUEUE_DEPTH = registry.gauge("calculator_queue_depth", "Messages waiting on the process queue")
+CONSUMER_WORKERS = registry.gauge("calculator_consumer_workers", "Consumer processes")
+
+
+def _retcode(status: str) -> int:
+    """Results of the tasks completed or still running succeed, failed, errored, cancelled and unknown ones do not"""
+    return 0 if status in ("COMPLETED", "PROCESSING") else 1
 
 
 def handle_evaluate(data: Dict, ms: CalculatorMicroservice = app.calculator_ms) -> Response:
+    accepted = now_ms()
     qm = ms.calculator_qm
     db = ms.calculator_db
+    cache = ms.calculator_cache
     data["api"] = "compute"
     task_id = str(uuid.uuid4())
     data["task_id"] = task_id
     logger.info(f"Computation API [evaluate] request task_id={data['task_id']}")
+    cache_key = cache.key(data.get("model"), data.get("number"))
+    output = cache.get(cache_key)
+    if output is not None:
+        # Identical computation has been completed before, skip the queue
+        try:
+            db.insert_completed_json_message(task_id=task_id, json_message=json.dumps(data), output=output)
+        except SQLiteError as e:
+            msg = f"Failed to persist cached result to database - {str(e)}"
+            logger.error(msg)
+            return Response(task_id=task_id, response=CommonResponse(
+                retcode=1, status="ERROR", message=msg))
+        return Response(task_id=task_id, response=CommonResponse(
+            retcode=0, status="COMPLETED", message="ok-cached"))
     if not qm.is_full():
         # Persist message into database
+        leader_task_id = task_id
         try:
-            db.insert_json_message(task_id=task_id, json_message=json.dumps(data))
+            if ms.config.COALESCE_INFLIGHT and cache_key is not None:
+                leader_task_id = db.insert_coalesced_json_message(task_id=task_id, json_message=json.dumps(data),
+                                                                  cache_key=cache_key)
+            else:
+                db.insert_json_message(task_id=task_id, json_message=json.dumps(data))
         except SQLiteError as e:
             msg = f"Failed to persist input message to database - {str(e)}"
             logger.error(msg)
             return Response(task_id=task_id, response=CommonResponse(
                 retcode=1, status="ERROR", message=msg))
-        qm.enqueue(json.dumps(data))
+        if leader_task_id != task_id:
+            # Identical computation is in progress, its result will be fanned out to this task
+            logger.info(f"Computation API [evaluate] task_id={task_id} coalesced into task_id={leader_task_id}")
+            return Response(task_id=task_id, response=CommonResponse(
+                retcode=0, status="PROCESSING", message="ok-coalesced"))
+        try:
+            shards = _enqueue_compute(data, ms, accepted)
+        except (Full, MessageTooLarge) as e:
+            reason = _enqueue_failure(e)
+            try:
+                ms.calculator_notifier.publish(
+                    db.update_status_output_message(task_id=task_id, status="FAILED", status_message=reason,
+                                                    output=-1.0))
+            except SQLiteError as e:
+                logger.error(f"Failed to mark task_id={task_id} as failed - {str(e)}")
+            return Response(task_id=task_id, response=CommonResponse(
+                retcode=1, status="FAILED", message=reason))
         return Response(task_id=task_id, response=CommonResponse(
-            retcode=0, status="PROCESSING", message="ok-queued"))
+            retcode=0, status="PROCESSING", message="ok-sharded" if shards > 1 else "ok-queued"))
     else:
         return Response(task_id=task_id, response=CommonResponse(
             retcode=1, status="FAILED", message="queue-full"))
 
 
-def handle_status(task_id: str, ms: CalculatorMicroservice = app.calculator_ms) -> Response:
+def _enqueue_failure(e: Exception) -> str:
+    """Status message of a task whose computation has not been enqueued"""
+    return "message-too-large" if isinstance(e, MessageTooLarge) else "queue-full"
+
+
+def _enqueue_compute(data: Dict, ms: CalculatorMicroservice, accepted: int) -> int:
+    """
+    Enqueue the computation, scattered as range shards over the consumers if the model is decomposable
+    and the queue is idle enough for the shards to run in parallel; returns the number of messages
+    """
+    # Lifecycle stamps travel with the queued message only, the persisted message is replayed without them
+    data = {**data, "timestamps": {"accepted": accepted, "enqueued": now_ms()}}
+    qm = ms.calculator_qm
+    config = ms.config
+    shards = config.SHARD_COUNT or config.CONSUMER_PARALLELISM
+    model_name = data.get("model")
+    sharded = config.SHARDING_ENABLED and shards > 1 and model_name in Model.range_model_mapping \
+        and qm.qsize() < config.CONSUMER_PARALLELISM
+    try:
+        int(data.get("number"))
+    except (TypeError, ValueError):
+        # Invalid input is reported by the consumer as for any other computation
+        sharded = False
+    if not sharded:
+        qm.enqueue(json.dumps(data))
+        return 1
+    for shard, (start, stop) in enumerate(Model.shard_ranges(model_name, shards)):
+        qm.enqueue(json.dumps({**data, "api": "compute_shard", "shard": shard, "shards": shards,
+                               "start": start, "stop": stop}))
+    return shards
+
+
+def handle_evaluate_batch(data: Dict, ms: CalculatorMicroservice = app.calculator_ms) -> BatchResponse:
+    accepted = now_ms()
+    qm = ms.calculator_qm
     db = ms.calculator_db
+    cache = ms.calculator_cache
+    config = ms.config
+    items = data.get("items") or []
+    logger.info(f"Computation API [evaluate_batch] request of {len(items)} items")
+    if len(items) > config.BATCH_MAX_ITEMS:
+        return BatchResponse(response=CommonResponse(
+            retcode=1, status="FAILED", message=f"batch-too-large; at most {config.BATCH_MAX_ITEMS} items"))
+    if qm.is_full():
+        return BatchResponse(response=CommonResponse(retcode=1, status="FAILED", message="queue-full"))
+    # Scheduling fields are shared by the whole batch
+    scheduling = {key: data[key] for key in ["priority", "tenant"] if data.get(key) is not None}
+    messages, rows = [], []
+    for item in items:
+        message = {"model": item.get("model"), "number": item.get("number"), **scheduling,
+                   "api": "compute", "task_id": str(uuid.uuid4())}
+        cache_key = cache.key(message["model"], message["number"])
+        messages.append(message)
+        rows.append((message["task_id"], json.dumps(message), cache_key, cache.get(cache_key)))
+    # Persist all messages into database in one transaction
+    try:
+        leader_task_ids = db.insert_json_messages(rows=rows, coalesce=config.COALESCE_INFLIGHT)
+    except SQLiteError as e:
+        msg = f"Failed to persist input messages to database - {str(e)}"
+        logger.error(msg)
+        return BatchResponse(response=CommonResponse(retcode=1, status="ERROR", message=msg))
+
+    statuses = {}
+    queued: List[dict] = []
+    for message, row, leader_task_id in zip(messages, rows, leader_task_ids):
+        if row[3] is not None:
+            statuses[message["task_id"]] = ("COMPLETED", "ok-cached")
+        elif leader_task_id != message["task_id"]:
+            statuses[message["task_id"]] = ("PROCESSING", "ok-coalesced")
+        else:
+            statuses[message["task_id"]] = ("PROCESSING", "ok-queued")
+            queued.append(message)
+    # Enqueue the items to compute as a few chunked messages
+    failed = []
+    for i in range(0, len(queued), config.BATCH_CHUNK_SIZE):
+        chunk = queued[i:i + config.BATCH_CHUNK_SIZE]
+        try:
+            qm.enqueue(json.dumps({"api": "compute_batch", "task_id": chunk[0]["task_id"], **scheduling,
+                                   "timestamps": {"accepted": accepted, "enqueued": now_ms()},
+                                   "items": [{key: message[key] for key in ["task_id", "model", "number"]}
+                                             for message in chunk]}))
+        except (Full, MessageTooLarge) as e:
+            failed.extend((message["task_id"], _enqueue_failure(e)) for message in chunk)
+    if failed:
+        updated = [(task_id, "FAILED", reason, -1.0) for task_id, reason in failed]
+        try:
+            # Coalesced followers of the failed items, of this batch or not, fail along with them
+            updated = db.update_status_output_messages(rows=updated)
+            ms.calculator_notifier.publish(updated)
+        except SQLiteError as e:
+            logger.error(f"Failed to mark {len(failed)} items as failed - {str(e)}")
+        for task_id, status, status_message, _ in updated:
+            if task_id in statuses:
+                statuses[task_id] = (status, status_message)
+    responses = [Response(task_id=task_id, response=CommonResponse(
+        retcode=1 if status == "FAILED" else 0, status=status, message=message))
+        for task_id, (status, message) in statuses.items()]
+    return BatchResponse(response=CommonResponse(retcode=0, status="ok", message="ok"), responses=responses)
+
+
+def handle_status(task_id: str, ms: CalculatorMicroservice = app.calculator_ms) -> Response:
     logger.info(f"Computation API [status] request task_id={task_id}")
     try:
-        status, status_message = db.get_status(task_id=task_id)
+        status, _, status_message = ms.calculator_status_cache.get_result(task_id=task_id)
     except SQLiteError as e:
         return Response(task_id=task_id, response=CommonResponse(
             retcode=1, status="ERROR", message=str(e)))
@@ -45,19 +196,194 @@ def handle_status(task_id: str, ms: CalculatorMicroservice = app.calculator_ms)
         retcode=0, status=status, message=status_message))
 
 
-def handle_result(task_id: str, ms: CalculatorMicroservice = app.calculator_ms) -> Result:
+def handle_result(task_id: str, wait: float = 0, ms: CalculatorMicroservice = app.calculator_ms) -> Result:
+    """Long-poll up to `wait` seconds (bounded by RESULT_MAX_WAIT) for a task still PROCESSING"""
+    logger.info(f"Computation API [result] request task_id={task_id} wait={wait}")
+    wait = min(wait or 0, ms.config.RESULT_MAX_WAIT)
+    # Subscribe before reading the database so that a completion in between is not missed
+    with ms.calculator_notifier.subscribe([task_id] if wait > 0 else []) as subscription:
+        try:
+            status, output, status_message = ms.calculator_status_cache.get_result(task_id=task_id)
+        except SQLiteError as e:
+            return Result(task_id=task_id,
+                          response=CommonResponse(retcode=1, status="ERROR", message=str(e)),
+                          output=-1.0)
+        deadline = time.monotonic() + wait
+        # Consumers of the other replicas and worker pods only notify their own API processes, hence the polling
+        poll = ms.config.LEASE_POLL_INTERVAL if ms.config.QUEUE_TRANSPORT == "lease" else wait
+        while status == "PROCESSING" and time.monotonic() < deadline:
+            notice = subscription.get(timeout=min(poll, deadline - time.monotonic()))
+            if notice is not None:
+                _, status, status_message, output = notice
+            elif poll < wait:
+                try:
+                    status, output, status_message = ms.calculator_status_cache.get_result(task_id=task_id)
+                except SQLiteError as e:
+                    logger.error(f"Computation API [result] task_id={task_id} failed to re-read its result - {e}")
+                    break
+    return Result(task_id=task_id,
+                  response=CommonResponse(retcode=_retcode(status), status=status, message=status_message),
+                  output=output)
+
+
+def handle_status_batch(task_ids: List[str], ms: CalculatorMicroservice = app.calculator_ms) -> BatchResponse:
+    logger.info(f"Computation API [status_batch] request of {len(task_ids)} task_ids")
+    if len(task_ids) > ms.config.BATCH_MAX_ITEMS:
+        return BatchResponse(response=CommonResponse(
+            retcode=1, status="FAILED", message=f"batch-too-large; at most {ms.config.BATCH_MAX_ITEMS} items"))
+    try:
+        results = ms.calculator_status_cache.get_results(task_ids=task_ids)
+    except SQLiteError as e:
+        return BatchResponse(response=CommonResponse(retcode=1, status="ERROR", message=str(e)))
+    responses = []
+    for task_id in task_ids:
+        status, _, status_message = results.get(task_id, ("NOT FOUND", -1, "NOT FOUND"))
+        responses.append(Response(task_id=task_id, response=CommonResponse(
+            retcode=0, status=status, message=status_message)))
+    return BatchResponse(response=CommonResponse(retcode=0, status="ok", message="ok"), responses=responses)
+
+
+def handle_result_batch(task_ids: List[str], ms: CalculatorMicroservice = app.calculator_ms) -> BatchResult:
+    logger.info(f"Computation API [result_batch] request of {len(task_ids)} task_ids")
+    if len(task_ids) > ms.config.BATCH_MAX_ITEMS:
+        return BatchResult(response=CommonResponse(
+            retcode=1, status="FAILED", message=f"batch-too-large; at most {ms.config.BATCH_MAX_ITEMS} items"))
+    try:
+        results = ms.calculator_status_cache.get_results(task_ids=task_ids)
+    except SQLiteError as e:
+        return BatchResult(response=CommonResponse(retcode=1, status="ERROR", message=str(e)))
+    outputs = []
+    for task_id in task_ids:
+        status, output, status_message = results.get(task_id, ("NOT FOUND", -1, "NOT FOUND"))
+        outputs.append(Result(task_id=task_id,
+                              response=CommonResponse(retcode=_retcode(status), status=status,
+                                                      message=status_message),
+                              output=output))
+    return BatchResult(response=CommonResponse(retcode=0, status="ok", message="ok"), results=outputs)
+
+
+def handle_kill(task_id: str, ms: CalculatorMicroservice = app.calculator_ms) -> Response:
+    """
+    Cancel a task still PROCESSING - its queued messages are dropped and its running computations are
+    preempted by the consumers at their next chunk along with its shards, unless coalesced followers are
+    still waiting for them: the first follower is then promoted to leader and the computation goes on
+    """
     db = ms.calculator_db
-    logger.info(f"Computation API [result] request task_id={task_id}")
+    logger.info(f"Computation API [kill] request task_id={task_id}")
     try:
-        status, output, status_message = db.get_result(task_id=task_id)
+        status, status_message, updated, stopped = db.cancel_task(task_id=task_id)
     except SQLiteError as e:
-        return Result(task_id=task_id,
-                      response=CommonResponse(retcode=1, status="ERROR", message=str(e)),
-                      output=-1.0)
-    retcode = 1 if status == "ERROR" else 0
-    return Result(task_id=task_id,
-                  response=CommonResponse(retcode=retcode, status=status, message=status_message),
-                  output=output)
+        return Response(task_id=task_id, response=CommonResponse(retcode=1, status="ERROR", message=str(e)))
+    if not updated:
+        # Unknown task or final status already
+        return Response(task_id=task_id, response=CommonResponse(retcode=1, status=status, message=status_message))
+    # Status is committed before the consumers are signalled, a preempted computation never leaves it PROCESSING
+    ms.calculator_cancellation.cancel(stopped)
+    removed = ms.calculator_qm.remove(stopped) if stopped else 0
+    ms.calculator_notifier.publish(updated)
+    return Response(task_id=task_id, response=CommonResponse(
+        retcode=0, status="CANCELLED", message="ok-dequeued" if removed else "ok-cancelled"))
+
+
+def _status_event(task_id: str, status: str, status_message: str, output: Optional[float]) -> str:
+    data = json.dumps({"task_id": task_id, "status": status, "message": status_message, "output": output})
+    return f"event: status\ndata: {data}\n\n"
+
+
+def _completed(task_ids: List[str], ms: CalculatorMicroservice) -> Dict[str, tuple]:
+    """Final results of the task_ids, empty on a database error"""
+    try:
+        results = ms.calculator_status_cache.get_results(task_ids=task_ids)
+    except SQLiteError as e:
+        logger.error(f"Computation API [stream] failed to re-read {len(task_ids)} results - {e}")
+        return {}
+    return {task_id: result for task_id, result in results.items() if result[0] != "PROCESSING"}
+
+
+def handle_status_stream(task_ids: List[str], ms: CalculatorMicroservice = app.calculator_ms) -> Iterator[str]:
+    """
+    Server-sent events of the status transitions of the task_ids - the current status of every task first,
+    then one event per completion until all tasks are done or STREAM_TIMEOUT elapses
+    """
+    db = ms.calculator_db
+    config = ms.config
+    logger.info(f"Computation API [stream] request of {len(task_ids)} task_ids")
+    with ms.calculator_notifier.subscribe(task_ids) as subscription:
+        try:
+            results = db.get_results(task_ids=task_ids)
+        except SQLiteError as e:
+            yield f"event: error\ndata: {json.dumps({'message': str(e)})}\n\n"
+            return
+        pending = set()
+        for task_id in task_ids:
+            status, output, status_message = results.get(task_id, ("NOT FOUND", -1, "NOT FOUND"))
+            if status == "PROCESSING":
+                pending.add(task_id)
+                output = None
+            yield _status_event(task_id, status, status_message, output)
+        deadline = time.monotonic() + config.STREAM_TIMEOUT
+        while pending and time.monotonic() < deadline:
+            notice = subscription.get(timeout=min(deadline - time.monotonic(), config.STREAM_HEARTBEAT))
+            if notice is None:
+                # Comment line keeps the connection open through proxies
+                yield ": keep-alive\n\n"
+                if config.QUEUE_TRANSPORT == "lease":
+                    # Consumers of the other replicas only notify their own API processes
+                    for task_id, (status, output, status_message) in _completed(sorted(pending), ms).items():
+                        pending.discard(task_id)
+                        yield _status_event(task_id, status, status_message, output)
+                continue
+            pending.discard(notice[0])
+            yield _status_event(*notice)
+    yield f"event: end\ndata: {json.dumps({'pending': sorted(pending)})}\n\n"
+
+
+def handle_cache_stats(ms: CalculatorMicroservice = app.calculator_ms) -> Dict[str, int]:
+    logger.info(f"Computation API [cache] requested")
+    return ms.calculator_cache.stats()
+
+
+def handle_recovery_status(ms: CalculatorMicroservice = app.calculator_ms) -> Dict:
+    logger.info(f"Computation API [recovery] requested")
+    if not ms.calculator_recovery:
+        return {"state": "PENDING", "total": 0, "replayed": 0, "remaining": 0}
+    return ms.calculator_recovery.progress()
+
+
+def handle_scheduler_stats(ms: CalculatorMicroservice = app.calculator_ms) -> Dict:
+    logger.info(f"Computation API [scheduler] requested")
+    stats = ms.calculator_qm.scheduler_stats()
+    return {"queue_wait": stats.get("queue_wait", {}), "queued": stats.get("queued", {}),
+            "dequeued": stats.get("dequeued", {})}
+
+
+def handle_autoscaler_stats(ms: CalculatorMicroservice = app.calculator_ms) -> Dict:
+    logger.info(f"Computation API [autoscaler] requested")
+    return ms.calculator_qm.autoscaler_stats()
+
+
+def handle_watchdog_stats(ms: CalculatorMicroservice = app.calculator_ms) -> Dict:
+    logger.info(f"Computation API [watchdog] requested")
+    return ms.calculator_qm.watchdog_stats()
+
+
+def handle_latency_stats(window: float = None, ms: CalculatorMicroservice = app.calculator_ms) -> Dict:
+    """Latency percentiles (ms) per lifecycle stage of the tasks committed within the last window seconds"""
+    window = min(window or ms.config.LATENCY_WINDOW, ms.config.LATENCY_MAX_WINDOW)
+    logger.info(f"Computation API [latency] requested over {window}s")
+    try:
+        percentiles = ms.calculator_db.get_latency_percentiles(since_time=wall_ms() - int(window * 1000))
+    except SQLiteError as e:
+        return {"window": window, "stages": {}, "response": CommonResponse(retcode=1, status="ERROR", message=str(e))}
+    stages = {stage: {"samples": samples, "p50": p50, "p95": p95, "p99": p99, "max": max_ms}
+              for stage, (samples, p50, p95, p99, max_ms) in percentiles.items()}
+    return {"window": window, "stages": stages, "response": CommonResponse(retcode=0, status="ok", message="ok")}
+
+
+def handle_metrics(ms: CalculatorMicroservice = app.calculator_ms) -> str:
+    QUEUE_DEPTH.set(ms.calculator_qm.qsize())
+    CONSUMER_WORKERS.set(ms.calculator_qm.autoscaler_stats()["workers"])
+    return registry.render()
 
 
 def handle_terminate(qm: ProcessQueueManager) -> None:
@@ -0,0 +1,246 @@
+import hashlib
+import json
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlite3 import Error as SQLiteError
+from typing import Optional, Dict, List, Tuple
+
+from app.calculator.computation.database import CalculatorDatabase
+from app.calculator.computation.model import Model
+from app.config import Config
+from app.util.completion_notifier import CompletionNotifier, Notice
+from app.util.logger import logger
+from app.util.metrics import registry
+
+STATUS_CACHE_REQUESTS = registry.counter("calculator_status_cache_requests_total",
+                                         "Task status lookups of the API processes per cache outcome", ["result"])
+
+# (status, output, status_message) of a task
+TaskResult = Tuple[str, float, str]
+
+
+class ResultCache:
+    """
+    Two-tier cache of completed computation outputs keyed on (model, number, model version)
+        - memory tier: bounded LRU, private to every process
+        - database tier: SQLite table shared by the API process and all consumer processes
+    Counters live in shared memory so that they aggregate the hits/misses of every process
+    """
+    __COUNTERS = ["memory_hits", "database_hits", "misses", "evictions"]
+
+    def __init__(self, config: Config, db: CalculatorDatabase):
+        self.enabled = config.RESULT_CACHE_ENABLED
+        self.max_size = config.RESULT_CACHE_SIZE
+        self.db = db
+        self._counters = multiprocessing.Array('q', len(self.__COUNTERS))
+        self._lru: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        logger.info(f"ResultCache with {self.max_size} memory entries initialized by Process-{os.getpid()}")
+
+    def __getstate__(self):
+        # Memory tier and thread lock are per process, only the shared counters are inherited
+        state = self.__dict__.copy()
+        del state["_lru"], state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(model: str, number) -> Optional[str]:
+        """Canonical hash of the computation input, None if the input cannot be cached"""
+        if model not in Model.model_mapping:
+            return None
+        try:
+            number = float(number)
+        except (TypeError, ValueError):
+            return None
+        canonical = json.dumps({"model": model, "number": number, "version": Model.model_version[model]},
+                               sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def get(self, cache_key: Optional[str]) -> Optional[float]:
+        if not self.enabled or cache_key is None:
+            return None
+        with self._lock:
+            if cache_key in self._lru:
+                self._lru.move_to_end(cache_key)
+                self._increment("memory_hits")
+                return self._lru[cache_key]
+        try:
+            output = self.db.get_cached_output(cache_key=cache_key)
+        except SQLiteError:
+            output = None
+        if output is None:
+            self._increment("misses")
+            return None
+        self._increment("database_hits")
+        self._put_memory(cache_key, output)
+        return output
+
+    def put(self, cache_key: Optional[str], model: str, output: float) -> None:
+        if not self.enabled or cache_key is None:
+            return
+        self._put_memory(cache_key, output)
+        try:
+            self.db.insert_cached_output(cache_key=cache_key, model=model, output=output)
+        except SQLiteError:
+            # Cache persistence is best effort, the computation result is stored regardless
+            pass
+
+    def put_many(self, items: List[Tuple[str, str, float]]) -> None:
+        """Cache a batch of (cache_key, model, output), persisted in one transaction"""
+        items = [item for item in items if item[0] is not None]
+        if not self.enabled or not items:
+            return
+        for cache_key, _, output in items:
+            self._put_memory(cache_key, output)
+        try:
+            self.db.insert_cached_outputs(rows=items)
+        except SQLiteError:
+            pass
+
+    def stats(self) -> Dict[str, int]:
+        with self._counters.get_lock():
+            stats = dict(zip(self.__COUNTERS, self._counters[:]))
+        stats["hits"] = stats["memory_hits"] + stats["database_hits"]
+        stats["memory_size"] = len(self._lru)
+        return stats
+
+    def _put_memory(self, cache_key: str, output: float) -> None:
+        with self._lock:
+            self._lru[cache_key] = output
+            self._lru.move_to_end(cache_key)
+            while len(self._lru) > self.max_size:
+                self._lru.popitem(last=False)
+                self._increment("evictions")
+
+    def _increment(self, counter: str) -> None:
+        with self._counters.get_lock():
+            self._counters[self.__COUNTERS.index(counter)] += 1
+
+
+class StatusCache:
+    """
+    Read-through cache of the task results looked up by the API process, private to every process
+        - final statuses are kept up to ttl seconds in a bounded LRU, they never change once committed
+        - PROCESSING and NOT FOUND are cached for negative_ttl seconds only
+    The consumers push every final status through the CompletionNotifier, so that a task polled while
+    PROCESSING is served its result from memory as soon as it is committed
+    """
+
+    def __init__(self, config: Config, db: CalculatorDatabase, notifier: CompletionNotifier):
+        self.enabled = config.STATUS_CACHE_ENABLED
+        self.max_size = config.STATUS_CACHE_SIZE
+        self.ttl = config.STATUS_CACHE_TTL
+        self.negative_ttl = config.STATUS_CACHE_NEGATIVE_TTL
+        self.db = db
+        self.notifier = notifier
+        self._pid: Optional[int] = None
+        self._lru: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._init_lock = threading.Lock()
+
+    @staticmethod
+    def is_final(status: str) -> bool:
+        return status not in ("PROCESSING", "NOT FOUND")
+
+    def _ensure_process(self) -> None:
+        if self._pid == os.getpid():
+            return
+        with self._init_lock:
+            if self._pid != os.getpid():
+                # Entries of the parent are not invalidated in a forked process, the notifier listener is per process
+                self._lru = OrderedDict()
+                self._lock = threading.Lock()
+                self.notifier.start()
+                self.notifier.observe(self._on_notices)
+                self._pid = os.getpid()
+                logger.info(f"StatusCache with {self.max_size} entries initialized by Process-{os.getpid()}")
+
+    def _get(self, task_id: str, now: float) -> Optional[TaskResult]:
+        entry = self._lru.get(task_id)
+        if entry is None:
+            return None
+        if entry[1] < now:
+            del self._lru[task_id]
+            return None
+        self._lru.move_to_end(task_id)
+        return entry[0]
+
+    def _put(self, task_id: str, result: TaskResult, now: float) -> None:
+        if self.is_final(result[0]):
+            expiry = now + self.ttl
+        else:
+            entry = self._lru.get(task_id)
+            if entry is not None and self.is_final(entry[0][0]):
+                # Read before the final status was pushed
+                return
+            expiry = now + self.negative_ttl
+        self._lru[task_id] = (result, expiry)
+        self._lru.move_to_end(task_id)
+        while len(self._lru) > self.max_size:
+            self._lru.popitem(last=False)
+
+    def get_result(self, task_id: str) -> TaskResult:
+        """Result of the task, its archived result once it has been pruned from the database"""
+        if not self.enabled:
+            return self._read(task_id)
+        self._ensure_process()
+        with self._lock:
+            cached = self._get(task_id, time.monotonic())
+        if cached is not None:
+            STATUS_CACHE_REQUESTS.inc(result="hit" if self.is_final(cached[0]) else "negative_hit")
+            return cached
+        STATUS_CACHE_REQUESTS.inc(result="miss")
+        result = self._read(task_id)
+        with self._lock:
+            self._put(task_id, result, time.monotonic())
+        return result
+
+    def get_results(self, task_ids: List[str]) -> Dict[str, TaskResult]:
+        """Batch of get_result in a single query for the misses, task_ids not found are left out"""
+        if not self.enabled:
+            return self.db.get_results(task_ids=task_ids)
+        self._ensure_process()
+        cached = {}
+        with self._lock:
+            now = time.monotonic()
+            for task_id in task_ids:
+                result = self._get(task_id, now)
+                if result is not None:
+                    cached[task_id] = result
+        misses = [task_id for task_id in task_ids if task_id not in cached]
+        STATUS_CACHE_REQUESTS.inc(len(cached), result="hit")
+        STATUS_CACHE_REQUESTS.inc(len(misses), result="miss")
+        results = self.db.get_results(task_ids=misses) if misses else {}
+        with self._lock:
+            now = time.monotonic()
+            for task_id in misses:
+                self._put(task_id, results.get(task_id, ("NOT FOUND", -1, "NOT FOUND")), now)
+        results.update(cached)
+        return {task_id: result for task_id, result in results.items() if result[0] != "NOT FOUND"}
+
+    def _read(self, task_id: str) -> TaskResult:
+        result = self.db.get_result(task_id=task_id)
+        if result[0] == "NOT FOUND":
+            # Pruned by the retention job
+            result = self.db.get_archived_result(task_id=task_id)
+        return result
+
+    def _on_notices(self, notices: List[Notice]) -> None:
+        with self._lock:
+            now = time.monotonic()
+            for task_id, status, status_message, output in notices:
+                if self.is_final(status):
+                    self._put(task_id, (status, output, status_message), now)
+                else:
+                    self._lru.pop(task_id, None)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": len(self._lru)}
@@ -1,16 +1,25 @@
 import functools
-import sqlite3
+import json
+import time
+import zlib
 from datetime import datetime
 from sqlite3 import Error as SQLiteError, Connection, Cursor
-from typing import Optional
+from typing import Optional, Sequence, List, Tuple, Iterator, Dict, Callable
 
+from app.calculator.computation.lifecycle import LifecycleRow, now_ms, wall_ms
+from app.calculator.computation.query import CalculatorQuery
 from app.config import Config
 from app.util.logger import logger
+from app.util.metrics import registry
+from app.util.sqlite_pool import SQLiteConnectionPool
+
+SQLITE_SECONDS = registry.histogram("calculator_sqlite_seconds",
+                                    "Time of a database method, connection acquire and commit included", ["method"])
+SQLITE_ERRORS = registry.counter("calculator_sqlite_errors_total", "Database methods failed", ["method"])
 
 
 class CalculatorDatabase:
-    __DB_PATH_VAR: str = "DB_PATH"
-    __DB_NAME_VAR: str = "DB_NAME"
+    __DB_POOL_VAR: str = "pool"
     __CLASSNAME: str = "CalculatorDatabase"
 
     def __init__(self, config: Config):
@@ -18,110 +27,418 @@ class CalculatorDatabase:
         self.DB_PATH = self.config.DB_PATH
         self.DB_NAME = self.config.CALCULATOR_SQLITE_DB_NAME
         self.TABLE_NAME = self.config.CALCULATOR_SQLITE_TABLE_NAME
+        self.query = CalculatorQuery(self.TABLE_NAME)
+        self.pool = SQLiteConnectionPool(f'{self.DB_PATH}/{self.DB_NAME}.db',
+                                         size=self.config.SQLITE_POOL_SIZE,
+                                         pragmas=self.config.SQLITE_PRAGMAS,
+                                         health_check_interval=self.config.SQLITE_POOL_HEALTH_CHECK_INTERVAL)
+        # Final tasks past their retention TTL, only used by the retention job and NOT FOUND lookups
+        self.ARCHIVE_DB_NAME = self.config.ARCHIVE_SQLITE_DB_NAME
+        self.archive_pool = SQLiteConnectionPool(f'{self.DB_PATH}/{self.ARCHIVE_DB_NAME}.db',
+                                                 size=1,
+                                                 pragmas=self.config.SQLITE_PRAGMAS,
+                                                 health_check_interval=self.config.SQLITE_POOL_HEALTH_CHECK_INTERVAL)
 
-    def _handle_sqlite_error(_func=None, *, db_path_var: str = __DB_PATH_VAR,
-                             db_name_var: str = __DB_NAME_VAR, msg: str = "DB issue"):
+    def _handle_sqlite_error(_func=None, *, db_pool_var: str = __DB_POOL_VAR, msg: str = "DB issue"):
         def error_wrapper(func):
             @functools.wraps(func)
             def wrapper(self, *args, **kwargs):
                 conn: Optional[Connection] = None
+                broken = False
+                start = time.perf_counter()
+                # Get runtime instance connection pool
+                pool: SQLiteConnectionPool = getattr(self, db_pool_var)
                 try:
-                    # Get runtime instance db_path & db_name
-                    db_path = getattr(self, db_path_var)
-                    db_name = getattr(self, db_name_var)
-                    conn = sqlite3.connect(f'{db_path}/{db_name}.db')
+                    conn = pool.acquire()
                     cur = conn.cursor()
                     result = func(self, *args, **kwargs, cur=cur)
                     conn.commit()
                     return result
                 except SQLiteError as e:
+                    SQLITE_ERRORS.inc(method=func.__name__)
                     logger.error(e, exc_info=True)
                     # rollback to the last commit
                     if conn:
-                        conn.rollback()
+                        try:
+                            conn.rollback()
+                        except SQLiteError:
+                            broken = True
                     raise SQLiteError(f"{msg} - {repr(e)}")
                 finally:
                     if conn:
-                        conn.close()
+                        pool.release(conn, discard=broken)
+                    SQLITE_SECONDS.observe(time.perf_counter() - start, method=func.__name__)
 
             return wrapper
 
         return error_wrapper(_func) if (_func) else error_wrapper
 
+    def close(self) -> None:
+        self.pool.close()
+        self.archive_pool.close()
+
     @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - execution error")
-    def execute(self, statement: str, cur: Cursor = None):
-        cur.execute(statement)
+    def execute(self, statement: str, parameters: Sequence = (), cur: Cursor = None):
+        cur.execute(statement, parameters)
         return cur.fetchall()
 
     @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - insert/update error in insert_message")
     def insert_json_message(self, task_id: str, json_message: str, cur: Cursor = None):
-        table = self.TABLE_NAME
-        cur.execute(f"""
-            INSERT INTO {table}(
-                task_id, event_time, json_message, status, status_message
-            ) 
-            VALUES ('{task_id}',{int(datetime.now().strftime('%s'))}, '{json_message}', 'PROCESSING', 'PROCESSING')
-            ON CONFLICT(task_id) DO 
-            UPDATE SET 
-            json_message = '{json_message}',
-            status = 'PROCESSING'
-        """)
+        cur.execute(self.query.INSERT_JSON_MESSAGE,
+                    (task_id, int(datetime.now().strftime('%s')), json_message))
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - insert/update error in insert_coalesced_json_message")
+    def insert_coalesced_json_message(self, task_id: str, json_message: str, cache_key: str,
+                                      cur: Cursor = None) -> str:
+        """
+        Persist the message and attach it to the in-flight computation of the same cache_key if any,
+        returns the leader task_id (the task_id itself if the message has to be computed)
+        """
+        cur.execute(self.query.INSERT_JSON_MESSAGE, (task_id, int(datetime.now().strftime('%s')), json_message))
+        return self._coalesce(task_id=task_id, cache_key=cache_key, cur=cur)
+
+    def _coalesce(self, task_id: str, cache_key: str, cur: Cursor) -> str:
+        query = self.query
+        cur.execute(query.RELEASE_STALE_LEADER, (cache_key,))
+        cur.execute(query.INSERT_LEADER, (cache_key, task_id))
+        leader_task_id = cur.execute(query.GET_LEADER, (cache_key,)).fetchone()[0]
+        if leader_task_id != task_id:
+            cur.execute(query.INSERT_FOLLOWER, (task_id, leader_task_id))
+        return leader_task_id
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - insert/update error in insert_json_messages")
+    def insert_json_messages(self, rows: List[Tuple[str, str, Optional[str], Optional[float]]],
+                             coalesce: bool = True, cur: Cursor = None) -> List[str]:
+        """
+        Batch of (task_id, json_message, cache_key, cached output) in one transaction - rows with a cached
+        output are stored as completed, the others are coalesced on their cache_key if enabled;
+        returns the leader task_id of every row as insert_coalesced_json_message
+        """
+        query = self.query
+        event_time = int(datetime.now().strftime('%s'))
+        leader_task_ids = []
+        for task_id, json_message, cache_key, output in rows:
+            if output is not None:
+                cur.execute(query.INSERT_COMPLETED_JSON_MESSAGE, (task_id, event_time, json_message, output))
+                leader_task_ids.append(task_id)
+                continue
+            cur.execute(query.INSERT_JSON_MESSAGE, (task_id, event_time, json_message))
+            if coalesce and cache_key is not None:
+                leader_task_ids.append(self._coalesce(task_id=task_id, cache_key=cache_key, cur=cur))
+            else:
+                leader_task_ids.append(task_id)
+        return leader_task_ids
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - insert error in insert_completed_json_message")
+    def insert_completed_json_message(self, task_id: str, json_message: str, output: float,
+                                      cur: Cursor = None) -> None:
+        cur.execute(self.query.INSERT_COMPLETED_JSON_MESSAGE,
+                    (task_id, int(datetime.now().strftime('%s')), json_message, output))
 
     @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - update error in update_status_output_message")
     def update_status_output_message(self, task_id: str, status: str, status_message: str,
-                                     output: float, cur: Cursor = None) -> None:
-        table = self.TABLE_NAME
-        cur.execute(f"""
-            UPDATE {table} 
-            SET status = '{status}', status_message = '{status_message}', output = {output}
-            WHERE task_id = '{task_id}'""")
+                                     output: float, cur: Cursor = None) -> List[Tuple[str, str, str, float]]:
+        """Returns the updated (task_id, status, status_message, output) of the task and its coalesced followers"""
+        return self._update_status_output_message(task_id, status, status_message, output, cur=cur)
+
+    def _update_status_output_message(self, task_id: str, status: str, status_message: str, output: float,
+                                      cur: Cursor) -> List[Tuple[str, str, str, float]]:
+        query = self.query
+        cur.execute(query.UPDATE_STATUS_OUTPUT_MESSAGE, (status, status_message, output, task_id))
+        if cur.rowcount == 0:
+            # Task is not PROCESSING anymore, e.g. cancelled in the meantime
+            return []
+        followers = [row[0] for row in cur.execute(query.GET_FOLLOWERS, (task_id,))]
+        # Fan the result out to the coalesced followers within the same transaction
+        cur.execute(query.UPDATE_FOLLOWERS_STATUS_OUTPUT_MESSAGE, (status, status_message, output, task_id))
+        cur.execute(query.DELETE_FOLLOWERS, (task_id,))
+        cur.execute(query.DELETE_LEADER, (task_id,))
+        return [(updated_task_id, status, status_message, output) for updated_task_id in [task_id, *followers]]
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - update error in update_status_output_messages")
+    def update_status_output_messages(self, rows: List[Tuple[str, str, str, float]],
+                                      lifecycle: List[LifecycleRow] = None,
+                                      cur: Cursor = None) -> List[Tuple[str, str, str, float]]:
+        """
+        Batch of update_status_output_message as (task_id, status, status_message, output) in one transaction,
+        along with the lifecycle of the computed tasks; returns the updated rows including the coalesced followers,
+        rows of the tasks not PROCESSING anymore are left out
+        """
+        query = self.query
+        # Computations of the cancelled leaders are committed for the followers promoted in their place
+        successors = self._successors([row[0] for row in rows], cur=cur)
+        rows = [(successors.get(task_id, task_id), *result) for task_id, *result in rows]
+        task_ids = json.dumps([row[0] for row in rows])
+        statuses = {row[0]: row[1] for row in cur.execute(query.GET_STATUSES, (task_ids,))}
+        rows = [row for row in rows if statuses.get(row[0]) == "PROCESSING"]
+        updated = list(rows)
+        for task_id, status, status_message, output in rows:
+            updated.extend((follower, status, status_message, output)
+                           for follower, in cur.execute(query.GET_FOLLOWERS, (task_id,)).fetchall())
+        parameters = [(status, status_message, output, task_id) for task_id, status, status_message, output in rows]
+        cur.executemany(query.UPDATE_STATUS_OUTPUT_MESSAGE, parameters)
+        cur.executemany(query.UPDATE_FOLLOWERS_STATUS_OUTPUT_MESSAGE, parameters)
+        cur.executemany(query.DELETE_FOLLOWERS, [(row[0],) for row in rows])
+        cur.executemany(query.DELETE_LEADER, [(row[0],) for row in rows])
+        if lifecycle:
+            lifecycle = [(successors.get(task_id, task_id), *stamps) for task_id, *stamps in lifecycle]
+            self._record_lifecycle([row for row in lifecycle if statuses.get(row[0]) == "PROCESSING"], cur=cur)
+        return updated
+
+    def _successors(self, task_ids: List[str], cur: Cursor) -> Dict[str, str]:
+        """Cancelled leaders among the task_ids -> follower promoted in their place"""
+        return dict(cur.execute(self.query.GET_SUCCESSORS, (json.dumps(task_ids),)).fetchall())
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - update error in cancel_task")
+    def cancel_task(self, task_id: str,
+                    cur: Cursor = None) -> Tuple[str, str, List[Tuple[str, str, str, float]], List[str]]:
+        """
+        Cancel a task still PROCESSING - a coalesced follower is detached from its leader, a leader with followers
+        hands its computation over to the first of them and a leader without followers is cancelled along with its
+        shards. Returns the status and status message before the cancellation ('NOT FOUND' if missing), the updated
+        rows as update_status_output_message, empty if not cancelled, and the task_ids of the computations to stop
+        """
+        query = self.query
+        row = cur.execute(query.GET_STATUS, (task_id,)).fetchone()
+        if row is None:
+            return "NOT FOUND", "NOT FOUND", [], []
+        if row[0] != "PROCESSING":
+            return row[0], row[1], [], []
+        cur.execute(query.DELETE_FOLLOWER, (task_id,))
+        if cur.rowcount:
+            # Leader keeps computing for the other tasks coalesced into it
+            cur.execute(query.UPDATE_STATUS_OUTPUT_MESSAGE, ("CANCELLED", "CANCELLED", -1.0, task_id))
+            return row[0], row[1], [(task_id, "CANCELLED", "CANCELLED", -1.0)], []
+        successor = cur.execute(query.GET_FOLLOWERS, (task_id,)).fetchone()
+        if successor is not None:
+            # Followers, and the leaders cancelled before, wait for the successor which inherits the computation,
+            # its leadership of the cache key and its shards
+            cur.execute(query.REPOINT_FOLLOWERS, (successor[0], task_id))
+            cur.execute(query.DELETE_FOLLOWER, (successor[0],))
+            cur.execute(query.INSERT_FOLLOWER, (task_id, successor[0]))
+            cur.execute(query.REPOINT_LEADER, (successor[0], task_id))
+            cur.execute(query.REPOINT_SHARDS, (successor[0], task_id))
+            cur.execute(query.UPDATE_STATUS_OUTPUT_MESSAGE, ("CANCELLED", "CANCELLED", -1.0, task_id))
+            return row[0], row[1], [(task_id, "CANCELLED", "CANCELLED", -1.0)], []
+        # Computation runs under the task_id, or under that of a leader cancelled before which handed it over
+        stopped = [task_id, *(redirected for redirected, in cur.execute(query.GET_REDIRECTED, (task_id,)).fetchall())]
+        cur.execute(query.DELETE_SHARDS, (task_id,))
+        return row[0], row[1], self._update_status_output_message(task_id, "CANCELLED", "CANCELLED", -1.0,
+                                                                  cur=cur), stopped
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - update error in report_shard")
+    def report_shard(self, task_id: str, shard: int, shard_count: int, status: str, status_message: str,
+                     output: float, combine: Callable[[List[float]], float], lifecycle: LifecycleRow = None,
+                     cur: Cursor = None) -> List[Tuple[str, str, str, float]]:
+        """
+        Record the partial output of a shard; the task is completed with the outputs of all shards combined in
+        shard order by the last reporter, or failed by the first failed shard. Returns the updated rows as
+        update_status_output_message, empty while shards are outstanding
+        """
+        query = self.query
+        # Shard of a cancelled leader is reported for the follower promoted in its place
+        task_id = self._successors([task_id], cur=cur).get(task_id, task_id)
+        row = cur.execute(query.GET_STATUS, (task_id,)).fetchone()
+        if row is None or row[0] != "PROCESSING":
+            # Task has been failed by another shard already
+            cur.execute(query.DELETE_SHARDS, (task_id,))
+            return []
+        if lifecycle:
+            # Shards are merged into the lifecycle of the task - first dequeue to last commit
+            self._record_lifecycle([lifecycle], cur=cur)
+        if status != "COMPLETED":
+            cur.execute(query.DELETE_SHARDS, (task_id,))
+            return self._update_status_output_message(task_id, status, status_message, output, cur=cur)
+        cur.execute(query.INSERT_SHARD, (task_id, shard, shard_count, output))
+        outputs = [row[0] for row in cur.execute(query.GET_SHARD_OUTPUTS, (task_id,))]
+        if len(outputs) < shard_count:
+            return []
+        cur.execute(query.DELETE_SHARDS, (task_id,))
+        return self._update_status_output_message(task_id, "COMPLETED", "COMPLETED", combine(outputs), cur=cur)
+
+    def _record_lifecycle(self, rows: List[LifecycleRow], cur: Cursor) -> None:
+        # Stamped within the result transaction, right before its commit
+        committed, committed_time = now_ms(), wall_ms()
+        cur.executemany(self.query.UPSERT_LIFECYCLE, [(task_id, committed_time, *stamps, committed)
+                                                      for task_id, *stamps in rows])
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - error while fetching records in get_latency_percentiles")
+    def get_latency_percentiles(self, since_time: int, cur: Cursor = None) -> Dict[str, Tuple[int, ...]]:
+        """(samples, p50, p95, p99, max) in ms per lifecycle stage of the tasks committed since the wall clock ms"""
+        return {row[0]: tuple(row[1:]) for row in cur.execute(self.query.GET_LATENCY_PERCENTILES, (since_time,))}
 
     @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - error while fetching records in get_json_messages")
     def get_json_messages(self, event_time: int, cur: Cursor = None) -> list:
-        table = self.TABLE_NAME
         rows = []
-        for row in cur.execute(f"""
-            SELECT 
-                json_message
-            FROM {table} 
-            WHERE event_time <= {event_time} and status = 'PROCESSING'
-        """):
+        for row in cur.execute(self.query.GET_JSON_MESSAGES, (event_time,)):
             rows.append(row[0])
         return rows
 
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - error while fetching records in get_json_message_page")
+    def get_json_message_page(self, event_time: int, after: Tuple[int, str], page_size: int,
+                              cur: Cursor = None) -> List[Tuple[int, str, str]]:
+        return cur.execute(self.query.GET_JSON_MESSAGE_PAGE, (event_time, *after, page_size)).fetchall()
+
+    def iter_json_messages(self, event_time: int, page_size: int) -> Iterator[str]:
+        """Stream the pending messages page by page, no connection is held in between pages"""
+        after = (-1, "")
+        while True:
+            rows = self.get_json_message_page(event_time=event_time, after=after, page_size=page_size)
+            for _, _, json_message in rows:
+                yield json_message
+            if len(rows) < page_size:
+                return
+            after = rows[-1][0], rows[-1][1]
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - error while counting records in count_json_messages")
+    def count_json_messages(self, event_time: int, cur: Cursor = None) -> int:
+        return cur.execute(self.query.COUNT_JSON_MESSAGES, (event_time,)).fetchone()[0]
+
     @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - error while fetching records in get_status")
     def get_status(self, task_id: str, cur: Cursor = None):
-        table = self.TABLE_NAME
-        for row in cur.execute(f"""
-            SELECT 
-                status, status_message 
-            FROM {table}
-            WHERE task_id = '{task_id}'
-        """):
+        for row in cur.execute(self.query.GET_STATUS, (task_id,)):
             return row[0], row[1]
         return "NOT FOUND", "NOT FOUND"
 
     @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - error while fetching records in get_result")
     def get_result(self, task_id: str, cur: Cursor = None):
-        table = self.TABLE_NAME
-        for row in cur.execute(f"""
-            SELECT 
-                status, output, status_message 
-            FROM {table}
-            WHERE task_id = '{task_id}'
-        """):
+        for row in cur.execute(self.query.GET_RESULT, (task_id,)):
+            return row[0], row[1], row[2]
+        return "NOT FOUND", -1, "NOT FOUND"
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - error while fetching records in get_statuses")
+    def get_statuses(self, task_ids: List[str], cur: Cursor = None) -> Dict[str, Tuple[str, str]]:
+        """Batch of get_status in a single query, task_ids not found are left out"""
+        return {row[0]: (row[1], row[2]) for row in cur.execute(self.query.GET_STATUSES, (json.dumps(task_ids),))}
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - error while fetching records in get_results")
+    def get_results(self, task_ids: List[str], cur: Cursor = None) -> Dict[str, Tuple[str, float, str]]:
+        """Batch of get_result in a single query, task_ids not found are left out"""
+        return {row[0]: (row[1], row[2], row[3])
+                for row in cur.execute(self.query.GET_RESULTS, (json.dumps(task_ids),))}
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - error while fetching records in get_pending_json_messages")
+    def get_pending_json_messages(self, task_ids: List[str], cur: Cursor = None) -> Dict[str, str]:
+        """
+        Persisted message of the tasks still PROCESSING in a single query, the other task_ids are left out - a
+        cancelled leader gets the message of the follower promoted in its place
+        """
+        successors = self._successors(task_ids, cur=cur)
+        pending = [successors.get(task_id, task_id) for task_id in task_ids]
+        messages = {row[0]: row[1]
+                    for row in cur.execute(self.query.GET_PENDING_JSON_MESSAGES, (json.dumps(pending),))}
+        return {task_id: messages[pending_id] for task_id, pending_id in zip(task_ids, pending)
+                if pending_id in messages}
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - error while fetching records in get_cancelled")
+    def get_cancelled(self, task_ids: List[str], cur: Cursor = None) -> List[str]:
+        """Task_ids cancelled whose computation is not handed over to a promoted follower"""
+        return [row[0] for row in cur.execute(self.query.GET_CANCELLED, (json.dumps(task_ids),))]
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - error while fetching records in get_event_times")
+    def get_event_times(self, task_ids: List[str], cur: Cursor = None) -> Dict[str, int]:
+        """Event time of the tasks in a single query, task_ids not found are left out"""
+        return {row[0]: row[1] for row in cur.execute(self.query.GET_EVENT_TIMES, (json.dumps(task_ids),))}
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - error while fetching records in get_cached_output")
+    def get_cached_output(self, cache_key: str, cur: Cursor = None) -> Optional[float]:
+        for row in cur.execute(self.query.GET_CACHED_OUTPUT, (cache_key,)):
+            return row[0]
+        return None
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - insert error in insert_cached_output")
+    def insert_cached_output(self, cache_key: str, model: str, output: float, cur: Cursor = None) -> None:
+        cur.execute(self.query.INSERT_CACHED_OUTPUT,
+                    (cache_key, model, output, int(datetime.now().strftime('%s'))))
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - migration error in migrate")
+    def migrate(self, cur: Cursor = None) -> List[str]:
+        """Apply the pending schema migrations idempotently, returns the names of the applied migrations"""
+        applied = []
+        cur.execute(self.query.CREATE_MIGRATION_TABLE)
+        for version, name, statements in self.query.MIGRATIONS:
+            # Claiming the version first serializes concurrent migrations on the database write lock
+            cur.execute(self.query.INSERT_MIGRATION, (version, name, int(datetime.now().strftime('%s'))))
+            if cur.rowcount == 0:
+                continue
+            for statement in statements:
+                cur.execute(statement)
+            applied.append(name)
+            logger.info(f"Migration {version} ({name}) is applied on {self.TABLE_NAME}")
+        return applied
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - insert error in insert_cached_outputs")
+    def insert_cached_outputs(self, rows: List[Tuple[str, str, float]], cur: Cursor = None) -> None:
+        """Batch of insert_cached_output as (cache_key, model, output) in one transaction"""
+        event_time = int(datetime.now().strftime('%s'))
+        cur.executemany(self.query.INSERT_CACHED_OUTPUT,
+                        [(cache_key, model, output, event_time) for cache_key, model, output in rows])
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - error while fetching records in get_expired_tasks")
+    def get_expired_tasks(self, event_time: int, limit: int, cur: Cursor = None) -> List[tuple]:
+        """Oldest final tasks older than event_time as (task_id, event_time, json_message, status, status_message,
+        output)"""
+        return cur.execute(self.query.GET_EXPIRED_TASKS, (event_time, limit)).fetchall()
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - delete error in delete_expired_tasks")
+    def delete_expired_tasks(self, task_ids: List[str], cur: Cursor = None) -> int:
+        """Prune archived tasks from the hot table, a task re-enqueued in the meantime is kept"""
+        cur.execute(self.query.DELETE_EXPIRED_TASKS, (json.dumps(task_ids),))
+        deleted = cur.rowcount
+        cur.execute(self.query.DELETE_EXPIRED_LIFECYCLE, (json.dumps(task_ids),))
+        return deleted
+
+    @_handle_sqlite_error(db_pool_var="archive_pool", msg=f"DB issue ({__CLASSNAME}) - insert error in archive_tasks")
+    def archive_tasks(self, rows: List[tuple], cur: Cursor = None) -> int:
+        """Store the rows of get_expired_tasks as one compressed batch of the archive database, returns its id"""
+        messages = zlib.compress(json.dumps({row[0]: row[2] for row in rows}).encode())
+        cur.execute(self.query.INSERT_ARCHIVE_BATCH, (int(datetime.now().strftime('%s')), rows[0][1], rows[-1][1],
+                                                      len(rows), messages))
+        batch_id = cur.lastrowid
+        cur.executemany(self.query.INSERT_ARCHIVED_TASK,
+                        [(task_id, batch_id, event_time, status, status_message, output)
+                         for task_id, event_time, _, status, status_message, output in rows])
+        return batch_id
+
+    @_handle_sqlite_error(db_pool_var="archive_pool",
+                          msg=f"DB issue ({__CLASSNAME}) - error while fetching records in get_archived_result")
+    def get_archived_result(self, task_id: str, cur: Cursor = None):
+        for row in cur.execute(self.query.GET_ARCHIVED_RESULT, (task_id,)):
             return row[0], row[1], row[2]
         return "NOT FOUND", -1, "NOT FOUND"
 
+    @_handle_sqlite_error(db_pool_var="archive_pool",
+                          msg=f"DB issue ({__CLASSNAME}) - error while fetching records in get_archived_json_message")
+    def get_archived_json_message(self, task_id: str, cur: Cursor = None) -> Optional[str]:
+        for row in cur.execute(self.query.GET_ARCHIVED_JSON_MESSAGES, (task_id,)):
+            return json.loads(zlib.decompress(row[0])).get(task_id)
+        return None
+
+    @_handle_sqlite_error(msg=f"DB issue ({__CLASSNAME}) - vacuum error in incremental_vacuum")
+    def incremental_vacuum(self, pages: int, cur: Cursor = None) -> Optional[int]:
+        """
+        Return up to `pages` free pages to the file system, None when the database is not in incremental
+        auto_vacuum mode (created before it was enabled, a one-off VACUUM converts it)
+        """
+        if cur.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return None
+        free_pages = cur.execute("PRAGMA freelist_count").fetchone()[0]
+        # The pragma frees one page per step, executescript steps it to the end - execute and fetchall stop
+        # after the first page on the Python versions which do not step statements without result columns
+        cur.executescript(f"PRAGMA incremental_vacuum({int(pages)});")
+        return free_pages - cur.execute("PRAGMA freelist_count").fetchone()[0]
+
+    @_handle_sqlite_error(db_pool_var="archive_pool", msg=f"DB issue ({__CLASSNAME}) - error in create_archive_table")
+    def create_archive_table(self, cur: Cursor = None) -> None:
+        cur.execute(self.query.CREATE_ARCHIVE_BATCH_TABLE)
+        cur.execute(self.query.CREATE_ARCHIVE_TABLE)
+
     def create_table(self):
-        table = self.TABLE_NAME
-        self.execute(f"""
-            CREATE TABLE IF NOT EXISTS {table} (
-                task_id TEXT PRIMARY KEY,
-                event_time INTEGER, 
-                json_message TEXT,
-                status TEXT,
-                status_message TEXT,
-                output FLOAT
-            )
-        """)
+        query = self.query
+        self.execute(query.CREATE_TABLE)
+        self.execute(query.CREATE_CACHE_TABLE)
+        self.execute(query.CREATE_INFLIGHT_TABLE)
+        self.execute(query.CREATE_FOLLOWER_TABLE)
+        self.execute(query.CREATE_FOLLOWER_LEADER_INDEX)
+        self.execute(query.CREATE_SHARD_TABLE)
+        self.create_archive_table()
@@ -0,0 +1,117 @@
+import importlib.util
+import math
+import time
+from typing import Dict, Callable, List, Optional
+
+from app.util.logger import logger
+
+
+class ComputationCancelled(Exception):
+    """Raised by the engine when the running computation has been cancelled"""
+    pass
+
+
+class ComputationTimeout(Exception):
+    """Raised by the engine when the running computation has exceeded its timeout"""
+    pass
+
+
+class ComputeEngine:
+    """Numerical backend of the calculator models, computing a model term range [start, stop)"""
+    name: str = None
+    # Cancellation flag of the running computation, checked between chunks - see Model.compute_batch;
+    # it may raise ComputationTimeout as well
+    cancelled: Optional[Callable[[], bool]] = None
+
+    def checkpoint(self) -> None:
+        if self.cancelled is not None and self.cancelled():
+            raise ComputationCancelled("CANCELLED")
+
+    def sum_math_cos(self, num: float, start: int, stop: int) -> float:
+        raise NotImplementedError
+
+    def sum_math_cos_batch(self, nums: List[float], start: int, stop: int) -> List[float]:
+        # Engines override it when evaluating several inputs at once is cheaper than one by one
+        return [self.sum_math_cos(num, start, stop) for num in nums]
+
+
+class PythonEngine(ComputeEngine):
+    """Reference engine - plain Python loop, chunked only to check for cancellation"""
+    name = "python"
+
+    def __init__(self, chunk_size: int = 2 ** 16):
+        self.chunk_size = chunk_size
+
+    def sum_math_cos(self, num: float, start: int, stop: int) -> float:
+        output = 0
+        for chunk_start in range(start, stop, self.chunk_size):
+            self.checkpoint()
+            for i in range(chunk_start, min(chunk_start + self.chunk_size, stop)):
+                output += math.cos(i * num * math.pi)
+        return output
+
+
+class NumpyEngine(ComputeEngine):
+    """Vectorized engine - memory is bounded by evaluating the term range chunk by chunk"""
+    name = "numpy"
+
+    def __init__(self, chunk_size: int = 2 ** 16):
+        # Imported lazily so that NumPy stays an optional dependency
+        import numpy
+        self.np = numpy
+        self.chunk_size = chunk_size
+
+    def sum_math_cos(self, num: float, start: int, stop: int) -> float:
+        np = self.np
+        output = 0.0
+        for chunk_start in range(start, stop, self.chunk_size):
+            self.checkpoint()
+            chunk_stop = min(chunk_start + self.chunk_size, stop)
+            i = np.arange(chunk_start, chunk_stop, dtype=np.float64)
+            # Same operation order as the reference loop: (i * num) * pi
+            output += float(np.cos(i * num * math.pi).sum())
+        return output
+
+
+def is_numpy_available() -> bool:
+    return importlib.util.find_spec("numpy") is not None
+
+
+engine_builders: Dict[str, Callable[[int], ComputeEngine]] = {
+    PythonEngine.name: lambda chunk_size: PythonEngine(chunk_size=chunk_size),
+    NumpyEngine.name: lambda chunk_size: NumpyEngine(chunk_size=chunk_size)
+}
+# Engine selected by 'auto' per chunk size - calibrated once per process and inherited by the forked consumers
+auto_selection: Dict[int, str] = {}
+
+
+def available_engines() -> List[str]:
+    return [name for name in engine_builders if name != NumpyEngine.name or is_numpy_available()]
+
+
+def _calibrate(engine: ComputeEngine, terms: int = 2 ** 14) -> float:
+    start = time.perf_counter()
+    engine.sum_math_cos(0.5, 0, terms)
+    return time.perf_counter() - start
+
+
+def create_engine(name: str = "auto", chunk_size: int = 2 ** 16) -> ComputeEngine:
+    """
+    Build the compute engine by name; 'auto' calibrates every available engine on a small
+    workload once per process and picks the fastest one
+    """
+    if name == "auto" and chunk_size in auto_selection:
+        return engine_builders[auto_selection[chunk_size]](chunk_size)
+    if name == "auto":
+        engines = [engine_builders[engine_name](chunk_size) for engine_name in available_engines()]
+        timings = {engine.name: _calibrate(engine) for engine in engines}
+        engine = min(engines, key=lambda e: timings[e.name])
+        auto_selection[chunk_size] = engine.name
+        logger.info(f"Compute engine '{engine.name}' is selected automatically - calibration {timings}")
+        return engine
+    if name not in engine_builders:
+        raise ValueError(f"Invalid compute engine - {name}; available engines are [{','.join(engine_builders)}]")
+    if name == NumpyEngine.name and not is_numpy_available():
+        logger.warning(f"Compute engine '{name}' is unavailable, falling back to '{PythonEngine.name}'")
+        name = PythonEngine.name
+    return engine_builders[name](chunk_size)
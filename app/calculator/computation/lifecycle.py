@@ -0,0 +1,26 @@
+import time
+from typing import Dict, Optional, Tuple
+
+# Lifecycle of a queued task, stamped by handle_evaluate (accepted, enqueued) and service.task (the rest)
+STAGES = ["accepted", "enqueued", "dequeued", "compute_start", "compute_end", "committed"]
+
+# (task_id, accepted, enqueued, dequeued, compute_start, compute_end) recorded along with the result
+LifecycleRow = Tuple[str, Optional[int], Optional[int], Optional[int], Optional[int], Optional[int]]
+
+
+def now_ms() -> int:
+    """
+    Monotonic clock in milliseconds - CLOCK_MONOTONIC is shared by all the processes of a host, so stamps
+    of the API and consumer processes are comparable, but not across restarts
+    """
+    return time.monotonic_ns() // 1_000_000
+
+
+def wall_ms() -> int:
+    return time.time_ns() // 1_000_000
+
+
+def lifecycle_row(task_id: str, timestamps: Dict[str, int], compute_start: Optional[int] = None,
+                  compute_end: Optional[int] = None) -> LifecycleRow:
+    return (task_id, timestamps.get("accepted"), timestamps.get("enqueued"), timestamps.get("dequeued"),
+            compute_start, compute_end)
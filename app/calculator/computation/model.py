@@ -1,14 +1,80 @@
-import math
-from typing import Dict, Callable
+from typing import Dict, Callable, List, Tuple, Optional
+
+from app.calculator.computation.engine import ComputeEngine, PythonEngine
 
 
 class Model:
+    # Engine is selected per process, see use_engine
+    engine: ComputeEngine = PythonEngine()
+
     def sum_math_cos(num: float):
-        output = 0
-        for i in range(10 ** 6):
-            output += math.cos(i * num * math.pi)
-        return output
+        return Model.engine.sum_math_cos(num, 0, 10 ** 6)
+
+    def sum_math_cos_batch(nums: List[float]):
+        return Model.engine.sum_math_cos_batch(nums, 0, 10 ** 6)
+
+    def sum_math_cos_range(num: float, start: int, stop: int):
+        return Model.engine.sum_math_cos(num, start, stop)
 
     model_mapping: Dict[str, Callable] = {
         sum_math_cos.__name__: sum_math_cos
     }
+
+    # Models able to evaluate a list of inputs in one call, see compute_batch
+    batch_model_mapping: Dict[str, Callable] = {
+        sum_math_cos.__name__: sum_math_cos_batch
+    }
+
+    # Decomposable models - a reduction over the independent terms [0, terms), computed by range shards
+    # and combined by sum, see shard_ranges and combine_shards
+    range_model_mapping: Dict[str, Tuple[Callable, int]] = {
+        sum_math_cos.__name__: (sum_math_cos_range, 10 ** 6)
+    }
+
+    # Bump the version whenever a model output changes, it invalidates the cached results
+    model_version: Dict[str, int] = {
+        sum_math_cos.__name__: 1
+    }
+
+    @staticmethod
+    def compute_batch(model_name: str, nums: List[float], cancelled: Optional[Callable[[], bool]] = None) \
+            -> List[float]:
+        """`cancelled` is checked between the chunks, ComputationCancelled is raised once it returns True"""
+        Model.engine.cancelled = cancelled
+        try:
+            batch_model = Model.batch_model_mapping.get(model_name, None)
+            if batch_model and len(nums) > 1:
+                return batch_model(nums=nums)
+            computation_model = Model.model_mapping[model_name]
+            return [computation_model(num=num) for num in nums]
+        finally:
+            Model.engine.cancelled = None
+
+    @staticmethod
+    def use_engine(engine: ComputeEngine) -> None:
+        Model.engine = engine
+
+    @staticmethod
+    def shard_ranges(model_name: str, shards: int) -> List[Tuple[int, int]]:
+        """Contiguous term ranges of the shards, deterministic for a given shard count"""
+        _, terms = Model.range_model_mapping[model_name]
+        bounds = [terms * i // shards for i in range(shards + 1)]
+        return [(bounds[i], bounds[i + 1]) for i in range(shards)]
+
+    @staticmethod
+    def compute_range(model_name: str, num: float, start: int, stop: int,
+                      cancelled: Optional[Callable[[], bool]] = None) -> float:
+        range_model, _ = Model.range_model_mapping[model_name]
+        Model.engine.cancelled = cancelled
+        try:
+            return range_model(num=num, start=start, stop=stop)
+        finally:
+            Model.engine.cancelled = None
+
+    @staticmethod
+    def combine_shards(model_name: str, partials: List[float]) -> float:
+        # Partials are always added in shard order so that the output does not depend on the completion order
+        output = 0.0
+        for partial in partials:
+            output += partial
+        return output
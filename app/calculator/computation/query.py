@@ -0,0 +1,383 @@
+class CalculatorQuery:
+    """
+    SQL text of the calculator tables, rendered once per table name
+
+    Every statement binds its values as parameters so that the statement text is constant and
+    the prepared statement is reused from the connection statement cache.
+    """
+
+    def __init__(self, table: str):
+        self.TABLE_NAME = table
+        self.CACHE_TABLE_NAME = f"{table}_result_cache"
+        self.INFLIGHT_TABLE_NAME = f"{table}_inflight"
+        self.FOLLOWER_TABLE_NAME = f"{table}_follower"
+        self.SHARD_TABLE_NAME = f"{table}_shard"
+        self.LIFECYCLE_TABLE_NAME = f"{table}_lifecycle"
+        self.MIGRATION_TABLE_NAME = f"{table}_schema_migration"
+        self.ARCHIVE_TABLE_NAME = f"{table}_archive"
+        self.ARCHIVE_BATCH_TABLE_NAME = f"{table}_archive_batch"
+        self.EXPIRY_INDEX_NAME = f"{table}_expiry_idx"
+        self.PENDING_INDEX_NAME = f"{table}_pending_idx"
+
+        # Computation table
+        self.CREATE_TABLE = f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                task_id TEXT PRIMARY KEY,
+                event_time INTEGER,
+                json_message TEXT,
+                status TEXT,
+                status_message TEXT,
+                output FLOAT
+            )
+        """
+        self.INSERT_JSON_MESSAGE = f"""
+            INSERT INTO {table}(
+                task_id, event_time, json_message, status, status_message
+            )
+            VALUES (?, ?, ?, 'PROCESSING', 'PROCESSING')
+            ON CONFLICT(task_id) DO
+            UPDATE SET
+            json_message = excluded.json_message,
+            status = 'PROCESSING'
+        """
+        self.INSERT_COMPLETED_JSON_MESSAGE = f"""
+            INSERT INTO {table}(
+                task_id, event_time, json_message, status, status_message, output
+            )
+            VALUES (?, ?, ?, 'COMPLETED', 'COMPLETED', ?)
+        """
+        # Only a task still PROCESSING reaches its final status - a result committed after the task has been
+        # cancelled (or failed by another shard) is discarded
+        self.UPDATE_STATUS_OUTPUT_MESSAGE = f"""
+            UPDATE {table}
+            SET status = ?, status_message = ?, output = ?
+            WHERE task_id = ? AND status = 'PROCESSING'
+        """
+        self.GET_JSON_MESSAGES = f"""
+            SELECT
+                json_message
+            FROM {table}
+            WHERE event_time <= ? and status = 'PROCESSING'
+            AND task_id NOT IN (SELECT task_id FROM {self.FOLLOWER_TABLE_NAME})
+        """
+        # Keyset pagination over the pending task index, ordered by (event_time, task_id)
+        self.GET_JSON_MESSAGE_PAGE = f"""
+            SELECT
+                event_time, task_id, json_message
+            FROM {table}
+            WHERE status = 'PROCESSING' AND event_time <= ? AND (event_time, task_id) > (?, ?)
+            AND task_id NOT IN (SELECT task_id FROM {self.FOLLOWER_TABLE_NAME})
+            ORDER BY event_time, task_id
+            LIMIT ?
+        """
+        self.COUNT_JSON_MESSAGES = f"""
+            SELECT
+                COUNT(*)
+            FROM {table}
+            WHERE event_time <= ? and status = 'PROCESSING'
+            AND task_id NOT IN (SELECT task_id FROM {self.FOLLOWER_TABLE_NAME})
+        """
+        # Lookups by the primary key, the planner picks the index
+        self.GET_STATUS = f"""
+            SELECT
+                status, status_message
+            FROM {table}
+            WHERE task_id = ?
+        """
+        self.GET_RESULT = f"""
+            SELECT
+                status, output, status_message
+            FROM {table}
+            WHERE task_id = ?
+        """
+        # Batch lookups bind the task_ids as one JSON array - constant statement text whatever the batch size
+        self.GET_STATUSES = f"""
+            SELECT
+                task_id, status, status_message
+            FROM {table}
+            WHERE task_id IN (SELECT value FROM json_each(?))
+        """
+        self.GET_RESULTS = f"""
+            SELECT
+                task_id, status, output, status_message
+            FROM {table}
+            WHERE task_id IN (SELECT value FROM json_each(?))
+        """
+        self.GET_PENDING_JSON_MESSAGES = f"""
+            SELECT
+                task_id, json_message
+            FROM {table}
+            WHERE task_id IN (SELECT value FROM json_each(?)) AND status = 'PROCESSING'
+        """
+        self.GET_EVENT_TIMES = f"""
+            SELECT
+                task_id, event_time
+            FROM {table}
+            WHERE task_id IN (SELECT value FROM json_each(?))
+        """
+
+        # Result cache table
+        self.CREATE_CACHE_TABLE = f"""
+            CREATE TABLE IF NOT EXISTS {self.CACHE_TABLE_NAME} (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT,
+                output FLOAT,
+                event_time INTEGER
+            )
+        """
+        self.GET_CACHED_OUTPUT = f"SELECT output FROM {self.CACHE_TABLE_NAME} WHERE cache_key = ?"
+        self.INSERT_CACHED_OUTPUT = f"""
+            INSERT OR IGNORE INTO {self.CACHE_TABLE_NAME}(
+                cache_key, model, output, event_time
+            )
+            VALUES (?, ?, ?, ?)
+        """
+
+        # In-flight coalescing tables
+        self.CREATE_INFLIGHT_TABLE = f"""
+            CREATE TABLE IF NOT EXISTS {self.INFLIGHT_TABLE_NAME} (
+                cache_key TEXT PRIMARY KEY,
+                leader_task_id TEXT
+            )
+        """
+        self.CREATE_FOLLOWER_TABLE = f"""
+            CREATE TABLE IF NOT EXISTS {self.FOLLOWER_TABLE_NAME} (
+                task_id TEXT PRIMARY KEY,
+                leader_task_id TEXT
+            )
+        """
+        self.CREATE_FOLLOWER_LEADER_INDEX = f"""
+            CREATE INDEX IF NOT EXISTS {self.FOLLOWER_TABLE_NAME}_leader_idx
+            ON {self.FOLLOWER_TABLE_NAME}(leader_task_id)
+        """
+        # Release leadership held by a task that is no longer processing
+        self.RELEASE_STALE_LEADER = f"""
+            DELETE FROM {self.INFLIGHT_TABLE_NAME}
+            WHERE cache_key = ? AND leader_task_id NOT IN (
+                SELECT task_id FROM {table} WHERE status = 'PROCESSING'
+            )
+        """
+        self.INSERT_LEADER = f"""
+            INSERT OR IGNORE INTO {self.INFLIGHT_TABLE_NAME}(cache_key, leader_task_id) VALUES (?, ?)
+        """
+        self.GET_LEADER = f"SELECT leader_task_id FROM {self.INFLIGHT_TABLE_NAME} WHERE cache_key = ?"
+        self.INSERT_FOLLOWER = f"""
+            INSERT OR REPLACE INTO {self.FOLLOWER_TABLE_NAME}(task_id, leader_task_id) VALUES (?, ?)
+        """
+        self.UPDATE_FOLLOWERS_STATUS_OUTPUT_MESSAGE = f"""
+            UPDATE {table}
+            SET status = ?, status_message = ?, output = ?
+            WHERE task_id IN (SELECT task_id FROM {self.FOLLOWER_TABLE_NAME} WHERE leader_task_id = ?)
+            AND status = 'PROCESSING'
+        """
+        # Followers still waiting for the result of the leader, in coalescing order
+        self.GET_FOLLOWERS = f"""
+            SELECT
+                follower.task_id
+            FROM {self.FOLLOWER_TABLE_NAME} AS follower JOIN {table} ON {table}.task_id = follower.task_id
+            WHERE follower.leader_task_id = ? AND {table}.status = 'PROCESSING'
+            ORDER BY follower.rowid
+        """
+        # A cancelled leader with followers hands its leadership over to the first of them: its computation keeps
+        # running under its task_id, redirected to the successor by a follower row of the cancelled leader
+        self.REPOINT_FOLLOWERS = f"UPDATE {self.FOLLOWER_TABLE_NAME} SET leader_task_id = ? WHERE leader_task_id = ?"
+        self.REPOINT_LEADER = f"UPDATE {self.INFLIGHT_TABLE_NAME} SET leader_task_id = ? WHERE leader_task_id = ?"
+        self.REPOINT_SHARDS = f"UPDATE {self.SHARD_TABLE_NAME} SET task_id = ? WHERE task_id = ?"
+        self.GET_SUCCESSORS = f"""
+            SELECT
+                follower.task_id, follower.leader_task_id
+            FROM {self.FOLLOWER_TABLE_NAME} AS follower JOIN {table} ON {table}.task_id = follower.task_id
+            WHERE follower.task_id IN (SELECT value FROM json_each(?)) AND {table}.status != 'PROCESSING'
+        """
+        self.GET_REDIRECTED = f"""
+            SELECT
+                follower.task_id
+            FROM {self.FOLLOWER_TABLE_NAME} AS follower JOIN {table} ON {table}.task_id = follower.task_id
+            WHERE follower.leader_task_id = ? AND {table}.status != 'PROCESSING'
+        """
+        # Cancelled tasks whose computation has no successor to run for
+        self.GET_CANCELLED = f"""
+            SELECT
+                task_id
+            FROM {table}
+            WHERE task_id IN (SELECT value FROM json_each(?)) AND status = 'CANCELLED'
+            AND task_id NOT IN (SELECT task_id FROM {self.FOLLOWER_TABLE_NAME})
+        """
+        self.DELETE_FOLLOWER = f"DELETE FROM {self.FOLLOWER_TABLE_NAME} WHERE task_id = ?"
+        self.DELETE_FOLLOWERS = f"DELETE FROM {self.FOLLOWER_TABLE_NAME} WHERE leader_task_id = ?"
+        self.DELETE_LEADER = f"DELETE FROM {self.INFLIGHT_TABLE_NAME} WHERE leader_task_id = ?"
+
+        # Map-reduce shards - partial outputs of a decomposable computation until all shards have reported
+        self.CREATE_SHARD_TABLE = f"""
+            CREATE TABLE IF NOT EXISTS {self.SHARD_TABLE_NAME} (
+                task_id TEXT,
+                shard INTEGER,
+                shard_count INTEGER,
+                output FLOAT,
+                PRIMARY KEY (task_id, shard)
+            )
+        """
+        self.INSERT_SHARD = f"""
+            INSERT OR REPLACE INTO {self.SHARD_TABLE_NAME}(task_id, shard, shard_count, output) VALUES (?, ?, ?, ?)
+        """
+        self.GET_SHARD_OUTPUTS = f"SELECT output FROM {self.SHARD_TABLE_NAME} WHERE task_id = ? ORDER BY shard"
+        self.DELETE_SHARDS = f"DELETE FROM {self.SHARD_TABLE_NAME} WHERE task_id = ?"
+
+        # Task lifecycle - monotonic milliseconds per stage (see lifecycle.STAGES), committed_time is the wall
+        # clock milliseconds of the commit for windowing; shards of a task are merged into one row
+        self.UPSERT_LIFECYCLE = f"""
+            INSERT INTO {self.LIFECYCLE_TABLE_NAME}(
+                task_id, committed_time, accepted, enqueued, dequeued, compute_start, compute_end, committed
+            )
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT(task_id) DO
+            UPDATE SET
+            committed_time = max(committed_time, excluded.committed_time),
+            accepted = coalesce(min(accepted, excluded.accepted), accepted, excluded.accepted),
+            enqueued = coalesce(min(enqueued, excluded.enqueued), enqueued, excluded.enqueued),
+            dequeued = coalesce(min(dequeued, excluded.dequeued), dequeued, excluded.dequeued),
+            compute_start = coalesce(min(compute_start, excluded.compute_start), compute_start,
+                                     excluded.compute_start),
+            compute_end = coalesce(max(compute_end, excluded.compute_end), compute_end, excluded.compute_end),
+            committed = max(committed, excluded.committed)
+        """
+        # Nearest-rank percentiles (ms) per stage of the tasks committed since a wall clock time, ranked by
+        # window functions; stamps taken across a restart give negative durations and are left out
+        self.GET_LATENCY_PERCENTILES = f"""
+            WITH lifecycle AS (
+                SELECT * FROM {self.LIFECYCLE_TABLE_NAME} WHERE committed_time >= ?
+            ), durations AS (
+                SELECT 'api' AS stage, enqueued - accepted AS duration FROM lifecycle
+                UNION ALL SELECT 'queue', dequeued - enqueued FROM lifecycle
+                UNION ALL SELECT 'dispatch', compute_start - dequeued FROM lifecycle
+                UNION ALL SELECT 'compute', compute_end - compute_start FROM lifecycle
+                UNION ALL SELECT 'commit', committed - compute_end FROM lifecycle
+                UNION ALL SELECT 'total', committed - accepted FROM lifecycle
+            ), ranked AS (
+                SELECT
+                    stage, duration,
+                    ROW_NUMBER() OVER (PARTITION BY stage ORDER BY duration) AS position,
+                    COUNT(*) OVER (PARTITION BY stage) AS samples
+                FROM durations
+                WHERE duration >= 0
+            )
+            SELECT
+                stage, samples,
+                MIN(CASE WHEN position >= 0.50 * samples THEN duration END) AS p50,
+                MIN(CASE WHEN position >= 0.95 * samples THEN duration END) AS p95,
+                MIN(CASE WHEN position >= 0.99 * samples THEN duration END) AS p99,
+                MAX(duration) AS max
+            FROM ranked
+            GROUP BY stage, samples
+        """
+
+        # Retention - final tasks past their TTL are moved to the archive database batch by batch, see RetentionJob
+        self.GET_EXPIRED_TASKS = f"""
+            SELECT
+                task_id, event_time, json_message, status, status_message, output
+            FROM {table}
+            WHERE status != 'PROCESSING' AND event_time < ?
+            ORDER BY event_time
+            LIMIT ?
+        """
+        self.DELETE_EXPIRED_TASKS = f"""
+            DELETE FROM {table}
+            WHERE task_id IN (SELECT value FROM json_each(?)) AND status != 'PROCESSING'
+        """
+        self.DELETE_EXPIRED_LIFECYCLE = f"""
+            DELETE FROM {self.LIFECYCLE_TABLE_NAME} WHERE task_id IN (SELECT value FROM json_each(?))
+        """
+
+        # Archive database - the messages of a batch are stored as one zlib compressed JSON object, the
+        # status and output of every task stay queryable
+        self.CREATE_ARCHIVE_BATCH_TABLE = f"""
+            CREATE TABLE IF NOT EXISTS {self.ARCHIVE_BATCH_TABLE_NAME} (
+                batch_id INTEGER PRIMARY KEY,
+                archived_time INTEGER,
+                first_event_time INTEGER,
+                last_event_time INTEGER,
+                task_count INTEGER,
+                json_messages BLOB
+            )
+        """
+        self.CREATE_ARCHIVE_TABLE = f"""
+            CREATE TABLE IF NOT EXISTS {self.ARCHIVE_TABLE_NAME} (
+                task_id TEXT PRIMARY KEY,
+                batch_id INTEGER,
+                event_time INTEGER,
+                status TEXT,
+                status_message TEXT,
+                output FLOAT
+            )
+        """
+        self.INSERT_ARCHIVE_BATCH = f"""
+            INSERT INTO {self.ARCHIVE_BATCH_TABLE_NAME}(
+                archived_time, first_event_time, last_event_time, task_count, json_messages
+            )
+            VALUES (?, ?, ?, ?, ?)
+        """
+        # Tasks archived again after an interrupted prune point to the latest batch
+        self.INSERT_ARCHIVED_TASK = f"""
+            INSERT OR REPLACE INTO {self.ARCHIVE_TABLE_NAME}(
+                task_id, batch_id, event_time, status, status_message, output
+            )
+            VALUES (?, ?, ?, ?, ?, ?)
+        """
+        self.GET_ARCHIVED_RESULT = f"""
+            SELECT status, output, status_message FROM {self.ARCHIVE_TABLE_NAME} WHERE task_id = ?
+        """
+        self.GET_ARCHIVED_JSON_MESSAGES = f"""
+            SELECT
+                json_messages
+            FROM {self.ARCHIVE_BATCH_TABLE_NAME}
+            WHERE batch_id = (SELECT batch_id FROM {self.ARCHIVE_TABLE_NAME} WHERE task_id = ?)
+        """
+
+        # Schema migrations - (version, name, statements) applied once in ascending version order
+        self.CREATE_MIGRATION_TABLE = f"""
+            CREATE TABLE IF NOT EXISTS {self.MIGRATION_TABLE_NAME} (
+                version INTEGER PRIMARY KEY,
+                name TEXT,
+                applied_time INTEGER
+            )
+        """
+        self.INSERT_MIGRATION = f"""
+            INSERT OR IGNORE INTO {self.MIGRATION_TABLE_NAME}(version, name, applied_time) VALUES (?, ?, ?)
+        """
+        self.MIGRATIONS = [
+            (1, "pending_task_index", [
+                # Partial index only holds the pending tasks scanned by the startup recovery, it does not copy
+                # their messages - the status lookups go through the primary key
+                f"""
+                CREATE INDEX IF NOT EXISTS {self.PENDING_INDEX_NAME}
+                ON {table}(event_time, task_id)
+                WHERE status = 'PROCESSING'
+                """
+            ]),
+            (2, "task_lifecycle_table", [
+                f"""
+                CREATE TABLE IF NOT EXISTS {self.LIFECYCLE_TABLE_NAME} (
+                    task_id TEXT PRIMARY KEY,
+                    committed_time INTEGER,
+                    accepted INTEGER,
+                    enqueued INTEGER,
+                    dequeued INTEGER,
+                    compute_start INTEGER,
+                    compute_end INTEGER,
+                    committed INTEGER
+                )
+                """,
+                f"""
+                CREATE INDEX IF NOT EXISTS {self.LIFECYCLE_TABLE_NAME}_committed_time_idx
+                ON {self.LIFECYCLE_TABLE_NAME}(committed_time)
+                """
+            ]),
+            (3, "expired_task_index", [
+                # Partial index only holds the final tasks scanned by the retention job
+                f"""
+                CREATE INDEX IF NOT EXISTS {self.EXPIRY_INDEX_NAME}
+                ON {table}(event_time)
+                WHERE status != 'PROCESSING'
+                """
+            ]),
+        ]
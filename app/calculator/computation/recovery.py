@@ -0,0 +1,140 @@
+import json
+import os
+import threading
+import time
+from queue import Full
+from sqlite3 import Error as SQLiteError
+from typing import Dict, List, Union
+
+from app.calculator.computation.database import CalculatorDatabase
+from app.util.ipc_queue import MessageTooLarge
+from app.util.logger import logger
+from app.util.process_queue_manager import ProcessQueueManager
+
+
+class StartupRecovery(threading.Thread):
+    """
+    Replay the tasks left PROCESSING by the previous run in a background thread
+
+    Pending messages are streamed page by page from the database and fed into the queue with
+    blocking puts, a full queue only slows the replay down (backpressure) instead of failing it.
+    """
+
+    def __init__(self, qm: ProcessQueueManager, db: CalculatorDatabase, event_time: int, page_size: int):
+        super().__init__(name="startup-recovery", daemon=True)
+        self.qm = qm
+        self.db = db
+        self.event_time = event_time
+        self.page_size = page_size
+        self.total = 0
+        self.replayed = 0
+        self.state = "PENDING"
+        self._stop_event = threading.Event()
+
+    def run(self) -> None:
+        self.state = "RUNNING"
+        try:
+            self.total = self.db.count_json_messages(event_time=self.event_time)
+            logger.info(f"Startup recovery of {self.total} tasks is started by Process-{os.getpid()}")
+            for message in self.db.iter_json_messages(event_time=self.event_time, page_size=self.page_size):
+                if not self._enqueue(message):
+                    self.state = "STOPPED"
+                    return
+                self.replayed += 1
+                if self.replayed % self.page_size == 0:
+                    logger.info(f"Startup recovery progress - replayed={self.replayed} remaining={self.remaining}")
+        except SQLiteError as e:
+            logger.error(f"Startup recovery failed - replayed={self.replayed} remaining={self.remaining} - {e}")
+            self.state = "ERROR"
+            return
+        self.state = "COMPLETED"
+        logger.info(f"Startup recovery is completed - replayed={self.replayed}")
+
+    def _enqueue(self, message: str) -> bool:
+        while not self._stop_event.is_set():
+            try:
+                self.qm.enqueue(message)
+                return True
+            except Full:
+                # Consumers are busy, retry until the queue drains
+                self._stop_event.wait(0.1)
+            except MessageTooLarge as e:
+                # Never fits in a slot of the queue, failed as the API does
+                logger.error(f"Startup recovery failed a message - {e}")
+                self.db.update_status_output_message(task_id=json.loads(message)["task_id"], status="FAILED",
+                                                     status_message="message-too-large", output=-1.0)
+                return True
+        return False
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    @property
+    def remaining(self) -> int:
+        return max(self.total - self.replayed, 0)
+
+    def progress(self) -> Dict[str, Union[str, int]]:
+        return {"state": self.state, "total": self.total, "replayed": self.replayed, "remaining": self.remaining}
+
+
+class LeaseRecovery(threading.Thread):
+    """
+    Re-enqueue the tasks left PROCESSING without any message in the lease queue, every interval seconds
+
+    Messages of a lease queue outlive the restarts so nothing is replayed at startup, but the task of a replica
+    which died between its insert and its put, or a message dropped along with a lost consumer, would stay
+    PROCESSING for good. Pending tasks older than age seconds are streamed page by page and only the ones no
+    replica has queued in the meantime are put back. Terminate messages of the replicas gone are pruned as well.
+    """
+
+    def __init__(self, qm: ProcessQueueManager, db: CalculatorDatabase, age: int, interval: float, page_size: int):
+        super().__init__(name="lease-recovery", daemon=True)
+        self.qm = qm
+        self.db = db
+        self.age = age
+        self.interval = interval
+        self.page_size = page_size
+        self.total = 0
+        self.replayed = 0
+        self.state = "PENDING"
+        self._stop_event = threading.Event()
+
+    def run_once(self) -> int:
+        """One scan of the pending tasks, returns the number of tasks re-enqueued"""
+        replayed = 0
+        page: List[str] = []
+        for message in self.db.iter_json_messages(event_time=int(time.time()) - self.age, page_size=self.page_size):
+            page.append(message)
+            if len(page) == self.page_size:
+                replayed += self.qm.queue.requeue(page)
+                page = []
+            self.total += 1
+        if page:
+            replayed += self.qm.queue.requeue(page)
+        self.replayed += replayed
+        pruned = self.qm.queue.prune()
+        if replayed or pruned:
+            logger.warning(f"Lease recovery re-enqueued {replayed} tasks and pruned {pruned} terminate messages "
+                           f"by Process-{os.getpid()}")
+        return replayed
+
+    def run(self) -> None:
+        self.state = "RUNNING"
+        logger.info(f"Lease recovery of the tasks older than {self.age}s is started by Process-{os.getpid()}")
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.run_once()
+            except SQLiteError as e:
+                # The next scan starts over
+                logger.error(f"Lease recovery failed by Process-{os.getpid()} - {e}")
+        self.state = "STOPPED"
+
+    def stop(self) -> None:
+        self._stop_event.set()
+
+    @property
+    def remaining(self) -> int:
+        return 0
+
+    def progress(self) -> Dict[str, Union[str, int]]:
+        return {"state": self.state, "total": self.total, "replayed": self.replayed, "remaining": self.remaining}
@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+from sqlite3 import Error as SQLiteError
+from typing import Dict, Union
+
+from app.calculator.computation.database import CalculatorDatabase
+from app.util.logger import logger
+from app.util.metrics import registry
+
+RETENTION_ARCHIVED = registry.counter("calculator_retention_archived_total",
+                                      "Final tasks moved from the hot table to the archive database")
+RETENTION_VACUUMED_PAGES = registry.counter("calculator_retention_vacuumed_pages_total",
+                                            "Free pages of the database returned to the file system")
+
+
+class RetentionJob(threading.Thread):
+    """
+    Archive the final tasks older than ttl seconds in a background thread
+
+    Every interval seconds the expired tasks are copied batch by batch to the archive database, then
+    pruned from the hot table, each batch in its own short write transaction with a pause in between so
+    that inserts of new tasks are never held behind the job. A batch is committed to the archive before
+    it is pruned, an interruption in between only archives it twice. The freed pages are returned to the
+    file system by steps of incremental vacuum.
+    """
+
+    def __init__(self, db: CalculatorDatabase, ttl: int, interval: float, batch_size: int, pause: float,
+                 vacuum_pages: int):
+        super().__init__(name="retention", daemon=True)
+        self.db = db
+        self.ttl = ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self.archived = 0
+        self.vacuumed_pages = 0
+        self.state = "PENDING"
+        self._stopped = threading.Event()
+        self._vacuum_warned = False
+
+    def archive(self, event_time: int) -> int:
+        """Move the final tasks older than event_time to the archive, returns the number of tasks pruned"""
+        pruned = 0
+        while not self._stopped.is_set():
+            rows = self.db.get_expired_tasks(event_time=event_time, limit=self.batch_size)
+            if not rows:
+                break
+            self.db.archive_tasks(rows)
+            deleted = self.db.delete_expired_tasks([row[0] for row in rows])
+            pruned += deleted
+            RETENTION_ARCHIVED.inc(deleted)
+            if len(rows) < self.batch_size:
+                break
+            self._stopped.wait(self.pause)
+        return pruned
+
+    def vacuum(self) -> int:
+        """Return the free pages to the file system, returns the number of pages"""
+        vacuumed = 0
+        while not self._stopped.is_set():
+            pages = self.db.incremental_vacuum(self.vacuum_pages)
+            if pages is None:
+                if not self._vacuum_warned:
+                    logger.warning(f"Database {self.db.DB_NAME} is not in incremental auto_vacuum mode, pruned pages "
+                                   f"are reused but the file does not shrink until a one-off VACUUM")
+                    self._vacuum_warned = True
+                break
+            vacuumed += pages
+            RETENTION_VACUUMED_PAGES.inc(pages)
+            if pages < self.vacuum_pages:
+                break
+            self._stopped.wait(self.pause)
+        return vacuumed
+
+    def run_once(self) -> Dict[str, int]:
+        event_time = int(time.time()) - self.ttl
+        archived = self.archive(event_time)
+        vacuumed = self.vacuum() if archived else 0
+        self.archived += archived
+        self.vacuumed_pages += vacuumed
+        logger.info(f"Retention archived {archived} tasks older than {event_time} and vacuumed {vacuumed} pages "
+                    f"by Process-{os.getpid()}")
+        return {"archived": archived, "vacuumed_pages": vacuumed}
+
+    def run(self) -> None:
+        self.state = "RUNNING"
+        logger.info(f"Retention of tasks older than {self.ttl}s is started by Process-{os.getpid()}")
+        while True:
+            try:
+                self.run_once()
+            except SQLiteError as e:
+                # The next run resumes from the oldest task left
+                logger.error(f"Retention failed by Process-{os.getpid()} - {e}")
+            if self._stopped.wait(self.interval):
+                break
+        self.state = "STOPPED"
+
+    def stop(self) -> None:
+        self._stopped.set()
+
+    def progress(self) -> Dict[str, Union[str, int]]:
+        return {"state": self.state, "archived": self.archived, "vacuumed_pages": self.vacuumed_pages}
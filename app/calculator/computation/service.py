@@ -1,62 +1,406 @@
+import functools
 import json
 import os
+import time
 from datetime import datetime
 from multiprocessing import Queue
-from queue import Empty
+from queue import Empty, Full
+from sqlite3 import Error as SQLiteError
+from typing import List, Dict, Tuple, Callable, Iterable, Optional
 
 from app import CalculatorMicroservice, Config
+from app.calculator.computation.cache import ResultCache
 from app.calculator.computation.database import CalculatorDatabase
+from app.calculator.computation.engine import create_engine, ComputationCancelled, ComputationTimeout
+from app.calculator.computation.lifecycle import LifecycleRow, lifecycle_row, now_ms
 from app.calculator.computation.model import Model
+from app.calculator.computation.recovery import StartupRecovery, LeaseRecovery
+from app.calculator.computation.retention import RetentionJob
+from app.util.cancellation import CancellationBoard
+from app.util.completion_notifier import CompletionNotifier
 from app.util.logger import logger
-from app.util.process_queue_manager import ProcessQueueManager
+from app.util.metrics import registry
+from app.util.lease_queue import LeaseQueue
+from app.util.process_queue_manager import ProcessQueueManager, QUEUE_DEQUEUE_SECONDS
+from app.util.watchdog import Heartbeat, WorkerHeartbeats
 
+COMPUTE_SECONDS = registry.histogram("calculator_compute_seconds",
+                                     "Time to compute a batch of inputs or a shard per model", ["model"])
+LOST_TASKS = registry.counter("calculator_lost_tasks_total",
+                              "In-flight tasks of lost consumers recovered by the watchdog", ["action"])
+TASK_SECONDS = registry.histogram("calculator_task_seconds",
+                                  "Time from the task event_time (second resolution) to its final status",
+                                  ["status"], buckets=(0.5, 1.0, 2.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0))
 
-def task(queue: Queue, db: CalculatorDatabase, config: Config):
-    def wrapper(data: dict):
-        if data["api"] == "compute":
-            try:
-                model_name = data.get("model")
-                num = int(data.get("number"))
-                computation_model = Model.model_mapping.get(model_name, None)
-                if not computation_model:
-                    model_names = ",".join(Model.model_mapping.keys())
-                    raise Exception(f"Invalid model - {model_name}; available models are [{model_names}]")
-                else:
-                    output = computation_model(num=num)
-                    db.update_status_output_message(task_id=data["task_id"],
-                                                    status="COMPLETED",
-                                                    status_message="COMPLETED",
-                                                    output=output)
-            except Exception as e:
-                db.update_status_output_message(task_id=data["task_id"],
-                                                status="ERROR",
-                                                status_message=str(e),
-                                                output=-1.0)
-        else:
-            logger.info("Unsupported api type")
+
+def _received(message: str) -> dict:
+    data = json.loads(message)
+    data.setdefault("timestamps", {})["dequeued"] = now_ms()
+    return data
+
+
+def _get_ready(queue: Queue) -> dict:
+    """Message ready on the queue, Empty otherwise - only the dequeue of a ready message is timed"""
+    start = time.perf_counter()
+    message = queue.get_nowait()
+    QUEUE_DEQUEUE_SECONDS.observe(time.perf_counter() - start)
+    return _received(message)
+
+
+def dequeue_batch(queue: Queue, config: Config) -> List[dict]:
+    """
+    Block for the first message, then drain up to CONSUMER_BATCH_SIZE messages for at most
+    CONSUMER_BATCH_WAIT_MS - a terminate message closes the batch, so does a shard message so that
+    the other shards of the task are left to the other consumers
+    """
+    try:
+        batch = [_get_ready(queue)]
+    except Empty:
+        batch = [_received(queue.get(block=True, timeout=config.QUEUE_BLOCK_TIMEOUT))]
+    deadline = time.monotonic() + config.CONSUMER_BATCH_WAIT_MS / 1000
+    while len(batch) < config.CONSUMER_BATCH_SIZE and batch[-1]["api"] not in ["terminate", "compute_shard"]:
+        try:
+            batch.append(_get_ready(queue))
+            continue
+        except Empty:
+            pass
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            batch.append(_received(queue.get(block=True, timeout=remaining)))
+        except Empty:
+            break
+    return batch
+
+
+def observe_task_seconds(db: CalculatorDatabase, updated: List[Tuple[str, str, str, float]]) -> None:
+    """End-to-end time of the tasks which have reached their final status"""
+    if not updated:
+        return
+    now = time.time()
+    statuses = {task_id: status for task_id, status, _, _ in updated}
+    for task_id, event_time in db.get_event_times(list(statuses)).items():
+        TASK_SECONDS.observe(max(now - event_time, 0.0), status=statuses[task_id])
+
+
+def compute_timeout(config: Config, model_name: str) -> float:
+    """Seconds per input before the computation of a model is failed"""
+    return config.MODEL_TIMEOUTS.get(model_name, config.COMPUTE_TIMEOUT)
+
+
+def interruption(task_ids: Iterable[str], timeout: Optional[float], cancellation: CancellationBoard = None,
+                 heartbeat: Heartbeat = None, db: CalculatorDatabase = None,
+                 poll_interval: float = None) -> Callable[[], bool]:
+    """
+    Check of the engine between chunks - beats, raises ComputationTimeout once the computation has run
+    for timeout seconds and returns True once all of its tasks have been cancelled, on the board or, every
+    poll_interval seconds, in the database shared with the API processes of other pods
+    """
+    task_ids = list(task_ids)
+    cancelled = cancellation.watcher(task_ids) if cancellation else None
+    deadline = time.monotonic() + timeout if timeout else None
+    next_poll = [time.monotonic() + poll_interval] if db and poll_interval else None
+
+    def cancelled_in_db() -> bool:
+        if next_poll is None or time.monotonic() < next_poll[0]:
+            return False
+        next_poll[0] = time.monotonic() + poll_interval
+        try:
+            cancelled_task_ids = db.get_cancelled(task_ids=task_ids)
+        except SQLiteError as e:
+            logger.error(f"Failed to check the cancellation of {len(task_ids)} tasks by Process-{os.getpid()} - {e}")
+            return False
+        return set(task_ids) <= set(cancelled_task_ids)
+
+    def interrupted() -> bool:
+        if heartbeat:
+            heartbeat.beat()
+        if deadline is not None and time.monotonic() > deadline:
+            raise ComputationTimeout(f"timeout; exceeded {timeout:g}s")
+        return (cancelled is not None and cancelled()) or cancelled_in_db()
+
+    return interrupted
+
+
+def cancellation_poll(config: Optional[Config]) -> Optional[float]:
+    """Interval of the database cancellation checks, only the lease transport is shared across pods"""
+    return config.CANCELLATION_POLL_INTERVAL if config and config.QUEUE_TRANSPORT == "lease" else None
+
+
+def compute_batch(payloads: List[dict], db: CalculatorDatabase, cache: ResultCache,
+                  notifier: CompletionNotifier = None, cancellation: CancellationBoard = None,
+                  config: Config = None, heartbeat: Heartbeat = None) -> None:
+    # (task_id, status, status_message, output) committed in a single transaction
+    results: List[Tuple[str, str, str, float]] = []
+    # model -> cache_key -> (num, task_ids), identical inputs of the batch are computed once
+    pending: Dict[str, Dict[str, Tuple[int, List[str]]]] = {}
+    timestamps: Dict[str, Dict[str, int]] = {data["task_id"]: data.get("timestamps", {}) for data in payloads}
+    lifecycle: List[LifecycleRow] = []
+    for data in payloads:
+        try:
+            model_name = data.get("model")
+            num = int(data.get("number"))
+            if model_name not in Model.model_mapping:
+                model_names = ",".join(Model.model_mapping.keys())
+                raise Exception(f"Invalid model - {model_name}; available models are [{model_names}]")
+        except Exception as e:
+            results.append((data["task_id"], "ERROR", str(e), -1.0))
+            lifecycle.append(lifecycle_row(data["task_id"], timestamps[data["task_id"]]))
+            continue
+        cache_key = cache.key(model_name, data.get("number"))
+        output = cache.get(cache_key)
+        if output is not None:
+            results.append((data["task_id"], "COMPLETED", "COMPLETED", output))
+            lifecycle.append(lifecycle_row(data["task_id"], timestamps[data["task_id"]]))
+            continue
+        inputs = pending.setdefault(model_name, {})
+        inputs.setdefault(cache_key or data["task_id"], (num, []))[1].append(data["task_id"])
+
+    cached_outputs: List[Tuple[str, str, float]] = []
+    for model_name, inputs in pending.items():
+        cache_keys = list(inputs.keys())
+        # Computation of the model group is preempted once all of its tasks have been cancelled,
+        # or failed once it has run for the timeout of all of its inputs
+        cancelled = interruption([task_id for cache_key in cache_keys for task_id in inputs[cache_key][1]],
+                                 compute_timeout(config, model_name) * len(cache_keys) if config else None,
+                                 cancellation, heartbeat, db, cancellation_poll(config))
+        compute_start = now_ms()
+        try:
+            with COMPUTE_SECONDS.time(model=model_name):
+                outputs = Model.compute_batch(model_name, [inputs[cache_key][0] for cache_key in cache_keys],
+                                              cancelled=cancelled)
+        except ComputationCancelled:
+            logger.info(f"Batch of {len(cache_keys)} {model_name} inputs is cancelled by Process-{os.getpid()}")
+            continue
+        except ComputationTimeout as e:
+            logger.warning(f"Batch of {len(cache_keys)} {model_name} inputs is failed ({e}) by Process-{os.getpid()}")
+            outputs = None
+            results.extend((task_id, "FAILED", str(e), -1.0)
+                           for cache_key in cache_keys for task_id in inputs[cache_key][1])
+        except Exception as e:
+            outputs = None
+            results.extend((task_id, "ERROR", str(e), -1.0)
+                           for cache_key in cache_keys for task_id in inputs[cache_key][1])
+        compute_end = now_ms()
+        lifecycle.extend(lifecycle_row(task_id, timestamps[task_id], compute_start, compute_end)
+                         for cache_key in cache_keys for task_id in inputs[cache_key][1])
+        if outputs is None:
+            continue
+        for cache_key, output in zip(cache_keys, outputs):
+            cached_outputs.append((cache_key, model_name, output))
+            results.extend((task_id, "COMPLETED", "COMPLETED", output) for task_id in inputs[cache_key][1])
+
+    cache.put_many(cached_outputs)
+    try:
+        updated = db.update_status_output_messages(rows=results, lifecycle=lifecycle)
+    except SQLiteError as e:
+        # Tasks stay PROCESSING and are replayed by the next startup recovery
+        logger.error(f"Failed to commit {len(results)} results by Process-{os.getpid()} - {e}")
+        return
+    if notifier:
+        # Published after the commit so that a notified waiter always reads the committed result
+        notifier.publish(updated)
+    try:
+        observe_task_seconds(db, updated)
+    except SQLiteError as e:
+        logger.error(f"Failed to read the event time of {len(updated)} tasks by Process-{os.getpid()} - {e}")
+
+
+def compute_shard(data: dict, db: CalculatorDatabase, cache: ResultCache, notifier: CompletionNotifier = None,
+                  cancellation: CancellationBoard = None, config: Config = None, heartbeat: Heartbeat = None) -> None:
+    model_name = data["model"]
+    cancelled = interruption([data["task_id"]], compute_timeout(config, model_name) if config else None,
+                             cancellation, heartbeat, db, cancellation_poll(config))
+    compute_start = now_ms()
+    try:
+        with COMPUTE_SECONDS.time(model=model_name):
+            output = Model.compute_range(model_name, int(data["number"]), data["start"], data["stop"],
+                                         cancelled=cancelled)
+        status, status_message = "COMPLETED", "COMPLETED"
+    except ComputationCancelled:
+        # Cancelled task has been marked CANCELLED and its shards dropped by the API already
+        logger.info(f"Shard {data['shard']} of task_id={data['task_id']} is cancelled by Process-{os.getpid()}")
+        return
+    except ComputationTimeout as e:
+        # First failed shard fails the task
+        output, status, status_message = -1.0, "FAILED", str(e)
+    except Exception as e:
+        output, status, status_message = -1.0, "ERROR", str(e)
+    lifecycle = lifecycle_row(data["task_id"], data.get("timestamps", {}), compute_start, now_ms())
+    try:
+        updated = db.report_shard(task_id=data["task_id"], shard=data["shard"], shard_count=data["shards"],
+                                  status=status, status_message=status_message, output=output,
+                                  combine=lambda outputs: Model.combine_shards(model_name, outputs),
+                                  lifecycle=lifecycle)
+    except SQLiteError as e:
+        # Task stays PROCESSING and is recomputed by the next startup recovery
+        logger.error(f"Failed to commit shard {data['shard']} of task_id={data['task_id']} "
+                     f"by Process-{os.getpid()} - {e}")
+        return
+    if updated:
+        logger.info(f"Shards of task_id={data['task_id']} are combined by Process-{os.getpid()}")
+        if updated[0][1] == "COMPLETED":
+            cache.put(cache.key(model_name, data["number"]), model_name, updated[0][3])
+        if notifier:
+            notifier.publish(updated)
+        try:
+            observe_task_seconds(db, updated)
+        except SQLiteError as e:
+            logger.error(f"Failed to read the event time of task_id={data['task_id']} by Process-{os.getpid()} - {e}")
+
+
+def skip_cancelled(payloads: List[dict], cancellation: CancellationBoard = None) -> List[dict]:
+    """Computations of the dequeued messages whose task has not been cancelled"""
+    if not cancellation:
+        return payloads
+    cancelled = cancellation.cancelled(payload["task_id"] for payload in payloads)
+    if cancelled:
+        logger.info(f"{len(cancelled)} cancelled tasks are skipped by Process-{os.getpid()}")
+    return [payload for payload in payloads if payload["task_id"] not in cancelled]
+
+
+def inflight_entry(payload: dict) -> list:
+    """In-flight record of a computation for the watchdog - [task_id, attempts] plus the range of a shard"""
+    entry = [payload["task_id"], payload.get("attempts", 0)]
+    if payload["api"] == "compute_shard":
+        entry.extend([payload["shard"], payload["shards"], payload["start"], payload["stop"]])
+    return entry
+
+
+def task(queue: Queue, db: CalculatorDatabase, config: Config, cache: ResultCache,
+         notifier: CompletionNotifier = None, cancellation: CancellationBoard = None,
+         heartbeats: WorkerHeartbeats = None):
+    Model.use_engine(create_engine(config.COMPUTE_ENGINE, config.COMPUTE_CHUNK_SIZE))
+    heartbeat = heartbeats.register() if heartbeats else None
 
     while queue:
+        if heartbeat:
+            heartbeat.beat()
         # Block and wait if no incoming message in child process - not affecting parent process
         try:
-            payload = json.loads(queue.get(block=True, timeout=config.QUEUE_BLOCK_TIMEOUT))
-            logger.info(f"Task is being executed by Process-{os.getpid()}...")
-            if payload["api"] == "terminate":
-                break
-            else:
-                wrapper(data=payload)
+            payloads = dequeue_batch(queue, config)
         except Empty:
             logger.info(f"Queue is empty, rechecking by Process-{os.getpid()}...")
+            continue
+        logger.info(f"Batch of {len(payloads)} tasks is being executed by Process-{os.getpid()}...")
+        compute_payloads, shard_payloads = [], []
+        for payload in payloads:
+            if payload["api"] == "compute":
+                compute_payloads.append(payload)
+            elif payload["api"] == "compute_batch":
+                compute_payloads.extend({**item, "api": "compute", "timestamps": payload["timestamps"],
+                                         "attempts": payload.get("attempts", 0)} for item in payload["items"])
+            elif payload["api"] == "compute_shard":
+                shard_payloads.append(payload)
+            elif payload["api"] != "terminate":
+                logger.info("Unsupported api type")
+        compute_payloads = skip_cancelled(compute_payloads, cancellation)
+        shard_payloads = skip_cancelled(shard_payloads, cancellation)
+        if heartbeat and (compute_payloads or shard_payloads):
+            # Hard deadline of the batch for the watchdog, each computation is failed by its own timeout first
+            inflight = compute_payloads + shard_payloads
+            timeout = sum(compute_timeout(config, payload.get("model")) for payload in inflight)
+            heartbeat.busy([inflight_entry(payload) for payload in inflight], deadline=time.monotonic() + timeout)
+        for payload in shard_payloads:
+            compute_shard(payload, db, cache, notifier, cancellation, config, heartbeat)
+        if compute_payloads:
+            compute_batch(compute_payloads, db, cache, notifier, cancellation, config, heartbeat)
+        if isinstance(queue, LeaseQueue):
+            # Results are committed, the messages are not redelivered anymore
+            queue.ack()
+        if heartbeat:
+            heartbeat.idle()
+        if payloads[-1]["api"] == "terminate":
+            if heartbeat:
+                heartbeat.release()
+            # Metrics of the last batches outlive the consumer
+            registry.flush()
+            break
+
+
+def recover_lost_tasks(inflight: List[list], reason: str, qm: ProcessQueueManager, db: CalculatorDatabase,
+                       config: Config, notifier: CompletionNotifier = None) -> Tuple[int, int]:
+    """
+    In-flight tasks of a lost consumer (see inflight_entry) still PROCESSING are re-enqueued up to
+    WATCHDOG_MAX_RETRIES times from their persisted message, or failed with the reason the consumer was
+    lost - a task which has outlived its timeout is not retried. Returns (re-enqueued, failed)
+    """
+    messages = db.get_pending_json_messages(task_ids=[entry[0] for entry in inflight])
+    rows: List[Tuple[str, str, str, float]] = []
+    shards: List[Tuple[str, int, int, str]] = []
+    requeued = 0
+    for task_id, attempts, *shard in inflight:
+        if task_id not in messages:
+            # Committed or cancelled before the consumer was lost
+            continue
+        status_message = f"worker-{reason}"
+        if reason != "timeout" and attempts < config.WATCHDOG_MAX_RETRIES:
+            data = {**json.loads(messages[task_id]), "attempts": attempts + 1}
+            if shard:
+                data.update(zip(["api", "shard", "shards", "start", "stop"], ["compute_shard", *shard]))
+            try:
+                qm.enqueue(json.dumps(data))
+                requeued += 1
+                continue
+            except Full:
+                status_message = "queue-full"
+        if shard:
+            shards.append((task_id, shard[0], shard[1], status_message))
+        else:
+            rows.append((task_id, "FAILED", status_message, -1.0))
+    updated = db.update_status_output_messages(rows=rows) if rows else []
+    for task_id, shard, shard_count, status_message in shards:
+        updated.extend(db.report_shard(task_id=task_id, shard=shard, shard_count=shard_count, status="FAILED",
+                                       status_message=status_message, output=-1.0, combine=sum))
+    if notifier:
+        notifier.publish(updated)
+    LOST_TASKS.inc(requeued, action="requeued")
+    LOST_TASKS.inc(len(rows) + len(shards), action="failed")
+    return requeued, len(rows) + len(shards)
+
+
+def startup_workflow(qm: ProcessQueueManager, db: CalculatorDatabase, config: Config) -> StartupRecovery:
+    # Tasks are stamped by the second - the API only accepts tasks once the cutoff second is over, so that a task
+    # submitted after the startup is never replayed on top of its own enqueue
+    event_time = int(datetime.now().strftime('%s'))
+    time.sleep(max(event_time + 1 - time.time(), 0))
+    # Replay in background so that the API is served while the backlog is recovered
+    recovery = StartupRecovery(qm, db, event_time=event_time, page_size=config.RECOVERY_PAGE_SIZE)
+    recovery.start()
+    return recovery
+
+
+def lease_recovery_workflow(qm: ProcessQueueManager, db: CalculatorDatabase, config: Config) -> LeaseRecovery:
+    recovery = LeaseRecovery(qm, db, age=config.LEASE_RECOVERY_AGE, interval=config.LEASE_RECOVERY_INTERVAL,
+                             page_size=config.RECOVERY_PAGE_SIZE)
+    recovery.start()
+    return recovery
 
 
-def startup_workflow(qm: ProcessQueueManager, db: CalculatorDatabase):
-    messages = db.get_json_messages(event_time=int(datetime.now().strftime('%s')))
-    for message in messages:
-        qm.enqueue(message)
+def retention_workflow(db: CalculatorDatabase, config: Config) -> RetentionJob:
+    retention = RetentionJob(db, ttl=config.RETENTION_TTL, interval=config.RETENTION_INTERVAL,
+                             batch_size=config.RETENTION_BATCH_SIZE, pause=config.RETENTION_BATCH_PAUSE,
+                             vacuum_pages=config.RETENTION_VACUUM_PAGES)
+    retention.start()
+    return retention
 
 
 def run_calculator_qm_task(ms: CalculatorMicroservice):
     qm: ProcessQueueManager = ms.calculator_qm
     db: CalculatorDatabase = ms.calculator_db
     config: Config = ms.config
-    qm.consumers(task, db, config)
-    startup_workflow(qm, db)
+    cache: ResultCache = ms.calculator_cache
+    notifier: CompletionNotifier = ms.calculator_notifier
+    cancellation: CancellationBoard = ms.calculator_cancellation
+    # Engine imported and calibrated once here, inherited by the consumers forked now or respawned later
+    create_engine(config.COMPUTE_ENGINE, config.COMPUTE_CHUNK_SIZE)
+    qm.consumers(task, db, config, cache, notifier, cancellation, qm.heartbeats)
+    qm.supervise(functools.partial(recover_lost_tasks, qm=qm, db=db, config=config, notifier=notifier))
+    if config.QUEUE_TRANSPORT != "lease":
+        ms.calculator_recovery = startup_workflow(qm, db, config)
+    else:
+        # Messages of a lease queue outlive the restart, only the pending tasks without message are replayed
+        ms.calculator_recovery = lease_recovery_workflow(qm, db, config)
+    if config.RETENTION_ENABLED:
+        ms.calculator_retention = retention_workflow(db, config)
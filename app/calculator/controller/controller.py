@@ -1,15 +1,28 @@
-from flask import request
+from flask import request, Response, stream_with_context
 from flask_restplus import Resource
 
-from app.calculator.computation.api import handle_evaluate, handle_status, handle_result
+from app.calculator.computation.api import handle_evaluate, handle_status, handle_result, handle_cache_stats, \
+    handle_recovery_status, handle_scheduler_stats, handle_evaluate_batch, handle_status_batch, handle_result_batch, \
+    handle_status_stream, handle_autoscaler_stats, handle_latency_stats, handle_kill, handle_watchdog_stats
 from app.calculator.serializer.dto import Dto
 
 calculator_api = Dto.api
 evaluate_request_model = Dto.evaluate_request_model
 status_request_model = Dto.status_request_model
 result_request_model = Dto.result_request_model
+kill_request_model = Dto.kill_request_model
 response_model = Dto.response_model
 result_model = Dto.result_model
+evaluate_batch_request_model = Dto.evaluate_batch_request_model
+batch_request_model = Dto.batch_request_model
+batch_response_model = Dto.batch_response_model
+batch_result_model = Dto.batch_result_model
+cache_stats_model = Dto.cache_stats_model
+recovery_status_model = Dto.recovery_status_model
+scheduler_stats_model = Dto.scheduler_stats_model
+autoscaler_stats_model = Dto.autoscaler_stats_model
+watchdog_stats_model = Dto.watchdog_stats_model
+latency_stats_model = Dto.latency_stats_model
 
 
 @calculator_api.route("/evaluate")
@@ -34,8 +47,107 @@ class EvaluateRequestHandler(Resource):
 @calculator_api.route("/result")
 class EvaluateRequestHandler(Resource):
     @calculator_api.expect(result_request_model, validate=True)
-    @calculator_api.doc("to check result of the submitted request")
+    @calculator_api.doc("to check result of the submitted request",
+                        params={"wait": "the seconds to wait for a task still processing to complete"})
     @calculator_api.marshal_with(result_model)
     def post(self):
         req = request.json
-        return handle_result(task_id=req["task_id"])
+        return handle_result(task_id=req["task_id"], wait=request.args.get("wait", default=0, type=float))
+
+
+@calculator_api.route("/kill")
+class KillRequestHandler(Resource):
+    @calculator_api.expect(kill_request_model, validate=True)
+    @calculator_api.doc("to cancel a submitted request, queued or running")
+    @calculator_api.marshal_with(response_model)
+    def post(self):
+        req = request.json
+        return handle_kill(task_id=req["task_id"])
+
+
+@calculator_api.route("/evaluate_batch")
+class EvaluateBatchRequestHandler(Resource):
+    @calculator_api.expect(evaluate_batch_request_model, validate=True)
+    @calculator_api.doc("to submit many computation requests at once, one task_id is returned per item")
+    @calculator_api.marshal_with(batch_response_model)
+    def post(self):
+        return handle_evaluate_batch(data=request.json)
+
+
+@calculator_api.route("/status_batch")
+class StatusBatchRequestHandler(Resource):
+    @calculator_api.expect(batch_request_model, validate=True)
+    @calculator_api.doc("to check status of many submitted requests at once")
+    @calculator_api.marshal_with(batch_response_model)
+    def post(self):
+        req = request.json
+        return handle_status_batch(task_ids=req["task_ids"])
+
+
+@calculator_api.route("/result_batch")
+class ResultBatchRequestHandler(Resource):
+    @calculator_api.expect(batch_request_model, validate=True)
+    @calculator_api.doc("to check result of many submitted requests at once")
+    @calculator_api.marshal_with(batch_result_model)
+    def post(self):
+        req = request.json
+        return handle_result_batch(task_ids=req["task_ids"])
+
+
+@calculator_api.route("/stream")
+class StatusStreamHandler(Resource):
+    @calculator_api.doc("to stream status transitions of the submitted requests as server-sent events",
+                        params={"task_id": "the task unique identifier, repeated for a batch of tasks"})
+    def get(self):
+        task_ids = request.args.getlist("task_id")
+        return Response(stream_with_context(handle_status_stream(task_ids=task_ids)),
+                        mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+@calculator_api.route("/cache")
+class CacheStatsHandler(Resource):
+    @calculator_api.doc("to check the result cache hit/miss/eviction counters")
+    @calculator_api.marshal_with(cache_stats_model)
+    def get(self):
+        return handle_cache_stats()
+
+
+@calculator_api.route("/recovery")
+class RecoveryStatusHandler(Resource):
+    @calculator_api.doc("to check the progress of the startup recovery of pending tasks")
+    @calculator_api.marshal_with(recovery_status_model)
+    def get(self):
+        return handle_recovery_status()
+
+
+@calculator_api.route("/scheduler")
+class SchedulerStatsHandler(Resource):
+    @calculator_api.doc("to check the queue-wait percentiles per priority class of the scheduler")
+    @calculator_api.marshal_with(scheduler_stats_model)
+    def get(self):
+        return handle_scheduler_stats()
+
+
+@calculator_api.route("/autoscaler")
+class AutoscalerStatsHandler(Resource):
+    @calculator_api.doc("to check the consumer processes and the scaling decisions of the autoscaler")
+    @calculator_api.marshal_with(autoscaler_stats_model)
+    def get(self):
+        return handle_autoscaler_stats()
+
+
+@calculator_api.route("/watchdog")
+class WatchdogStatsHandler(Resource):
+    @calculator_api.doc("to check the consumers respawned and the in-flight tasks recovered by the watchdog")
+    @calculator_api.marshal_with(watchdog_stats_model)
+    def get(self):
+        return handle_watchdog_stats()
+
+
+@calculator_api.route("/latency")
+class LatencyStatsHandler(Resource):
+    @calculator_api.doc("to check the latency percentiles per lifecycle stage of the recently committed tasks",
+                        params={"window": "the seconds of committed tasks covered"})
+    @calculator_api.marshal_with(latency_stats_model)
+    def get(self):
+        return handle_latency_stats(window=request.args.get("window", default=None, type=float))
@@ -1,3 +1,6 @@
+from typing import List
+
+
 class CommonResponse(object):
     def __init__(self, retcode: int = None, status: str = None, message: str = None):
         self.retcode = retcode
@@ -25,3 +28,21 @@ class Result(object):
 
     def __repr__(self):
         return f"Result({self.task_id},{repr(self.response)},{repr(self.output)})"
+
+
+class BatchResponse(object):
+    def __init__(self, response: CommonResponse = None, responses: List[Response] = None):
+        self.response = response
+        self.responses = responses or []
+
+    def __repr__(self):
+        return f"BatchResponse({repr(self.response)},{repr(self.responses)})"
+
+
+class BatchResult(object):
+    def __init__(self, response: CommonResponse = None, results: List[Result] = None):
+        self.response = response
+        self.results = results or []
+
+    def __repr__(self):
+        return f"BatchResult({repr(self.response)},{repr(self.results)})"
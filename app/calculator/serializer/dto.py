@@ -5,12 +5,32 @@ class Dto:
     api = Namespace('Calculator',
                     description='It computes the output based on the default functions and user defined inputs')
 
-    # {number: int}
+    # {model: str, number: int, priority: int, tenant: str}
     evaluate_request_model = api.model('evaluate_request_model', {
+        'model': fields.String(required=True, description='the name of computation model'),
+        'number': fields.Float(readOnly=True, required=True, description='the user defined input'),
+        'priority': fields.Integer(required=False, default=0,
+                                   description='the scheduling priority class; lower value is served first'),
+        'tenant': fields.String(required=False, default='default',
+                                description='the client identifier used for fair sharing of the workers')
+    })
+
+    # {model: str, number: int}
+    evaluate_item_model = api.model('evaluate_item_model', {
         'model': fields.String(required=True, description='the name of computation model'),
         'number': fields.Float(readOnly=True, required=True, description='the user defined input')
     })
 
+    # {items: [{model: str, number: int}], priority: int, tenant: str}
+    evaluate_batch_request_model = api.model('evaluate_batch_request_model', {
+        'items': fields.List(fields.Nested(evaluate_item_model), required=True,
+                             description='the computation requests, one task_id is returned per item'),
+        'priority': fields.Integer(required=False, default=0,
+                                   description='the scheduling priority class; lower value is served first'),
+        'tenant': fields.String(required=False, default='default',
+                                description='the client identifier used for fair sharing of the workers')
+    })
+
     # {task_id: str}
     status_request_model = api.model('status_request_model', {
         'task_id': fields.String(required=True, description='the task unique identifier')
@@ -21,6 +41,11 @@ class Dto:
         'task_id': fields.String(required=True, description='the task unique identifier')
     })
 
+    # {task_ids: [str]}
+    batch_request_model = api.model('batch_request_model', {
+        'task_ids': fields.List(fields.String, required=True, description='the task unique identifiers')
+    })
+
     # {task_id: str}
     kill_request_model = api.model('kill_request_model', {
         'task_id': fields.String(required=True, description='the task unique identifier')
@@ -50,3 +75,75 @@ class Dto:
                                description='the computation output; '
                                            '-1.0 is returned if error encountered'),
     })
+
+    # {response: {retcode: int, message: str}, responses: [{task_id: str, response: {...}}]}
+    batch_response_model = api.model('batch_response_model', {
+        'response': fields.Nested(common_response_model),
+        'responses': fields.List(fields.Nested(response_model), description='the responses in request order')
+    })
+
+    # {response: {retcode: int, message: str}, results: [{task_id: str, response: {...}, output: float}]}
+    batch_result_model = api.model('batch_result_model', {
+        'response': fields.Nested(common_response_model),
+        'results': fields.List(fields.Nested(result_model), description='the results in request order')
+    })
+
+    # {hits: int, memory_hits: int, database_hits: int, misses: int, evictions: int, memory_size: int}
+    cache_stats_model = api.model('cache_stats_model', {
+        'hits': fields.Integer(required=True, description='the number of cache hits across all processes'),
+        'memory_hits': fields.Integer(required=True, description='the number of in-memory LRU hits'),
+        'database_hits': fields.Integer(required=True, description='the number of persistent cache hits'),
+        'misses': fields.Integer(required=True, description='the number of cache misses'),
+        'evictions': fields.Integer(required=True, description='the number of in-memory LRU evictions'),
+        'memory_size': fields.Integer(required=True, description='the in-memory LRU size of the API process'),
+    })
+
+    # {state: str, total: int, replayed: int, remaining: int}
+    recovery_status_model = api.model('recovery_status_model', {
+        'state': fields.String(required=True, description='the startup recovery state; '
+                                                          'PENDING, RUNNING, COMPLETED, STOPPED or ERROR'),
+        'total': fields.Integer(required=True, description='the number of pending tasks to be replayed'),
+        'replayed': fields.Integer(required=True, description='the number of tasks replayed into the queue'),
+        'remaining': fields.Integer(required=True, description='the number of tasks still to be replayed'),
+    })
+
+    # {queue_wait: {class: {samples: int, p50: float, p95: float, p99: float}}, queued: {...}, dequeued: {...}}
+    scheduler_stats_model = api.model('scheduler_stats_model', {
+        'queue_wait': fields.Raw(required=True, description='the queue-wait percentiles in seconds per class'),
+        'queued': fields.Raw(required=True, description='the number of queued messages per class'),
+        'dequeued': fields.Raw(required=True, description='the number of dequeued messages per class/tenant'),
+    })
+
+    # {window: float, stages: {stage: {samples: int, p50: int, p95: int, p99: int, max: int}}}
+    latency_stats_model = api.model('latency_stats_model', {
+        'window': fields.Float(required=True, description='the seconds of committed tasks covered'),
+        'stages': fields.Raw(required=True, description='the latency percentiles in ms per lifecycle stage; '
+                                                        'api, queue, dispatch, compute, commit and total'),
+        'response': fields.Nested(common_response_model),
+    })
+
+    # {enabled: bool, workers: int, min_workers: int, max_workers: int, cpus: float, queue_wait: float, ...}
+    autoscaler_stats_model = api.model('autoscaler_stats_model', {
+        'enabled': fields.Boolean(required=True, description='whether the consumers are autoscaled'),
+        'workers': fields.Integer(required=True, description='the number of consumer processes'),
+        'min_workers': fields.Integer(required=True, description='the min number of consumer processes'),
+        'max_workers': fields.Integer(required=True, description='the max number of consumer processes '
+                                                                  'allowed by the CPU quota'),
+        'cpus': fields.Float(required=True, description='the CPUs available as of the latest check'),
+        'queue_wait': fields.Float(description='the estimated queue wait in seconds, priority transport only'),
+        'scale_ups': fields.Integer(required=True, description='the number of consumers added'),
+        'scale_downs': fields.Integer(required=True, description='the number of consumers drained'),
+    })
+
+    watchdog_restarts_model = api.model('watchdog_restarts_model', {
+        'crashed': fields.Integer(required=True, description='the consumers respawned after their process died'),
+        'timeout': fields.Integer(required=True, description='the consumers killed past their compute timeouts'),
+        'unresponsive': fields.Integer(required=True, description='the consumers killed without heartbeat'),
+    })
+
+    watchdog_stats_model = api.model('watchdog_stats_model', {
+        'enabled': fields.Boolean(required=True, description='whether the consumers are supervised'),
+        'restarts': fields.Nested(watchdog_restarts_model, required=True),
+        'requeued': fields.Integer(required=True, description='the in-flight tasks of lost consumers re-enqueued'),
+        'failed': fields.Integer(required=True, description='the in-flight tasks of lost consumers failed'),
+    })
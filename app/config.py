@@ -1,22 +1,120 @@
 import os
+import tempfile
 
 
 class Config:
-    CONSUMER_PARALLELISM = 1
+    CONSUMER_PARALLELISM = 1  # consumers started initially
+    CONSUMER_MIN_PARALLELISM = 1  # consumers are autoscaled between min and max when max is above min
+    CONSUMER_MAX_PARALLELISM = 1
+    AUTOSCALE_INTERVAL = 2  # seconds between autoscaling decisions
+    AUTOSCALE_TARGET_WAIT = 1.0  # seconds of estimated queue wait before a consumer is added
+    AUTOSCALE_BACKLOG = 4  # queued messages per consumer before one is added
+    AUTOSCALE_IDLE_DELAY = 30  # seconds of empty queue before a consumer is drained
+    AUTOSCALE_CPU_OVERCOMMIT = 2.0  # consumers per CPU of the cgroup quota at most
     QUEUE_SIZE = 10
     QUEUE_BLOCK_TIMEOUT = 2  # seconds
+    # manager / queue / simple / shm_ring / priority / lease (shared by the replicas), see ProcessQueueManager
+    QUEUE_TRANSPORT = os.getenv("FLASK_MICROSERVICE_QUEUE_TRANSPORT", "manager")
+    QUEUE_SLOT_SIZE = 4096  # bytes per message, shm_ring transport only
+    QUEUE_FAIR_SHARE = True  # weighted fair queuing between tenants, priority transport only
+    QUEUE_TENANT_WEIGHTS = {}  # tenant -> weight, 1.0 if not listed
+    LEASE_QUEUE_DB_NAME = "calculator_dev_queue"  # lease transport only, next to the task database
+    LEASE_VISIBILITY_TIMEOUT = 30  # seconds before the message of a lost replica is redelivered
+    LEASE_POLL_INTERVAL = 0.2  # seconds between the claims of an idle consumer
+    LEASE_RECOVERY_INTERVAL = 60  # seconds between the scans for pending tasks without message in the lease queue
+    LEASE_RECOVERY_AGE = 60  # seconds a pending task is left to its replica before it is checked
+    CONSUMER_BATCH_SIZE = 16  # messages drained per consumer wakeup
+    CONSUMER_BATCH_WAIT_MS = 5  # max wait for a batch to fill up after its first message
     CALCULATOR_SQLITE_DB_NAME = "calculator_dev"
     CALCULATOR_SQLITE_TABLE_NAME = "computation_dev"
+    ARCHIVE_SQLITE_DB_NAME = "calculator_dev_archive"
     DB_PATH = os.getcwd()
+    SQLITE_POOL_SIZE = 4  # idle connections kept per process
+    SQLITE_POOL_HEALTH_CHECK_INTERVAL = 30  # seconds idle before a pooled connection is health checked
+    SQLITE_PRAGMAS = {
+        # Only effective on a new database, must come before journal_mode
+        "auto_vacuum": "INCREMENTAL",
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 2 ** 26,  # bytes
+        "cache_size": -8000,  # negative value is in KiB
+    }
+    # python / numpy / auto (fastest available engine picked at startup)
+    COMPUTE_ENGINE = os.getenv("FLASK_MICROSERVICE_COMPUTE_ENGINE", "auto")
+    COMPUTE_CHUNK_SIZE = 2 ** 16  # terms per vectorized chunk
+    COMPUTE_TIMEOUT = 60  # seconds per input before a computation is failed with a timeout
+    MODEL_TIMEOUTS = {}  # model -> COMPUTE_TIMEOUT of the model, COMPUTE_TIMEOUT if not listed
+    RESULT_CACHE_ENABLED = True
+    RESULT_CACHE_SIZE = 1024  # in-memory entries per process
+    STATUS_CACHE_ENABLED = True  # serve /status and /result of the API process from memory
+    STATUS_CACHE_SIZE = 10000  # entries per API process
+    STATUS_CACHE_TTL = 300  # seconds a final status is served from memory
+    STATUS_CACHE_NEGATIVE_TTL = 0.5  # seconds a PROCESSING or NOT FOUND status is served from memory
+    RECOVERY_PAGE_SIZE = 500  # pending tasks fetched per page by the startup recovery
+    COALESCE_INFLIGHT = True  # attach duplicate requests to the identical computation in progress
+    SHARDING_ENABLED = True  # split decomposable computations across the consumers when the queue is idle
+    SHARD_COUNT = None  # range shards per computation, CONSUMER_PARALLELISM if not set
+    BATCH_MAX_ITEMS = 1000  # items accepted per evaluate/status/result batch request
+    BATCH_CHUNK_SIZE = 32  # evaluate batch items per queue message, fits a shm_ring slot
+    RESULT_MAX_WAIT = 30  # seconds, upper bound of the /result long-poll wait
+    STREAM_TIMEOUT = 300  # seconds before a status event stream is closed
+    STREAM_HEARTBEAT = 15  # seconds between keep-alive comments of a status event stream
+    # dev (Flask development server) / wsgi (pre-fork gunicorn) / asgi (pre-fork gunicorn with uvicorn workers)
+    SERVER = os.getenv("FLASK_MICROSERVICE_SERVER", "dev")
+    # all (server and consumers) / api (server only) / worker (consumers only), split roles need the lease transport
+    ROLE = os.getenv("FLASK_MICROSERVICE_ROLE", "all")
+    SERVER_WORKERS = int(os.getenv("FLASK_MICROSERVICE_WORKERS", "1"))  # pre-fork API worker processes
+    SERVER_THREADS = 8  # request threads per wsgi worker
+    ASGI_EXECUTOR_THREADS = 16  # threads running the blocking DB/queue calls of an asgi worker
+    # Per process metric snapshots aggregated by /metrics, cleared when the microservice starts - one directory
+    # per instance, the processes forked by the instance inherit it
+    METRICS_DIR = os.getenv("FLASK_MICROSERVICE_METRICS_DIR",
+                            os.path.join(tempfile.gettempdir(), f"flask_microservice_metrics_{os.getpid()}"))
+    METRICS_FLUSH_INTERVAL = 1.0  # seconds between the metric snapshots of a process
+    METRICS_PORT = int(os.getenv("FLASK_MICROSERVICE_METRICS_PORT", "9100"))  # /metrics of the worker role
+    LATENCY_WINDOW = 300  # seconds of committed tasks covered by the /latency percentiles by default
+    LATENCY_MAX_WINDOW = 86400  # seconds, upper bound of the /latency window
+    CANCELLATION_SLOTS = 1024  # latest cancelled task ids checked by the running computations
+    # seconds between the database status checks of a running computation on the lease transport, the cancelled
+    # task ids of the API processes of another pod do not reach the board of the workers
+    CANCELLATION_POLL_INTERVAL = 1.0
+    WATCHDOG_ENABLED = True  # respawn dead or hung consumers and recover their in-flight tasks
+    WATCHDOG_INTERVAL = 1.0  # seconds between the consumer checks
+    WATCHDOG_HEARTBEAT_TIMEOUT = 30  # seconds without heartbeat, on top of QUEUE_BLOCK_TIMEOUT, before a kill
+    WATCHDOG_GRACE = 5  # seconds past the compute timeouts of its batch before a busy consumer is killed
+    WATCHDOG_MAX_RETRIES = 1  # re-enqueues of a task lost with its consumer before it is failed
+    WATCHDOG_SLOT_SIZE = 2 ** 17  # bytes of in-flight task ids recorded per consumer
+    RETENTION_ENABLED = True  # move final tasks past RETENTION_TTL to the archive database
+    RETENTION_TTL = 7 * 86400  # seconds after its event time before a final task is archived
+    RETENTION_INTERVAL = 3600  # seconds between the retention runs
+    RETENTION_BATCH_SIZE = 500  # tasks archived and pruned per write transaction
+    RETENTION_BATCH_PAUSE = 0.05  # seconds between two batches, leaves the write lock to the inserts
+    RETENTION_VACUUM_PAGES = 256  # free pages returned to the file system per incremental vacuum step
 
 
 class ProductionConfig(Config):
     CONSUMER_PARALLELISM = 3
+    CONSUMER_MIN_PARALLELISM = 1
+    CONSUMER_MAX_PARALLELISM = 4
     QUEUE_SIZE = 500
     QUEUE_BLOCK_TIMEOUT = 60  # seconds
+    LEASE_QUEUE_DB_NAME = "calculator_queue"
+    CONSUMER_BATCH_SIZE = 64
+    CONSUMER_BATCH_WAIT_MS = 10
     CALCULATOR_SQLITE_DB_NAME = "calculator"
     CALCULATOR_SQLITE_TABLE_NAME = "computation"
+    ARCHIVE_SQLITE_DB_NAME = "calculator_archive"
     DB_PATH = "/database"
+    SQLITE_POOL_SIZE = 8
+    SQLITE_PRAGMAS = {
+        "auto_vacuum": "INCREMENTAL",
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "mmap_size": 2 ** 28,
+        "cache_size": -64000,
+    }
+    RESULT_CACHE_SIZE = 100000
+    STATUS_CACHE_SIZE = 100000
 
 
 config_by_env = {
@@ -1,18 +1,24 @@
+import time
+
 from flask import Blueprint
-from flask import Flask
+from flask import Flask, Response, g, request
 from flask_restplus import Api
 
 from app import CalculatorMicroservice
+from app.calculator.computation.api import handle_metrics, REQUEST_SECONDS
 from app.calculator.computation.service import run_calculator_qm_task
 from app.calculator.controller.controller import calculator_api
 
 
 def start_app(ms: CalculatorMicroservice):
     ms.calculator_db.create_table()
-    run_calculator_qm_task(ms)
+    ms.calculator_db.migrate()
+    if ms.config.ROLE == "all":
+        run_calculator_qm_task(ms)
     app = Flask(__name__)
     blueprint = register_blueprint_v1()
     app.register_blueprint(blueprint)
+    register_metrics(app, ms)
     return app
 
 
@@ -26,3 +32,24 @@ def register_blueprint_v1():
     )
     api.add_namespace(calculator_api, path='/v1/calculator')
     return blueprint
+
+
+def register_metrics(app: Flask, ms: CalculatorMicroservice):
+    """Time every request per endpoint and expose the metrics of all processes at /metrics"""
+
+    @app.before_request
+    def start_timer():
+        g.request_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        # Event streams are timed until their headers are sent
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        REQUEST_SECONDS.observe(time.perf_counter() - g.request_start, method=request.method, endpoint=endpoint,
+                                status=response.status_code)
+        return response
+
+    def metrics():
+        return Response(handle_metrics(ms=ms), mimetype="text/plain; version=0.0.4")
+
+    app.add_url_rule("/metrics", "metrics", metrics)
@@ -0,0 +1,52 @@
+import os
+
+from app import CalculatorMicroservice
+from app.util.logger import logger
+
+servers = ["dev", "wsgi", "asgi"]
+
+
+def run_prefork(ms: CalculatorMicroservice, application, server: str, port: int) -> None:
+    """
+    Serve the application with SERVER_WORKERS gunicorn worker processes forked from this process
+
+    The microservice (process queue manager, consumers and startup recovery) is initialized once in this
+    master process, workers inherit the queue and re-open their own database connections after the fork.
+    """
+    # Imported lazily so that gunicorn/uvicorn stay optional for the development server
+    from gunicorn.app.base import BaseApplication
+
+    config = ms.config
+
+    def post_fork(_server, _worker):
+        # Every worker listens on its own completion channel
+        ms.calculator_notifier.start()
+
+    def on_exit(_server):
+        logger.info(f"Pre-fork {server} server is shut down by Process-{os.getpid()}")
+        ms.calculator_qm.stop()
+
+    options = {
+        "bind": f"0.0.0.0:{port}",
+        "workers": config.SERVER_WORKERS,
+        "post_fork": post_fork,
+        "on_exit": on_exit,
+        # Long-polls and event streams hold the request for up to STREAM_TIMEOUT
+        "timeout": config.STREAM_TIMEOUT + config.STREAM_HEARTBEAT,
+    }
+    if server == "asgi":
+        options["worker_class"] = "uvicorn.workers.UvicornWorker"
+    else:
+        options["worker_class"] = "gthread"
+        options["threads"] = config.SERVER_THREADS
+
+    class PreforkApplication(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            return application
+
+    logger.info(f"Pre-fork {server} server with {config.SERVER_WORKERS} workers is started by Process-{os.getpid()}")
+    PreforkApplication().run()
@@ -0,0 +1,130 @@
+import asyncio
+import importlib.util
+import json
+import tempfile
+import unittest
+from types import SimpleNamespace
+
+from app import Config
+from app.asgi import CalculatorASGI, API_PREFIX
+from app.calculator.computation.cache import ResultCache, StatusCache
+from app.calculator.computation.database import CalculatorDatabase
+from app.calculator.computation.service import run_calculator_qm_task
+from app.util.cancellation import CancellationBoard
+from app.util.completion_notifier import CompletionNotifier
+from app.util.process_queue_manager import ProcessQueueManager
+
+
+def request(app: CalculatorASGI, method: str, path: str, payload=None, query: str = ""):
+    """Call the ASGI application in process, returns (status, content type, body)"""
+    messages = [{"type": "http.request", "body": json.dumps(payload).encode() if payload is not None else b"",
+                 "more_body": False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        # Client stays connected until the response is complete
+        await asyncio.sleep(3600)
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "method": method, "path": f"{API_PREFIX}{path}", "query_string": query.encode()}
+    asyncio.run(app(scope, receive, send))
+    headers = dict(sent[0]["headers"])
+    return sent[0]["status"], headers[b"content-type"], b"".join(message.get("body", b"") for message in sent[1:])
+
+
+@unittest.skipUnless(importlib.util.find_spec("flask_restplus"), "flask_restplus is required for the controller routes")
+class TestASGI(unittest.TestCase):
+    app: CalculatorASGI = None
+    ms: SimpleNamespace = None
+    tmp_dir: tempfile.TemporaryDirectory = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        config = Config()
+        config.DB_PATH = cls.tmp_dir.name
+        db = CalculatorDatabase(config)
+        db.create_table()
+        db.migrate()
+        qm = ProcessQueueManager(service="asgi", parallelism=1, max_limit=config.QUEUE_SIZE,
+                                 queue_block_timeout=config.QUEUE_BLOCK_TIMEOUT)
+        notifier = CompletionNotifier()
+        cls.ms = SimpleNamespace(config=config, calculator_db=db, calculator_cache=ResultCache(config, db),
+                                 calculator_qm=qm, calculator_notifier=notifier,
+                                 calculator_cancellation=CancellationBoard(), calculator_recovery=None,
+                                 calculator_status_cache=StatusCache(config, db, notifier))
+        run_calculator_qm_task(cls.ms)
+        cls.app = CalculatorASGI(cls.ms)
+
+    def test_evaluate_result(self):
+        status, content_type, body = request(self.app, "POST", "/evaluate",
+                                             {"model": "sum_math_cos", "number": 0.5, "tenant": "asgi"})
+        self.assertEqual(status, 200)
+        self.assertEqual(content_type, b"application/json")
+        response = json.loads(body)
+        self.assertEqual(response["response"], {"retcode": 0, "status": "PROCESSING", "message": "ok-queued"})
+
+        status, _, body = request(self.app, "POST", "/result", {"task_id": response["task_id"]}, query="wait=10")
+        self.assertEqual(json.loads(body), {"task_id": response["task_id"], "output": 1000000.0,
+                                            "response": {"retcode": 0, "status": "COMPLETED",
+                                                         "message": "COMPLETED"}})
+
+        status, _, body = request(self.app, "POST", "/status_batch", {"task_ids": [response["task_id"], "missing"]})
+        self.assertEqual([r["response"]["status"] for r in json.loads(body)["responses"]],
+                         ["COMPLETED", "NOT FOUND"])
+
+        # Completed task is not cancelled
+        status, _, body = request(self.app, "POST", "/kill", {"task_id": response["task_id"]})
+        self.assertEqual(json.loads(body)["response"], {"retcode": 1, "status": "COMPLETED", "message": "COMPLETED"})
+
+    def test_stream(self):
+        status, _, body = request(self.app, "POST", "/evaluate_batch",
+                                  {"items": [{"model": "sum_math_cos", "number": 2}]})
+        task_id = json.loads(body)["responses"][0]["task_id"]
+        status, content_type, body = request(self.app, "GET", "/stream", query=f"task_id={task_id}")
+        self.assertEqual(content_type, b"text/event-stream; charset=utf-8")
+        events = body.decode().strip().split("\n\n")
+        self.assertTrue(events[-1].startswith("event: end"))
+        self.assertEqual(json.loads(events[-2].split("data: ", 1)[1])["status"], "COMPLETED")
+
+    def test_validation(self):
+        status, _, body = request(self.app, "POST", "/evaluate", {"model": "sum_math_cos"})
+        self.assertEqual(status, 400)
+        self.assertEqual(json.loads(body)["errors"], {"number": "'number' is a required property"})
+        status, _, body = request(self.app, "POST", "/evaluate_batch", {"items": [{"model": 1, "number": 1}]})
+        self.assertEqual(status, 400)
+        self.assertIn("items.0.model", json.loads(body)["errors"])
+        status, _, _ = request(self.app, "GET", "/missing")
+        self.assertEqual(status, 404)
+        status, _, body = request(self.app, "GET", "/cache")
+        self.assertEqual(status, 200)
+        self.assertIn("hits", json.loads(body))
+        status, _, body = request(self.app, "GET", "/latency", query="window=60")
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(body)["response"], {"retcode": 0, "status": "ok", "message": "ok"})
+
+    def test_metrics(self):
+        request(self.app, "GET", "/cache")
+        scope = {"type": "http", "method": "GET", "path": "/metrics", "query_string": b""}
+        sent = []
+
+        async def send(message):
+            sent.append(message)
+
+        asyncio.run(self.app(scope, None, send))
+        self.assertEqual(sent[0]["status"], 200)
+        self.assertIn(b'http_request_duration_seconds_count{method="GET",endpoint="/v1/calculator/cache",'
+                      b'status="200"}', sent[1]["body"])
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.ms.calculator_qm.enqueue(json.dumps({"task_id": "abc-efg-xyz-123", "api": "terminate"}))
+        cls.ms.calculator_qm.processes[0].join(timeout=10)
+        cls.ms.calculator_qm.stop()
+        cls.ms.calculator_notifier.stop()
+        cls.ms.calculator_db.close()
+        cls.tmp_dir.cleanup()
@@ -0,0 +1,96 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+from queue import Empty
+from types import SimpleNamespace
+
+from app.util.autoscaler import Autoscaler, cgroup_cpu_limit
+from app.util.process_queue_manager import ProcessQueueManager
+
+
+def task(queue):
+    while True:
+        try:
+            payload = json.loads(queue.get(block=True, timeout=0.5))
+        except Empty:
+            continue
+        if payload["api"] == "terminate":
+            break
+        time.sleep(0.05)
+
+
+class TestAutoscaler(unittest.TestCase):
+    tmp_dir: tempfile.TemporaryDirectory = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+
+    def _cgroup(self, name: str, files: dict) -> str:
+        root = os.path.join(self.tmp_dir.name, name)
+        for path, content in files.items():
+            os.makedirs(os.path.dirname(os.path.join(root, path)), exist_ok=True)
+            with open(os.path.join(root, path), "w") as f:
+                f.write(content)
+        return root
+
+    def test_cgroup_cpu_limit(self):
+        self.assertEqual(cgroup_cpu_limit(self._cgroup("v2", {"cpu.max": "50000 100000\n"})), 0.5)
+        self.assertIsNone(cgroup_cpu_limit(self._cgroup("v2-max", {"cpu.max": "max 100000\n"})))
+        self.assertEqual(cgroup_cpu_limit(self._cgroup("v1", {"cpu/cpu.cfs_quota_us": "200000",
+                                                              "cpu/cpu.cfs_period_us": "100000"})), 2.0)
+        self.assertIsNone(cgroup_cpu_limit(self._cgroup("v1-max", {"cpu/cpu.cfs_quota_us": "-1",
+                                                                  "cpu/cpu.cfs_period_us": "100000"})))
+        self.assertIsNone(cgroup_cpu_limit(os.path.join(self.tmp_dir.name, "missing")))
+
+    def test_decide(self):
+        qm = SimpleNamespace(service="test", min_parallelism=1, max_parallelism=4)
+        autoscaler = Autoscaler(qm, target_wait=1.0, backlog=4, idle_delay=10, cpu_overcommit=2.0)
+        # 1-CPU quota caps the max workers below max parallelism
+        self.assertEqual(autoscaler.max_workers(1.0), 2)
+        self.assertEqual(autoscaler.max_workers(0.5), 1)
+        self.assertEqual(autoscaler.max_workers(8.0), 4)
+        self.assertEqual(autoscaler.decide(0, 0, None, 2, now=0)[0], 1)
+        self.assertEqual(autoscaler.decide(1, 5, None, 2, now=0)[0], 1)
+        self.assertEqual(autoscaler.decide(1, 1, 2.0, 2, now=0)[0], 1)
+        self.assertEqual(autoscaler.decide(2, 100, 2.0, 2, now=0)[0], 0)
+        self.assertEqual(autoscaler.decide(3, 0, 0.0, 2, now=1)[0], -1)
+        # Drained only once the queue has been idle for idle_delay
+        self.assertEqual(autoscaler.decide(2, 0, 0.0, 2, now=5)[0], 0)
+        self.assertEqual(autoscaler.decide(2, 0, 0.0, 2, now=10)[0], -1)
+        self.assertEqual(autoscaler.decide(1, 0, 0.0, 2, now=30)[0], 0)
+
+    def test_scale_up_and_down(self):
+        qm = ProcessQueueManager(service="autoscaler", parallelism=1, max_limit=100, queue_block_timeout=0.5,
+                                 transport="priority", min_parallelism=1, max_parallelism=3,
+                                 autoscale={"interval": 0.1, "backlog": 2, "idle_delay": 0.5,
+                                            "cpu_overcommit": 100,
+                                            "cgroup_root": self._cgroup("unlimited", {"cpu.max": "max 100000"})})
+        try:
+            for i in range(60):
+                qm.enqueue(json.dumps({"task_id": str(i), "api": "compute"}))
+            qm.consumers(task)
+            deadline = time.monotonic() + 10
+            while qm.autoscaler_stats()["workers"] < 3:
+                self.assertLess(time.monotonic(), deadline, msg="consumers are not scaled up")
+                time.sleep(0.05)
+            # Drained through terminate messages once the backlog is processed
+            deadline = time.monotonic() + 20
+            while len(qm.processes) > 1:
+                self.assertLess(time.monotonic(), deadline, msg="consumers are not scaled down")
+                time.sleep(0.1)
+            stats = qm.autoscaler_stats()
+            self.assertTrue(stats["enabled"])
+            self.assertEqual(stats["workers"], 1)
+            self.assertEqual(stats["max_workers"], 3)
+            self.assertEqual(stats["scale_ups"], 2)
+            self.assertEqual(stats["scale_downs"], 2)
+            self.assertIsNotNone(stats["queue_wait"])
+        finally:
+            qm.stop()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.tmp_dir.cleanup()
@@ -0,0 +1,67 @@
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from app.benchmark import latency_summary, ROOT_DIR
+from app.benchmark.components import benchmark_queue, benchmark_database, benchmark_model
+from app.benchmark.load import parse_mix
+
+
+class TestBenchmark(unittest.TestCase):
+    tmp_dir: tempfile.TemporaryDirectory = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+
+    def test_latency_summary(self):
+        summary = latency_summary([i / 1000 for i in range(1, 101)])
+        self.assertEqual(summary, {"count": 100, "p50_ms": 51.0, "p95_ms": 96.0, "p99_ms": 100.0, "max_ms": 100.0})
+        self.assertEqual(latency_summary([])["count"], 0)
+
+    def test_parse_mix(self):
+        self.assertEqual(parse_mix("evaluate=1,status=3,result"), {"evaluate": 1, "status": 3, "result": 1})
+        with self.assertRaises(ValueError):
+            parse_mix("kill=1")
+
+    def test_components(self):
+        queue = benchmark_queue("simple", messages=200, max_limit=50)
+        self.assertEqual(queue["received"] + queue["rejected"], 200)
+        self.assertEqual(queue["enqueue"]["count"], queue["received"])
+
+        database = benchmark_database(iterations=50)
+        self.assertEqual(set(database), {"insert_json_message", "get_status", "update_status_output_message",
+                                         "get_result"})
+        self.assertTrue(all(stats["count"] == 50 for stats in database.values()))
+
+        model = benchmark_model(iterations=2, batch_size=2, engines=["python"])
+        self.assertEqual(model["python"]["single"]["count"], 2)
+        self.assertEqual(model["python"]["batch"]["count"], 1)
+
+    @unittest.skipUnless(importlib.util.find_spec("uvicorn"), "uvicorn is required to load test the ASGI server")
+    def test_load(self):
+        output = os.path.join(self.tmp_dir.name, "results", "benchmark.json")
+        subprocess.run([sys.executable, "-m", "app.benchmark", "--suite", "load", "--server", "asgi", "--workers", "1",
+                        "--requests", "100", "--concurrency", "4", "--output", output], cwd=ROOT_DIR,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True, timeout=120)
+        with open(output) as f:
+            results = json.load(f)
+        self.assertEqual(results["arguments"]["requests"], 100)
+        load = results["load"]["asgi"]
+        endpoints = load["endpoints"]
+        self.assertEqual(sum(stats["count"] + stats["errors"] for stats in endpoints.values()), 100)
+        self.assertTrue(all(stats["errors"] == 0 for stats in endpoints.values()))
+        self.assertLessEqual(endpoints["status"]["p50_ms"], endpoints["status"]["p99_ms"])
+        tasks = load["tasks"]
+        self.assertEqual(tasks["accepted"] + tasks["rejected"] + tasks["failed"], tasks["submitted"])
+        # Accepted tasks are all computed by the end of the drain
+        self.assertEqual(tasks["completed"], tasks["accepted"])
+        self.assertGreater(tasks["tasks_per_s"], 0)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.tmp_dir.cleanup()
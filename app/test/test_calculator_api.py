@@ -1,12 +1,17 @@
 import json
 import os
+import signal
 import time
 import unittest
+from sqlite3 import Error as SQLiteError
 
 from app import Config, CalculatorMicroservice
-from app.calculator.computation.api import handle_terminate, handle_status, handle_evaluate, handle_result
+from app.calculator.computation.api import handle_terminate, handle_status, handle_evaluate, handle_result, \
+    handle_evaluate_batch, handle_status_batch, handle_result_batch, handle_status_stream, handle_autoscaler_stats, \
+    handle_metrics, handle_latency_stats, handle_kill, handle_watchdog_stats
 from app.calculator.computation.database import CalculatorDatabase
 from app.calculator.computation.service import run_calculator_qm_task
+from app.util.ipc_queue import ShmRingQueue
 from app.util.process_queue_manager import ProcessQueueManager
 
 
@@ -22,6 +27,7 @@ class TestCalculator(unittest.TestCase):
         cls.config = cls.calculator_ms.config
         cls.db = cls.calculator_ms.calculator_db
         cls.db.create_table()
+        cls.db.migrate()
         cls.qm = cls.calculator_ms.calculator_qm
         run_calculator_qm_task(cls.calculator_ms)
 
@@ -94,9 +100,234 @@ class TestCalculator(unittest.TestCase):
                          "Invalid model - invalid; available models are [sum_math_cos]")
         self.assertEqual(result.output, -1)
 
+    def test_unsuccessful_result(self):
+        for task_id in ["failed-task", "cancelled-task"]:
+            self.db.insert_json_message(task_id=task_id, json_message=json.dumps(
+                {"model": "sum_math_cos", "number": 13, "api": "compute", "task_id": task_id}))
+        self.db.update_status_output_message(task_id="failed-task", status="FAILED",
+                                             status_message="timeout; exceeded 1s", output=-1.0)
+        handle_kill(task_id="cancelled-task", ms=self.calculator_ms)
+        # Only the results of completed and running tasks are successful, a status is always read successfully
+        for task_id, status in [("failed-task", "FAILED"), ("cancelled-task", "CANCELLED"), ("missing", "NOT FOUND")]:
+            result = handle_result(task_id=task_id, ms=self.calculator_ms)
+            self.assertEqual((result.response.retcode, result.response.status, result.output), (1, status, -1.0))
+            response = handle_status(task_id=task_id, ms=self.calculator_ms)
+            self.assertEqual((response.response.retcode, response.response.status), (0, status))
+        results = handle_result_batch(task_ids=["failed-task", "cancelled-task"], ms=self.calculator_ms)
+        self.assertEqual([r.response.retcode for r in results.results], [1, 1])
+
+    def test_message_too_large(self):
+        queue, self.qm.queue = self.qm.queue, ShmRingQueue(maxsize=4, slot_size=256)
+        try:
+            response = handle_evaluate(data={"model": "sum_math_cos", "number": 14, "tenant": "t" * 256},
+                                       ms=self.calculator_ms)
+            self.assertEqual((response.response.retcode, response.response.status, response.response.message),
+                             (1, "FAILED", "message-too-large"))
+            # Task is not left PROCESSING
+            self.assertEqual(handle_status(task_id=response.task_id, ms=self.calculator_ms).response.status, "FAILED")
+
+            response = handle_evaluate_batch(data={"items": [{"model": "sum_math_cos", "number": 15}],
+                                                   "tenant": "t" * 256}, ms=self.calculator_ms)
+            self.assertEqual([(r.response.status, r.response.message) for r in response.responses],
+                             [("FAILED", "message-too-large")])
+            self.assertEqual(self.db.get_status(task_id=response.responses[0].task_id),
+                             ("FAILED", "message-too-large"))
+
+            # Items coalesced onto a failed item fail along with it, in the database and in the response
+            response = handle_evaluate_batch(data={"items": [{"model": "sum_math_cos", "number": 16}] * 2,
+                                                   "tenant": "t" * 256}, ms=self.calculator_ms)
+            self.assertEqual([(r.response.retcode, r.response.status, r.response.message) for r in response.responses],
+                             [(1, "FAILED", "message-too-large")] * 2)
+            self.assertEqual([self.db.get_status(task_id=r.task_id) for r in response.responses],
+                             [("FAILED", "message-too-large")] * 2)
+        finally:
+            self.qm.queue.close()
+            self.qm.queue = queue
+
+    def test_autoscaler_stats(self):
+        # Test config runs a fixed single consumer
+        stats = handle_autoscaler_stats(ms=self.calculator_ms)
+        self.assertFalse(stats["enabled"])
+        self.assertEqual(stats["workers"], 1)
+        self.assertEqual(stats["scale_ups"], 0)
+        self.assertIsNone(stats["queue_wait"])
+
+    def test_watchdog(self):
+        # Consumer killed while idle is respawned and the tasks keep being served
+        pid = self.qm.processes[0].pid
+        os.kill(pid, signal.SIGKILL)
+        deadline = time.monotonic() + 10
+        while handle_watchdog_stats(ms=self.calculator_ms)["restarts"]["crashed"] < 1:
+            self.assertLess(time.monotonic(), deadline, msg="consumer is not respawned")
+            time.sleep(0.1)
+        self.assertEqual(len(self.qm.processes), 1)
+        self.assertNotEqual(self.qm.processes[0].pid, pid)
+        # A get left pending by the killed consumer on the manager queue times out first
+        time.sleep(self.config.QUEUE_BLOCK_TIMEOUT)
+        response = handle_evaluate(data={"model": "sum_math_cos", "number": 13}, ms=self.calculator_ms)
+        self.assertEqual(handle_result(task_id=response.task_id, wait=10, ms=self.calculator_ms).response.status,
+                         "COMPLETED")
+
+    def test_metrics(self):
+        response = handle_evaluate(data={"model": "sum_math_cos", "number": 7}, ms=self.calculator_ms)
+        handle_result(task_id=response.task_id, wait=10, ms=self.calculator_ms)
+        # Burst of tasks, only the dequeue of the messages already waiting for the consumer is timed
+        messages = {f"metrics-{i}": json.dumps({"task_id": f"metrics-{i}", "api": "compute", "model": "sum_math_cos",
+                                                "number": 7 + i}) for i in range(20)}
+        for task_id, message in messages.items():
+            self.db.insert_json_message(task_id=task_id, json_message=message)
+        for message in messages.values():
+            self.qm.enqueue(message)
+        for task_id in messages:
+            handle_result(task_id=task_id, wait=10, ms=self.calculator_ms)
+        # Consumer snapshots are flushed every METRICS_FLUSH_INTERVAL
+        deadline = time.monotonic() + 5
+        while "calculator_queue_dequeue_seconds_count" not in handle_metrics(ms=self.calculator_ms):
+            self.assertLess(time.monotonic(), deadline, msg="consumer metrics are not aggregated")
+            time.sleep(0.2)
+        text = handle_metrics(ms=self.calculator_ms)
+        self.assertIn('calculator_compute_seconds_count{model="sum_math_cos"}', text)
+        self.assertIn('calculator_sqlite_seconds_count{method="update_status_output_messages"}', text)
+        self.assertIn('calculator_sqlite_seconds_count{method="insert_coalesced_json_message"}', text)
+        self.assertIn('calculator_task_seconds_count{status="COMPLETED"}', text)
+        self.assertIn("calculator_queue_enqueue_seconds_count", text)
+        self.assertIn("calculator_queue_depth 0", text)
+        self.assertIn("calculator_consumer_workers 1", text)
+
+    def test_latency_stats(self):
+        response = handle_evaluate(data={"model": "sum_math_cos", "number": 9}, ms=self.calculator_ms)
+        handle_result(task_id=response.task_id, wait=10, ms=self.calculator_ms)
+        stats = handle_latency_stats(window=60, ms=self.calculator_ms)
+        self.assertEqual(stats["window"], 60)
+        for stage in ["api", "queue", "dispatch", "compute", "commit", "total"]:
+            self.assertGreaterEqual(stats["stages"][stage]["samples"], 1)
+            self.assertLessEqual(stats["stages"][stage]["p50"], stats["stages"][stage]["max"])
+        self.assertEqual(stats["response"].retcode, 0)
+        # Window is bounded
+        self.assertEqual(handle_latency_stats(window=10 ** 9, ms=self.calculator_ms)["window"],
+                         self.config.LATENCY_MAX_WINDOW)
+
+        # Database error is reported in the response instead of failing the request
+        def broken(**_):
+            raise SQLiteError("database is locked")
+
+        self.db.get_latency_percentiles = broken
+        try:
+            stats = handle_latency_stats(window=60, ms=self.calculator_ms)
+        finally:
+            del self.db.get_latency_percentiles
+        self.assertEqual((stats["stages"], stats["response"].retcode, stats["response"].status,
+                          stats["response"].message), ({}, 1, "ERROR", "database is locked"))
+
+    def test_kill(self):
+        payload = {"model": "sum_math_cos", "number": 11, "api": "compute", "task_id": "kill-me"}
+        self.db.insert_json_message(task_id="kill-me", json_message=json.dumps(payload))
+        response = handle_kill(task_id="kill-me", ms=self.calculator_ms)
+        self.assertEqual(response.response.retcode, 0)
+        self.assertEqual(response.response.status, "CANCELLED")
+        # Message still on the queue is skipped by the consumer
+        self.qm.enqueue(json.dumps(payload))
+        response = handle_evaluate(data={"model": "sum_math_cos", "number": 12}, ms=self.calculator_ms)
+        self.assertEqual(handle_result(task_id=response.task_id, wait=10, ms=self.calculator_ms).response.status,
+                         "COMPLETED")
+        result = handle_result(task_id="kill-me", ms=self.calculator_ms)
+        self.assertEqual((result.response.status, result.output), ("CANCELLED", -1.0))
+
+        # Final and unknown tasks are not cancelled
+        response = handle_kill(task_id="kill-me", ms=self.calculator_ms)
+        self.assertEqual((response.response.retcode, response.response.status), (1, "CANCELLED"))
+        response = handle_kill(task_id="missing", ms=self.calculator_ms)
+        self.assertEqual((response.response.retcode, response.response.status), (1, "NOT FOUND"))
+
+    def test_result_cache(self):
+        payload = {
+            "model": "sum_math_cos",
+            "number": 3
+        }
+
+        response = handle_evaluate(data=dict(payload), ms=self.calculator_ms)
+        self.assertEqual(response.response.message, "ok-queued")
+        time.sleep(1)  # To give time for qm to process
+        result = handle_result(task_id=response.task_id, ms=self.calculator_ms)
+        self.assertEqual(result.response.status, "COMPLETED")
+
+        # Identical request is completed straight away from the cache
+        hits = self.calculator_ms.calculator_cache.stats()["hits"]
+        cached_response = handle_evaluate(data=dict(payload), ms=self.calculator_ms)
+        self.assertNotEqual(cached_response.task_id, response.task_id)
+        self.assertEqual(cached_response.response.retcode, 0)
+        self.assertEqual(cached_response.response.status, "COMPLETED")
+        self.assertEqual(cached_response.response.message, "ok-cached")
+        cached_result = handle_result(task_id=cached_response.task_id, ms=self.calculator_ms)
+        self.assertEqual(cached_result.response.status, "COMPLETED")
+        self.assertEqual(cached_result.output, result.output)
+        self.assertEqual(self.calculator_ms.calculator_cache.stats()["hits"], hits + 1)
+
+    def test_evaluate_batch(self):
+        self.config.BATCH_CHUNK_SIZE = 2
+        items = [{"model": "sum_math_cos", "number": number} for number in [4, 5, 6]]
+        items += [{"model": "sum_math_cos", "number": 4}, {"model": "invalid", "number": 1}]
+        response = handle_evaluate_batch(data={"items": items, "tenant": "batch"}, ms=self.calculator_ms)
+        self.assertEqual(response.response.retcode, 0)
+        self.assertEqual([r.response.message for r in response.responses],
+                         ["ok-queued", "ok-queued", "ok-queued", "ok-coalesced", "ok-queued"])
+        task_ids = [r.task_id for r in response.responses]
+        self.assertEqual(len(set(task_ids)), len(items))
+
+        time.sleep(1)  # To give time for qm to process
+        statuses = handle_status_batch(task_ids=task_ids + ["missing"], ms=self.calculator_ms)
+        self.assertEqual([r.task_id for r in statuses.responses], task_ids + ["missing"])
+        self.assertEqual([r.response.status for r in statuses.responses],
+                         ["COMPLETED", "COMPLETED", "COMPLETED", "COMPLETED", "ERROR", "NOT FOUND"])
+        results = handle_result_batch(task_ids=task_ids, ms=self.calculator_ms)
+        self.assertEqual(results.results[0].output, results.results[3].output)
+        self.assertEqual(results.results[4].response.retcode, 1)
+
+        too_large = handle_evaluate_batch(data={"items": items * self.config.BATCH_MAX_ITEMS},
+                                          ms=self.calculator_ms)
+        self.assertEqual(too_large.response.status, "FAILED")
+        self.assertEqual(too_large.responses, [])
+
+    def test_long_poll_result(self):
+        response = handle_evaluate(data={"model": "sum_math_cos", "number": 7}, ms=self.calculator_ms)
+        self.assertEqual(response.response.message, "ok-queued")
+        # Completion is notified by the consumer, no sleep or polling needed
+        result = handle_result(task_id=response.task_id, wait=10, ms=self.calculator_ms)
+        self.assertEqual(result.response.status, "COMPLETED")
+        self.assertEqual(result.output, handle_result(task_id=response.task_id, ms=self.calculator_ms).output)
+
+        # Unknown task is returned straight away
+        start = time.monotonic()
+        result = handle_result(task_id="missing", wait=10, ms=self.calculator_ms)
+        self.assertEqual(result.response.status, "NOT FOUND")
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_status_stream(self):
+        items = [{"model": "sum_math_cos", "number": 8}, {"model": "sum_math_cos", "number": 8},
+                 {"model": "invalid", "number": 8}]
+        response = handle_evaluate_batch(data={"items": items}, ms=self.calculator_ms)
+        task_ids = [r.task_id for r in response.responses]
+        events = [event for event in handle_status_stream(task_ids=task_ids + ["missing"], ms=self.calculator_ms)
+                  if event.startswith("event: status")]
+        statuses = {}
+        for event in events:
+            data = json.loads(event.split("data: ", 1)[1])
+            statuses.setdefault(data["task_id"], []).append(data["status"])
+        # Coalesced follower is notified along with its leader
+        for task_id, status in zip(task_ids, ["COMPLETED", "COMPLETED", "ERROR"]):
+            self.assertEqual(statuses[task_id][-1], status)
+        self.assertEqual(statuses["missing"], ["NOT FOUND"])
+
     @classmethod
     def tearDownClass(cls) -> None:
         handle_terminate(cls.qm)
         cls.db.execute(f"DROP TABLE IF EXISTS {cls.config.CALCULATOR_SQLITE_TABLE_NAME}")
-        os.remove(os.path.join(cls.config.DB_PATH, f'{cls.config.CALCULATOR_SQLITE_DB_NAME}.db'))
+        cls.db.close()
+        for db_name in [cls.config.CALCULATOR_SQLITE_DB_NAME, cls.config.ARCHIVE_SQLITE_DB_NAME]:
+            db_file = os.path.join(cls.config.DB_PATH, f'{db_name}.db')
+            os.remove(db_file)
+            # Write-ahead log files left behind by consumer processes
+            for suffix in ["-wal", "-shm"]:
+                if os.path.exists(db_file + suffix):
+                    os.remove(db_file + suffix)
         cls.qm.stop()
@@ -0,0 +1,256 @@
+import json
+import multiprocessing
+import pickle
+import tempfile
+import unittest
+from datetime import datetime
+from sqlite3 import Error as SQLiteError
+
+from app import Config
+from app.calculator.computation.database import CalculatorDatabase
+from app.calculator.computation.lifecycle import now_ms, wall_ms
+
+
+def get_status(db: CalculatorDatabase, task_id: str, queue: multiprocessing.Queue):
+    queue.put(db.get_status(task_id=task_id))
+    db.close()
+
+
+class TestCalculatorDatabase(unittest.TestCase):
+    db: CalculatorDatabase = None
+    tmp_dir: tempfile.TemporaryDirectory = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        config = Config()
+        config.DB_PATH = cls.tmp_dir.name
+        cls.db = CalculatorDatabase(config)
+        cls.db.create_table()
+        cls.db.migrate()
+
+    def test_coalesced_json_message(self):
+        payload = json.dumps({"model": "sum_math_cos", "number": 1, "api": "compute"})
+        leader = self.db.insert_coalesced_json_message(task_id="leader", json_message=payload, cache_key="key")
+        follower_1 = self.db.insert_coalesced_json_message(task_id="follower-1", json_message=payload,
+                                                           cache_key="key")
+        follower_2 = self.db.insert_coalesced_json_message(task_id="follower-2", json_message=payload,
+                                                           cache_key="key")
+        self.assertEqual([leader, follower_1, follower_2], ["leader", "leader", "leader"])
+
+        # Only the leader is replayed by the crash recovery
+        messages = self.db.get_json_messages(event_time=int(datetime.now().strftime('%s')))
+        self.assertEqual(messages, [payload])
+
+        # Result of the leader is fanned out to the followers
+        self.db.update_status_output_message(task_id="leader", status="COMPLETED", status_message="COMPLETED",
+                                             output=1.5)
+        for task_id in ["leader", "follower-1", "follower-2"]:
+            self.assertEqual(self.db.get_result(task_id=task_id), ("COMPLETED", 1.5, "COMPLETED"))
+
+        # Leadership is released once the leader has completed
+        leader = self.db.insert_coalesced_json_message(task_id="next", json_message=payload, cache_key="key")
+        self.assertEqual(leader, "next")
+
+    def test_migration_idempotent(self):
+        self.assertEqual(self.db.migrate(), [])
+        versions = self.db.execute(f"SELECT version FROM {self.db.query.MIGRATION_TABLE_NAME} ORDER BY version")
+        self.assertEqual([row[0] for row in versions], [version for version, _, _ in self.db.query.MIGRATIONS])
+
+    def test_query_plan_index(self):
+        # Index searches, not index-only plans - the messages and outputs are read from the table
+        query = self.db.query
+        for statement, parameters, index in [(query.GET_JSON_MESSAGES, (0,), query.PENDING_INDEX_NAME),
+                                             (query.GET_JSON_MESSAGE_PAGE, (0, -1, "", 10), query.PENDING_INDEX_NAME),
+                                             (query.GET_STATUS, ("task",), "sqlite_autoindex"),
+                                             (query.GET_RESULT, ("task",), "sqlite_autoindex")]:
+            plan = self.db.execute(f"EXPLAIN QUERY PLAN {statement}", parameters)
+            details = [row[3] for row in plan]
+            self.assertIn(f"USING INDEX {index}", details[0], msg=details)
+            for detail in details:
+                self.assertNotIn("SCAN", detail, msg=details)
+
+    def test_narrow_indexes(self):
+        # Indexes do not hold a copy of the messages and outputs
+        columns = {name: [row[2] for row in self.db.execute(f"PRAGMA index_info({name})")]
+                   for name, in self.db.execute(f"SELECT name FROM sqlite_master WHERE type = 'index' "
+                                                f"AND tbl_name = '{self.db.TABLE_NAME}'")}
+        self.assertEqual(columns[self.db.query.PENDING_INDEX_NAME], ["event_time", "task_id"])
+        self.assertEqual([column for index in columns.values() for column in index
+                          if column in ["json_message", "status_message", "output"]], [])
+
+    def test_batch_json_messages(self):
+        payload = json.dumps({"model": "sum_math_cos", "number": 2, "api": "compute"})
+        leaders = self.db.insert_json_messages(rows=[("batch-leader", payload, "batch-key", None),
+                                                     ("batch-follower", payload, "batch-key", None),
+                                                     ("batch-cached", payload, "cached-key", 2.5),
+                                                     ("batch-invalid", payload, None, None)])
+        self.assertEqual(leaders, ["batch-leader", "batch-leader", "batch-cached", "batch-invalid"])
+
+        self.db.update_status_output_messages(rows=[("batch-leader", "COMPLETED", "COMPLETED", 1.5)])
+        task_ids = ["batch-leader", "batch-follower", "batch-cached", "batch-invalid", "missing"]
+        self.assertEqual(self.db.get_statuses(task_ids=task_ids), {
+            "batch-leader": ("COMPLETED", "COMPLETED"),
+            "batch-follower": ("COMPLETED", "COMPLETED"),
+            "batch-cached": ("COMPLETED", "COMPLETED"),
+            "batch-invalid": ("PROCESSING", "PROCESSING"),
+        })
+        results = self.db.get_results(task_ids=task_ids)
+        self.assertEqual(results["batch-follower"], ("COMPLETED", 1.5, "COMPLETED"))
+        self.assertEqual(results["batch-cached"], ("COMPLETED", 2.5, "COMPLETED"))
+        self.assertNotIn("missing", results)
+        self.db.update_status_output_messages(rows=[("batch-invalid", "ERROR", "ERROR", -1.0)])
+
+        # Task ids are looked up on the primary key, only the bound JSON array is scanned
+        for statement in [self.db.query.GET_STATUSES, self.db.query.GET_RESULTS]:
+            plan = self.db.execute(f"EXPLAIN QUERY PLAN {statement}", (json.dumps(task_ids),))
+            details = [row[3] for row in plan]
+            self.assertIn("USING INDEX sqlite_autoindex", details[0], msg=details)
+            self.assertEqual([detail for detail in details if "SCAN" in detail and "json_each" not in detail], [])
+
+    def test_report_shard(self):
+        payload = json.dumps({"model": "sum_math_cos", "number": 3, "api": "compute"})
+        self.db.insert_coalesced_json_message(task_id="sharded", json_message=payload, cache_key="sharded-key")
+        self.db.insert_coalesced_json_message(task_id="sharded-follower", json_message=payload,
+                                              cache_key="sharded-key")
+        # Shards report in any order, the task is completed by the last one only
+        for shard, output in [(2, 4.0), (0, 1.0)]:
+            self.assertEqual(self.db.report_shard(task_id="sharded", shard=shard, shard_count=3, status="COMPLETED",
+                                                  status_message="COMPLETED", output=output, combine=sum), [])
+            self.assertEqual(self.db.get_status(task_id="sharded"), ("PROCESSING", "PROCESSING"))
+        updated = self.db.report_shard(task_id="sharded", shard=1, shard_count=3, status="COMPLETED",
+                                       status_message="COMPLETED", output=2.0,
+                                       combine=lambda outputs: outputs[0] * 100 + outputs[1] * 10 + outputs[2])
+        # Partial outputs are combined in shard order
+        self.assertEqual(updated, [("sharded", "COMPLETED", "COMPLETED", 124.0),
+                                   ("sharded-follower", "COMPLETED", "COMPLETED", 124.0)])
+
+        # First failed shard fails the task, late shards are discarded
+        self.db.insert_json_message(task_id="sharded-error", json_message=payload)
+        updated = self.db.report_shard(task_id="sharded-error", shard=0, shard_count=2, status="ERROR",
+                                       status_message="boom", output=-1.0, combine=sum)
+        self.assertEqual(updated, [("sharded-error", "ERROR", "boom", -1.0)])
+        self.assertEqual(self.db.report_shard(task_id="sharded-error", shard=1, shard_count=2, status="COMPLETED",
+                                              status_message="COMPLETED", output=1.0, combine=sum), [])
+        self.assertEqual(self.db.get_result(task_id="sharded-error"), ("ERROR", -1.0, "boom"))
+        self.assertEqual(self.db.execute(f"SELECT COUNT(*) FROM {self.db.query.SHARD_TABLE_NAME}"), [(0,)])
+
+    def test_cancel_task(self):
+        payload = json.dumps({"model": "sum_math_cos", "number": 4, "api": "compute"})
+        for task_id in ["cancel-leader", "cancel-follower-1", "cancel-follower-2"]:
+            self.db.insert_coalesced_json_message(task_id=task_id, json_message=payload, cache_key="cancel-key")
+        # Cancelled follower is detached, the leader keeps computing for the other follower
+        self.assertEqual(self.db.cancel_task(task_id="cancel-follower-1"),
+                         ("PROCESSING", "PROCESSING", [("cancel-follower-1", "CANCELLED", "CANCELLED", -1.0)], []))
+        self.db.report_shard(task_id="cancel-leader", shard=0, shard_count=2, status="COMPLETED",
+                             status_message="COMPLETED", output=1.0, combine=sum)
+        # Cancelled leader hands its computation over to the follower, which is not cancelled
+        self.assertEqual(self.db.cancel_task(task_id="cancel-leader"),
+                         ("PROCESSING", "PROCESSING", [("cancel-leader", "CANCELLED", "CANCELLED", -1.0)], []))
+        self.assertEqual(self.db.get_cancelled(task_ids=["cancel-leader", "cancel-follower-1"]), ["cancel-follower-1"])
+        self.assertEqual(json.loads(self.db.get_pending_json_messages(task_ids=["cancel-leader"])["cancel-leader"]),
+                         json.loads(payload))
+        # Later identical tasks coalesce into the promoted follower
+        self.assertEqual(self.db.insert_coalesced_json_message(task_id="cancel-follower-3", json_message=payload,
+                                                               cache_key="cancel-key"), "cancel-follower-2")
+        # Last shard of the computation completes the promoted follower and the tasks coalesced into it
+        self.assertEqual(self.db.report_shard(task_id="cancel-leader", shard=1, shard_count=2, status="COMPLETED",
+                                              status_message="COMPLETED", output=1.0, combine=sum),
+                         [("cancel-follower-2", "COMPLETED", "COMPLETED", 2.0),
+                          ("cancel-follower-3", "COMPLETED", "COMPLETED", 2.0)])
+        self.assertEqual(self.db.execute(f"SELECT COUNT(*) FROM {self.db.query.SHARD_TABLE_NAME}"), [(0,)])
+        for task_id, result in [("cancel-leader", ("CANCELLED", -1.0, "CANCELLED")),
+                                ("cancel-follower-1", ("CANCELLED", -1.0, "CANCELLED")),
+                                ("cancel-follower-2", ("COMPLETED", 2.0, "COMPLETED"))]:
+            self.assertEqual(self.db.get_result(task_id=task_id), result)
+        self.assertEqual(self.db.cancel_task(task_id="cancel-leader"), ("CANCELLED", "CANCELLED", [], []))
+        self.assertEqual(self.db.cancel_task(task_id="missing"), ("NOT FOUND", "NOT FOUND", [], []))
+
+    def test_cancel_promoted_leader(self):
+        payload = json.dumps({"model": "sum_math_cos", "number": 5, "api": "compute"})
+        for task_id in ["promoted-leader", "promoted-follower"]:
+            self.db.insert_coalesced_json_message(task_id=task_id, json_message=payload, cache_key="promoted-key")
+        self.db.cancel_task(task_id="promoted-leader")
+        # Last task waiting for the computation stops it, under the task_id it was started with
+        self.assertEqual(self.db.cancel_task(task_id="promoted-follower"),
+                         ("PROCESSING", "PROCESSING", [("promoted-follower", "CANCELLED", "CANCELLED", -1.0)],
+                          ["promoted-follower", "promoted-leader"]))
+        self.assertEqual(sorted(self.db.get_cancelled(task_ids=["promoted-leader", "promoted-follower"])),
+                         ["promoted-follower", "promoted-leader"])
+        # Results committed after the cancellation are discarded
+        self.assertEqual(self.db.update_status_output_messages(
+            rows=[("promoted-leader", "COMPLETED", "COMPLETED", 2.0)]), [])
+        for task_id in ["promoted-leader", "promoted-follower"]:
+            self.assertEqual(self.db.get_result(task_id=task_id), ("CANCELLED", -1.0, "CANCELLED"))
+        # Leadership is released
+        self.assertEqual(self.db.insert_coalesced_json_message(task_id="promoted-next", json_message=payload,
+                                                               cache_key="promoted-key"), "promoted-next")
+        self.db.cancel_task(task_id="promoted-next")
+
+    def test_lifecycle_percentiles(self):
+        payload = json.dumps({"model": "sum_math_cos", "number": 1, "api": "compute"})
+        base = now_ms() - 1000
+        rows, lifecycle = [], []
+        for i in range(1, 11):
+            self.db.insert_json_message(task_id=f"lifecycle-{i}", json_message=payload)
+            rows.append((f"lifecycle-{i}", "COMPLETED", "COMPLETED", 1.0))
+            # (task_id, accepted, enqueued, dequeued, compute_start, compute_end), compute takes i ms
+            lifecycle.append((f"lifecycle-{i}", base, base + 2, base + 20, base + 21, base + 21 + i))
+        self.db.update_status_output_messages(rows=rows, lifecycle=lifecycle)
+
+        # Shards of a task are merged - first dequeue to last compute end
+        self.db.insert_json_message(task_id="lifecycle-sharded", json_message=payload)
+        for shard, (dequeued, compute_end) in enumerate([(base + 30, base + 40), (base + 25, base + 60)]):
+            self.db.report_shard(task_id="lifecycle-sharded", shard=shard, shard_count=2, status="COMPLETED",
+                                 status_message="COMPLETED", output=1.0, combine=sum,
+                                 lifecycle=("lifecycle-sharded", base, base + 2, dequeued, dequeued, compute_end))
+        row = self.db.execute(f"SELECT dequeued, compute_start, compute_end FROM {self.db.query.LIFECYCLE_TABLE_NAME} "
+                              f"WHERE task_id = 'lifecycle-sharded'")
+        self.assertEqual(row, [(base + 25, base + 25, base + 60)])
+
+        stages = self.db.get_latency_percentiles(since_time=wall_ms() - 60000)
+        # Nearest-rank (samples, p50, p95, p99, max) over the 10 tasks and the sharded one
+        self.assertEqual(stages["api"], (11, 2, 2, 2, 2))
+        self.assertEqual(stages["compute"], (11, 6, 35, 35, 35))
+        self.assertEqual(stages["queue"][0], 11)
+        self.assertGreaterEqual(stages["total"][1], 1000)
+        self.assertEqual(self.db.get_latency_percentiles(since_time=wall_ms() + 60000), {})
+
+    def test_json_message_with_quote(self):
+        payload = json.dumps({"model": "it's", "number": 1, "api": "compute"})
+        self.db.insert_json_message(task_id="quoted", json_message=payload)
+        self.db.update_status_output_message(task_id="quoted", status="ERROR", status_message="Invalid model - it's",
+                                             output=-1.0)
+        self.assertEqual(self.db.get_result(task_id="quoted"), ("ERROR", -1.0, "Invalid model - it's"))
+        self.assertEqual(self.db.execute(f"SELECT json_message FROM {self.db.TABLE_NAME} WHERE task_id = ?",
+                                         ("quoted",)), [(payload,)])
+
+    def test_connection_pool(self):
+        self.db.insert_json_message(task_id="pooled", json_message="{}")
+        conn = self.db.pool.acquire()
+        self.db.pool.release(conn)
+        self.assertIs(self.db.pool.acquire(), conn)
+        self.db.pool.release(conn)
+        self.assertEqual(conn.execute("PRAGMA journal_mode").fetchone()[0], "wal")
+
+        # Failed statement is rolled back and the connection is still reusable
+        with self.assertRaises(SQLiteError):
+            self.db.execute("SELECT * FROM missing_table")
+        self.assertEqual(self.db.get_status(task_id="pooled"), ("PROCESSING", "PROCESSING"))
+
+        # Pool is recreated in forked and spawned child processes
+        pickled = pickle.loads(pickle.dumps(self.db))
+        self.assertIsNone(pickled.pool._idle)
+        for method in ["fork", "spawn"]:
+            context = multiprocessing.get_context(method)
+            queue = context.Queue()
+            process = context.Process(target=get_status, args=(self.db, "pooled", queue))
+            process.start()
+            self.assertEqual(queue.get(timeout=30), ("PROCESSING", "PROCESSING"))
+            process.join()
+        self.assertEqual(self.db.get_status(task_id="pooled"), ("PROCESSING", "PROCESSING"))
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.db.close()
+        cls.tmp_dir.cleanup()
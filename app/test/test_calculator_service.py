@@ -0,0 +1,245 @@
+import copy
+import json
+import os
+import queue
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+
+from app import Config
+from app.calculator.computation.cache import ResultCache
+from app.calculator.computation.database import CalculatorDatabase
+from app.calculator.computation.model import Model
+from app.calculator.computation.recovery import LeaseRecovery
+from app.calculator.computation.service import dequeue_batch, compute_batch, compute_shard, skip_cancelled, \
+    recover_lost_tasks, task, interruption
+from app.util.cancellation import CancellationBoard
+from app.util.process_queue_manager import ProcessQueueManager
+
+
+class TestCalculatorService(unittest.TestCase):
+    db: CalculatorDatabase = None
+    cache: ResultCache = None
+    config: Config = None
+    tmp_dir: tempfile.TemporaryDirectory = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        config = Config()
+        config.DB_PATH = cls.tmp_dir.name
+        config.CONSUMER_BATCH_SIZE = 3
+        config.QUEUE_BLOCK_TIMEOUT = 0.1
+        cls.config = config
+        cls.db = CalculatorDatabase(config)
+        cls.db.create_table()
+        cls.db.migrate()
+        cls.cache = ResultCache(config, cls.db)
+
+    def test_dequeue_batch(self):
+        tasks = queue.Queue()
+        for i in range(4):
+            tasks.put(json.dumps({"task_id": str(i), "api": "compute"}))
+        tasks.put(json.dumps({"task_id": "4", "api": "terminate"}))
+        tasks.put(json.dumps({"task_id": "5", "api": "compute"}))
+
+        self.assertEqual([payload["task_id"] for payload in dequeue_batch(tasks, self.config)], ["0", "1", "2"])
+        # Terminate message closes the batch, the next message is left to the other consumers
+        self.assertEqual([payload["task_id"] for payload in dequeue_batch(tasks, self.config)], ["3", "4"])
+        self.assertEqual([payload["task_id"] for payload in dequeue_batch(tasks, self.config)], ["5"])
+        with self.assertRaises(queue.Empty):
+            dequeue_batch(tasks, self.config)
+
+    def test_compute_batch(self):
+        payloads = [
+            {"task_id": "batch-0", "api": "compute", "model": "sum_math_cos", "number": 0},
+            {"task_id": "batch-1", "api": "compute", "model": "sum_math_cos", "number": 0},
+            {"task_id": "batch-2", "api": "compute", "model": "sum_math_cos", "number": 1},
+            {"task_id": "batch-3", "api": "compute", "model": "invalid", "number": 1},
+            {"task_id": "batch-4", "api": "compute", "model": "sum_math_cos", "number": "abc"},
+        ]
+        for payload in payloads:
+            self.db.insert_json_message(task_id=payload["task_id"], json_message=json.dumps(payload))
+        compute_batch(payloads, self.db, self.cache)
+
+        self.assertEqual(self.db.get_result(task_id="batch-0"), ("COMPLETED", 1000000.0, "COMPLETED"))
+        self.assertEqual(self.db.get_result(task_id="batch-1"), ("COMPLETED", 1000000.0, "COMPLETED"))
+        self.assertEqual(self.db.get_result(task_id="batch-2")[0], "COMPLETED")
+        self.assertEqual(self.db.get_result(task_id="batch-3"),
+                         ("ERROR", -1.0, "Invalid model - invalid; available models are [sum_math_cos]"))
+        self.assertEqual(self.db.get_result(task_id="batch-4")[0], "ERROR")
+        # Identical inputs of the batch are computed once
+        self.assertEqual(self.cache.stats()["memory_size"], 2)
+
+    def test_compute_shard(self):
+        tasks = queue.Queue()
+        payload = {"task_id": "shard", "api": "compute", "model": "sum_math_cos", "number": 2}
+        self.db.insert_json_message(task_id="shard", json_message=json.dumps(payload))
+        for shard, (start, stop) in enumerate(Model.shard_ranges("sum_math_cos", 2)):
+            tasks.put(json.dumps({**payload, "api": "compute_shard", "shard": shard, "shards": 2,
+                                  "start": start, "stop": stop}))
+        # Every shard is a batch of its own so that the shards are scattered across the consumers
+        batches = [dequeue_batch(tasks, self.config) for _ in range(2)]
+        self.assertEqual([[data["shard"] for data in batch] for batch in batches], [[0], [1]])
+        for batch in reversed(batches):
+            compute_shard(batch[0], self.db, self.cache)
+        self.assertEqual(self.db.get_result(task_id="shard"), ("COMPLETED", 1000000.0, "COMPLETED"))
+        self.assertEqual(self.cache.get(self.cache.key("sum_math_cos", 2)), 1000000.0)
+
+    def test_cancelled_computation(self):
+        board = CancellationBoard()
+        cache = ResultCache(self.config, self.db)
+        payloads = [{"task_id": f"cancel-{i}", "api": "compute", "model": "sum_math_cos", "number": 10 + i}
+                    for i in range(3)]
+        for payload in payloads:
+            self.db.insert_json_message(task_id=payload["task_id"], json_message=json.dumps(payload))
+        for task_id in ["cancel-0", "cancel-1"]:
+            self.db.cancel_task(task_id=task_id)
+        board.cancel(["cancel-0"])
+        # Queued task cancelled already is not computed
+        self.assertEqual([payload["task_id"] for payload in skip_cancelled(payloads, board)], ["cancel-1", "cancel-2"])
+
+        # Group of a cancelled task and a live one is computed, only the result of the live one is committed
+        board.cancel(["cancel-1"])
+        compute_batch(payloads[1:], self.db, cache, cancellation=board)
+        self.assertEqual(self.db.get_status(task_id="cancel-1"), ("CANCELLED", "CANCELLED"))
+        self.assertEqual(self.db.get_status(task_id="cancel-2"), ("COMPLETED", "COMPLETED"))
+
+        # Running shard of a cancelled task is preempted
+        shard = {**payloads[0], "api": "compute_shard", "shard": 0, "shards": 2, "start": 0, "stop": 10 ** 6}
+        compute_shard(shard, self.db, cache, cancellation=board)
+        self.assertEqual(self.db.get_status(task_id="cancel-0"), ("CANCELLED", "CANCELLED"))
+        self.assertEqual(self.db.execute(f"SELECT COUNT(*) FROM {self.db.query.SHARD_TABLE_NAME} "
+                                         f"WHERE task_id = 'cancel-0'"), [(0,)])
+
+    def test_cancelled_leader(self):
+        board = CancellationBoard()
+        payload = {"task_id": "coalesced-leader", "api": "compute", "model": "sum_math_cos", "number": 40}
+        for task_id in ["coalesced-leader", "coalesced-follower"]:
+            message = json.dumps({**payload, "task_id": task_id})
+            self.db.insert_coalesced_json_message(task_id=task_id, json_message=message, cache_key="coalesced-key")
+        stopped = self.db.cancel_task(task_id="coalesced-leader")[3]
+        board.cancel(stopped)
+        # Computation dequeued under the task_id of the cancelled leader goes on for the promoted follower
+        self.assertEqual(skip_cancelled([payload], board), [payload])
+        compute_batch([payload], self.db, ResultCache(self.config, self.db), cancellation=board)
+        self.assertEqual(self.db.get_status(task_id="coalesced-leader"), ("CANCELLED", "CANCELLED"))
+        self.assertEqual(self.db.get_status(task_id="coalesced-follower"), ("COMPLETED", "COMPLETED"))
+
+    def test_cancelled_in_database(self):
+        # Killed by an API process of another pod, its cancellation board is not shared with this consumer
+        for task_id in ["remote-0", "remote-1"]:
+            self.db.insert_json_message(task_id=task_id, json_message=json.dumps({
+                "task_id": task_id, "api": "compute", "model": "sum_math_cos", "number": 30}))
+        cancelled = interruption(["remote-0", "remote-1"], None, CancellationBoard(), db=self.db, poll_interval=0.05)
+        self.db.cancel_task(task_id="remote-0")
+        time.sleep(0.1)
+        self.assertFalse(cancelled())
+        self.db.cancel_task(task_id="remote-1")
+        # Checked once per poll interval
+        self.assertFalse(cancelled())
+        time.sleep(0.1)
+        self.assertTrue(cancelled())
+
+        config = copy.copy(self.config)
+        config.QUEUE_TRANSPORT = "lease"
+        config.CANCELLATION_POLL_INTERVAL = 0.01
+        shard = {"task_id": "remote-0", "api": "compute_shard", "model": "sum_math_cos", "number": 30, "shard": 0,
+                 "shards": 1, "start": 0, "stop": 10 ** 9}
+        start = time.monotonic()
+        compute_shard(shard, self.db, ResultCache(config, self.db), config=config)
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(self.db.get_status(task_id="remote-0"), ("CANCELLED", "CANCELLED"))
+
+    def test_compute_timeout(self):
+        config = copy.copy(self.config)
+        config.MODEL_TIMEOUTS = {"sum_math_cos": 1e-9}
+        payloads = [{"task_id": f"timeout-{i}", "api": "compute", "model": "sum_math_cos", "number": 20 + i}
+                    for i in range(2)]
+        for payload in payloads:
+            self.db.insert_json_message(task_id=payload["task_id"], json_message=json.dumps(payload))
+        compute_batch(payloads, self.db, ResultCache(config, self.db), config=config)
+        for payload in payloads:
+            self.assertEqual(self.db.get_result(task_id=payload["task_id"]),
+                             ("FAILED", -1.0, "timeout; exceeded 2e-09s"))
+
+    def test_recover_lost_tasks(self):
+        enqueued = []
+        qm = SimpleNamespace(enqueue=enqueued.append)
+        for task_id in ["lost-0", "lost-1", "lost-2", "lost-shard", "lost-done"]:
+            self.db.insert_json_message(task_id=task_id, json_message=json.dumps({
+                "task_id": task_id, "api": "compute", "model": "sum_math_cos", "number": 1}))
+        self.db.update_status_output_message(task_id="lost-done", status="COMPLETED", status_message="COMPLETED",
+                                             output=1.0)
+        inflight = [["lost-0", 0], ["lost-1", 1], ["lost-shard", 0, 1, 2, 500000, 1000000], ["lost-done", 0]]
+        # Retried once, then failed with the reason the consumer was lost
+        self.assertEqual(recover_lost_tasks(inflight, "crashed", qm, self.db, self.config), (2, 1))
+        self.assertEqual([json.loads(message) for message in enqueued], [
+            {"task_id": "lost-0", "api": "compute", "model": "sum_math_cos", "number": 1, "attempts": 1},
+            {"task_id": "lost-shard", "api": "compute_shard", "model": "sum_math_cos", "number": 1, "attempts": 1,
+             "shard": 1, "shards": 2, "start": 500000, "stop": 1000000}])
+        self.assertEqual(self.db.get_result(task_id="lost-1"), ("FAILED", -1.0, "worker-crashed"))
+        self.assertEqual(self.db.get_status(task_id="lost-done"), ("COMPLETED", "COMPLETED"))
+
+        # Task which has outlived its timeout is not retried
+        self.assertEqual(recover_lost_tasks([["lost-2", 0], ["lost-shard", 1, 0, 2, 0, 500000]], "timeout", qm,
+                                            self.db, self.config), (0, 2))
+        self.assertEqual(self.db.get_result(task_id="lost-2"), ("FAILED", -1.0, "worker-timeout"))
+        self.assertEqual(self.db.get_result(task_id="lost-shard"), ("FAILED", -1.0, "worker-timeout"))
+
+    def test_lease_replicas(self):
+        # Replicas share the task database and the lease queue next to it
+        lease = {"database": os.path.join(self.config.DB_PATH, "queue.db"), "poll_interval": 0.05,
+                 "pragmas": self.config.SQLITE_PRAGMAS}
+        replicas = [ProcessQueueManager(service="replicas", parallelism=1, max_limit=20, queue_block_timeout=1,
+                                        transport="lease", lease=lease) for _ in range(2)]
+        try:
+            for qm in replicas:
+                qm.consumers(task, self.db, self.config, ResultCache(self.config, self.db))
+            task_ids = [f"replica-{i}" for i in range(6)]
+            for i, task_id in enumerate(task_ids):
+                message = json.dumps({"task_id": task_id, "api": "compute", "model": "sum_math_cos", "number": i})
+                self.db.insert_json_message(task_id=task_id, json_message=message)
+                replicas[i % 2].enqueue(message)
+            deadline = time.time() + 10
+            while time.time() < deadline:
+                if all(status == "COMPLETED" for status, _ in self.db.get_statuses(task_ids).values()):
+                    break
+                time.sleep(0.05)
+            self.assertEqual({status for status, _ in self.db.get_statuses(task_ids).values()}, {"COMPLETED"})
+            # Terminate message drains the consumer of its own replica
+            for qm in replicas:
+                qm.scale_down()
+            for qm in replicas:
+                qm.processes[0].join(timeout=10)
+                self.assertEqual(qm.processes[0].exitcode, 0)
+            # Every message has been acknowledged
+            self.assertEqual(replicas[0].queue._execute("SELECT count(*) FROM replicas_queue")[0], [(0,)])
+        finally:
+            for qm in replicas:
+                qm.stop()
+
+    def test_lease_recovery(self):
+        lease = {"database": os.path.join(self.config.DB_PATH, "queue.db"), "pragmas": self.config.SQLITE_PRAGMAS}
+        qm = ProcessQueueManager(service="orphans", parallelism=1, max_limit=20, queue_block_timeout=1,
+                                 transport="lease", lease=lease)
+        try:
+            messages = {task_id: json.dumps({"task_id": task_id, "api": "compute", "model": "sum_math_cos",
+                                             "number": 1}) for task_id in ["queued", "orphan"]}
+            for task_id, message in messages.items():
+                self.db.insert_json_message(task_id=task_id, json_message=message)
+            # Replica died between the insert and the put of the orphan
+            qm.enqueue(messages["queued"])
+            recovery = LeaseRecovery(qm, self.db, age=0, interval=60, page_size=2)
+            self.assertGreaterEqual(recovery.run_once(), 1)
+            self.assertEqual(recovery.run_once(), 0)
+            queued = qm.queue._execute("SELECT task_id FROM orphans_queue")[0]
+            self.assertEqual(sorted(task_id for task_id, in queued if task_id in messages), ["orphan", "queued"])
+        finally:
+            qm.stop()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.db.close()
+        cls.tmp_dir.cleanup()
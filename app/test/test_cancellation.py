@@ -0,0 +1,30 @@
+import multiprocessing
+import unittest
+
+from app.util.cancellation import CancellationBoard
+
+
+def cancel(board: CancellationBoard, task_id: str):
+    board.cancel([task_id])
+
+
+class TestCancellation(unittest.TestCase):
+    def test_cancel_across_processes(self):
+        board = CancellationBoard(slots=4)
+        watcher = board.watcher(["a", "b"])
+        self.assertFalse(watcher())
+        self.assertEqual(board.cancelled(["a", "b"]), set())
+
+        process = multiprocessing.Process(target=cancel, args=(board, "a"))
+        process.start()
+        process.join()
+        self.assertTrue(board.is_cancelled("a"))
+        # Running computation is preempted only once all of its tasks are cancelled
+        self.assertFalse(watcher())
+        board.cancel(["b"])
+        self.assertTrue(watcher())
+        self.assertEqual(board.cancelled(["a", "b", "c"]), {"a", "b"})
+
+        # Oldest cancellations are pushed out of the ring
+        board.cancel(["c", "d", "e"])
+        self.assertEqual(board.cancelled(["a", "b", "c", "d", "e"]), {"b", "c", "d", "e"})
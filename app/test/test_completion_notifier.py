@@ -0,0 +1,44 @@
+import multiprocessing
+import unittest
+from queue import Empty
+
+from app.util.completion_notifier import CompletionNotifier
+
+
+def publish(notifier: CompletionNotifier, task_id: str, times: int = 1):
+    for _ in range(times):
+        notifier.publish([(task_id, "COMPLETED", "COMPLETED", 1.5)])
+
+
+class TestCompletionNotifier(unittest.TestCase):
+
+    def test_publish_subscribe(self):
+        notifier = CompletionNotifier()
+        try:
+            with notifier.subscribe(["task-1"]) as subscription, notifier.subscribe(["task-2"]) as other:
+                # Published by a child process, dispatched by the listener thread of this process
+                process = multiprocessing.Process(target=publish, args=(notifier, "task-1"))
+                process.start()
+                process.join()
+                self.assertEqual(subscription.get(timeout=10), ("task-1", "COMPLETED", "COMPLETED", 1.5))
+                self.assertIsNone(other.get(timeout=0.1))
+            # Released subscriptions are not kept around
+            self.assertEqual(len(notifier._subscribers), 0)
+        finally:
+            notifier.stop()
+
+    def test_publish_without_listener(self):
+        notifier = CompletionNotifier(channels=2)
+        # Channel of an API process which has exited
+        gone = multiprocessing.Process(target=int)
+        gone.start()
+        gone.join()
+        notifier._owners[1] = gone.pid
+        # Consumer of a worker role process - nobody listens, the notices are dropped and it exits right away
+        process = multiprocessing.Process(target=publish, args=(notifier, "task-1", 2000))
+        process.start()
+        process.join(timeout=10)
+        self.assertEqual(process.exitcode, 0)
+        for queue in notifier.queues:
+            with self.assertRaises(Empty):
+                queue.get(timeout=0.1)
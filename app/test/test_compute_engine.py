@@ -0,0 +1,64 @@
+import unittest
+
+from app.calculator.computation.engine import PythonEngine, NumpyEngine, create_engine, is_numpy_available, \
+    ComputationCancelled
+from app.calculator.computation.model import Model
+
+
+class TestComputeEngine(unittest.TestCase):
+    inputs = [0, 1, 2, 0.5, 0.3, 7.25]
+
+    def test_python_engine(self):
+        engine = PythonEngine()
+        self.assertEqual(engine.sum_math_cos(0, 0, 10 ** 6), 1000000.0)
+        self.assertEqual(engine.sum_math_cos(1, 0, 10), 0.0)
+
+    @unittest.skipUnless(is_numpy_available(), "numpy is not installed")
+    def test_numpy_engine_equivalence(self):
+        reference = PythonEngine()
+        engine = NumpyEngine(chunk_size=1000)
+        for num in self.inputs:
+            expected = reference.sum_math_cos(num, 0, 10 ** 5)
+            self.assertAlmostEqual(engine.sum_math_cos(num, 0, 10 ** 5), expected, delta=1e-6)
+        # Ranges not aligned to the chunk size
+        self.assertAlmostEqual(engine.sum_math_cos(0.3, 123, 4567), reference.sum_math_cos(0.3, 123, 4567),
+                               delta=1e-9)
+
+    def test_cancellation(self):
+        # Chunking does not change the output of the reference loop
+        self.assertEqual(PythonEngine(chunk_size=7).sum_math_cos(0.3, 5, 1000),
+                         PythonEngine().sum_math_cos(0.3, 5, 1000))
+        engine = PythonEngine(chunk_size=1000)
+        Model.use_engine(engine)
+        checks = []
+        try:
+            # Flag is checked between chunks, the computation stops at the first chunk after it is raised
+            with self.assertRaises(ComputationCancelled):
+                Model.compute_batch("sum_math_cos", [0.5], cancelled=lambda: checks.append(1) or len(checks) > 2)
+            self.assertEqual(len(checks), 3)
+            self.assertIsNone(engine.cancelled)
+            self.assertEqual(Model.compute_range("sum_math_cos", 0, 0, 10, cancelled=lambda: False), 10.0)
+        finally:
+            Model.use_engine(PythonEngine())
+
+    def test_shard_ranges(self):
+        ranges = Model.shard_ranges("sum_math_cos", 3)
+        self.assertEqual(ranges, [(0, 333333), (333333, 666666), (666666, 1000000)])
+        partials = [Model.compute_range("sum_math_cos", 0.3, start, stop) for start, stop in ranges]
+        self.assertAlmostEqual(Model.combine_shards("sum_math_cos", partials), Model.sum_math_cos(0.3), delta=1e-6)
+        self.assertEqual(Model.combine_shards("sum_math_cos", [Model.compute_range("sum_math_cos", 0, start, stop)
+                                                               for start, stop in ranges]), 1000000.0)
+
+    def test_create_engine(self):
+        self.assertIsInstance(create_engine("python"), PythonEngine)
+        self.assertIn(create_engine("auto").name, ["python", "numpy"])
+        with self.assertRaises(ValueError):
+            create_engine("invalid")
+
+    def test_model_use_engine(self):
+        default_engine = Model.engine
+        try:
+            Model.use_engine(create_engine("auto"))
+            self.assertEqual(Model.model_mapping["sum_math_cos"](num=0), 1000000.0)
+        finally:
+            Model.use_engine(default_engine)
@@ -0,0 +1,86 @@
+import sqlite3
+import tempfile
+import time
+import unittest
+
+from app import Config
+from app.calculator.computation.database import CalculatorDatabase
+from app.util.logger import logger
+
+
+class TestDatabaseBenchmark(unittest.TestCase):
+    db: CalculatorDatabase = None
+    tmp_dir: tempfile.TemporaryDirectory = None
+    iterations = 2000
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        config = Config()
+        config.DB_PATH = cls.tmp_dir.name
+        cls.db = CalculatorDatabase(config)
+        cls.db.create_table()
+        cls.db.migrate()
+        for i in range(1000):
+            cls.db.insert_json_message(task_id=f"task-{i}", json_message="{}")
+
+    def _connect_per_call_status(self, task_id: str):
+        # Lookup path before the connection pool - connect, query and close on every call
+        conn = sqlite3.connect(self.db.pool.database)
+        try:
+            cur = conn.cursor()
+            for row in cur.execute(f"""
+                SELECT
+                    status, status_message
+                FROM {self.db.TABLE_NAME}
+                WHERE task_id = '{task_id}'
+            """):
+                return row[0], row[1]
+        finally:
+            conn.close()
+
+    def test_status_lookup(self):
+        start = time.perf_counter()
+        for i in range(self.iterations):
+            self.assertEqual(self._connect_per_call_status(f"task-{i % 1000}")[0], "PROCESSING")
+        before = time.perf_counter() - start
+
+        start = time.perf_counter()
+        for i in range(self.iterations):
+            self.assertEqual(self.db.get_status(task_id=f"task-{i % 1000}")[0], "PROCESSING")
+        after = time.perf_counter() - start
+
+        logger.info(f"Status lookup - connect per call: {self.iterations / before:.0f} ops/s, "
+                    f"connection pool: {self.iterations / after:.0f} ops/s")
+        self.assertLess(after, before)
+
+    def test_statement_planning(self):
+        conn = self.db.pool.acquire()
+        try:
+            # Unique statement text per call - parsed and planned every time
+            start = time.perf_counter()
+            for i in range(self.iterations):
+                conn.execute(f"""
+                    SELECT
+                        status, status_message
+                    FROM {self.db.TABLE_NAME}
+                    WHERE task_id = 'task-{i % 1000}'
+                """).fetchone()
+            before = time.perf_counter() - start
+
+            # Bound parameters - prepared statement reused from the statement cache
+            start = time.perf_counter()
+            for i in range(self.iterations):
+                conn.execute(self.db.query.GET_STATUS, (f"task-{i % 1000}",)).fetchone()
+            after = time.perf_counter() - start
+        finally:
+            self.db.pool.release(conn)
+
+        logger.info(f"Status statement - interpolated: {before / self.iterations * 1e6:.1f} us/query, "
+                    f"bound parameters: {after / self.iterations * 1e6:.1f} us/query")
+        self.assertLess(after, before)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.db.close()
+        cls.tmp_dir.cleanup()
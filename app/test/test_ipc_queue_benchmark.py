@@ -0,0 +1,112 @@
+import json
+import multiprocessing
+import os
+import pickle
+import tempfile
+import time
+import unittest
+from multiprocessing import Queue
+from queue import Empty, Full
+
+from app.util.ipc_queue import transports, BoundedSimpleQueue
+from app.util.logger import logger
+from app.util.process_queue_manager import ProcessQueueManager
+
+
+def task(queue: Queue, received: multiprocessing.Value):
+    while queue:
+        try:
+            payload = json.loads(queue.get(block=True, timeout=5))
+        except Empty:
+            break
+        if payload["api"] == "terminate":
+            break
+        with received.get_lock():
+            received.value += 1
+
+
+class TestIPCQueueBenchmark(unittest.TestCase):
+    messages = 2000
+    max_limit = 500
+    tmp_dir: tempfile.TemporaryDirectory = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+
+    def _lease(self, transport: str):
+        if transport != "lease":
+            return None
+        return {"database": os.path.join(self.tmp_dir.name, "queue.db")}
+
+    def _benchmark(self, transport: str):
+        qm = ProcessQueueManager(service=f"benchmark-{transport}", parallelism=1, max_limit=self.max_limit,
+                                 queue_block_timeout=5, transport=transport, lease=self._lease(transport))
+        received = multiprocessing.Value('i', 0)
+        try:
+            qm.consumers(task, received)
+            message = json.dumps({"task_id": "abc-efg-xyz-123", "api": "compute", "model": "sum_math_cos",
+                                  "number": 0.5})
+            latencies = []
+            start = time.perf_counter()
+            for _ in range(self.messages):
+                enqueue_start = time.perf_counter()
+                qm.enqueue(message)
+                latencies.append(time.perf_counter() - enqueue_start)
+            qm.enqueue(json.dumps({"task_id": "abc-efg-xyz-123", "api": "terminate"}))
+            qm.processes[0].join(timeout=60)
+            elapsed = time.perf_counter() - start
+        finally:
+            qm.stop()
+        latencies.sort()
+        return received.value, self.messages / elapsed, latencies[int(len(latencies) * 0.99)]
+
+    def test_transports(self):
+        results = {}
+        for transport in transports:
+            received, throughput, p99 = self._benchmark(transport)
+            self.assertEqual(received, self.messages, msg=transport)
+            results[transport] = throughput
+            logger.info(f"Transport {transport:>8}: {throughput:>8.0f} msg/s, p99 enqueue {p99 * 1e6:>8.1f} us")
+        # Native transports skip the manager server round trip
+        self.assertGreater(max(results["queue"], results["simple"], results["shm_ring"]), results["manager"])
+
+    def test_queue_limit(self):
+        for transport in transports:
+            qm = ProcessQueueManager(service=f"limit-{transport}", parallelism=1, max_limit=3,
+                                     queue_block_timeout=0.1, transport=transport, lease=self._lease(transport))
+            try:
+                with self.assertRaises(Full):
+                    for _ in range(4):
+                        qm.enqueue(json.dumps({"api": "compute"}))
+                self.assertEqual(qm.qsize(), 3)
+                self.assertTrue(qm.is_full())
+                self.assertEqual(json.loads(qm.dequeue()), {"api": "compute"})
+                self.assertEqual(qm.qsize(), 2)
+            finally:
+                qm.stop()
+
+    def test_simple_queue_full_without_consumer(self):
+        message = json.dumps({"task_id": "abc-efg-xyz-123", "api": "compute", "model": "sum_math_cos",
+                              "number": 0.5, "padding": "x" * 64})
+        # Bounded by the number of messages, then by the bytes the pipe buffers
+        for maxsize, message in ((self.max_limit, message), (self.max_limit, message * 400)):
+            queue = BoundedSimpleQueue(maxsize)
+            frame = len(pickle.dumps(message)) + 4
+            expected = min(maxsize, queue.capacity // frame)
+            try:
+                start = time.perf_counter()
+                with self.assertRaises(Full):
+                    for _ in range(maxsize + 1):
+                        queue.put(message, timeout=1)
+                # Full is raised at the put timeout, the producer never blocks on the pipe
+                self.assertLess(time.perf_counter() - start, 5)
+                self.assertEqual(queue.qsize(), expected)
+                self.assertEqual([queue.get(timeout=1) for _ in range(expected)], [message] * expected)
+                self.assertTrue(queue.empty())
+            finally:
+                queue.close()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.tmp_dir.cleanup()
@@ -0,0 +1,144 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import unittest
+from queue import Empty, Full
+
+from app.util.lease_queue import LeaseQueue
+
+
+def claim_and_die(queue: LeaseQueue):
+    queue.get(block=True, timeout=5)
+    # Lost before the ack
+    os._exit(1)
+
+
+class TestLeaseQueue(unittest.TestCase):
+    tmp_dir: tempfile.TemporaryDirectory = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+
+    def _replicas(self, table: str, **kwargs):
+        database = os.path.join(self.tmp_dir.name, "queue.db")
+        return [LeaseQueue(database, table, maxsize=3, poll_interval=0.05, **kwargs) for _ in range(2)]
+
+    def test_shared_across_replicas(self):
+        first, second = self._replicas("shared")
+        first.put(json.dumps({"task_id": "a", "api": "compute"}))
+        first.put(json.dumps({"task_id": "b", "api": "compute"}))
+        first.put(json.dumps({"task_id": "c", "api": "compute"}))
+        with self.assertRaises(Full):
+            second.put(json.dumps({"task_id": "d", "api": "compute"}), timeout=0.1)
+        self.assertEqual(second.remove(["c"]), 1)
+
+        # Each message is delivered once while leased, acknowledged messages are deleted
+        self.assertEqual(json.loads(second.get_nowait())["task_id"], "a")
+        self.assertEqual(json.loads(first.get_nowait())["task_id"], "b")
+        with self.assertRaises(Empty):
+            second.get(timeout=0.1)
+        self.assertEqual(second.qsize(), 0)
+        self.assertEqual(second.remove(["a"]), 0)
+        self.assertEqual(first.ack() + second.ack(), 2)
+        self.assertEqual(first.ack(), 0)
+
+        # Terminate messages only drain the consumers of their replica
+        first.put(json.dumps({"task_id": "terminate", "api": "terminate"}))
+        with self.assertRaises(Empty):
+            second.get_nowait()
+        self.assertEqual(first.qsize(), 0)
+        self.assertEqual(json.loads(first.get_nowait())["api"], "terminate")
+        first.ack()
+
+    def test_idle_wait(self):
+        database = os.path.join(self.tmp_dir.name, "queue.db")
+        first, second = [LeaseQueue(database, "idle", maxsize=3, poll_interval=0.5) for _ in range(2)]
+        for i in range(20):
+            first.put(json.dumps({"task_id": str(i), "api": "compute"}))
+            # Claimed by the consumers of the other replica
+            second.get(timeout=1)
+            second.ack()
+        # Wake-ups of the local puts do not pile up, an idle consumer waits between its claims
+        claims = []
+        claim = first._claim
+        first._claim = lambda: claims.append(1) or claim()
+        with self.assertRaises(Empty):
+            first.get(timeout=1)
+        self.assertLessEqual(len(claims), 4)
+
+        # Local put wakes up the idle consumer before the poll interval
+        put = threading.Timer(0.1, first.put, args=(json.dumps({"task_id": "wake", "api": "compute"}),))
+        start = time.monotonic()
+        put.start()
+        self.assertEqual(json.loads(first.get(timeout=5))["task_id"], "wake")
+        self.assertLess(time.monotonic() - start, 0.5)
+        put.join()
+        first.ack()
+
+    def test_visibility_timeout(self):
+        first, second = self._replicas("visibility", visibility_timeout=0.6)
+        first.put(json.dumps({"task_id": "held", "api": "compute"}))
+        self.assertEqual(json.loads(first.get_nowait())["task_id"], "held")
+        # Lease is renewed while the message is held
+        time.sleep(1)
+        with self.assertRaises(Empty):
+            second.get_nowait()
+        first.ack()
+
+        first.put(json.dumps({"task_id": "lost", "api": "compute"}))
+        process = multiprocessing.Process(target=claim_and_die, args=(first,))
+        process.start()
+        process.join()
+        with self.assertRaises(Empty):
+            second.get_nowait()
+        # Redelivered once the lease of the lost consumer has expired
+        self.assertEqual(json.loads(second.get(timeout=5))["task_id"], "lost")
+        self.assertEqual(second.ack(), 1)
+
+    def test_abandon(self):
+        first, second = self._replicas("abandon")
+        first.put(json.dumps({"task_id": "unrecorded", "api": "compute"}))
+        self.assertEqual(json.loads(first.get_nowait())["task_id"], "unrecorded")
+        # Released for redelivery when the in-flight tasks of the lost consumer are not recovered
+        self.assertEqual(first.abandon(os.getpid(), recovered=False), 1)
+        self.assertEqual(json.loads(second.get_nowait())["task_id"], "unrecorded")
+        # Deleted when they are recovered by the watchdog
+        self.assertEqual(second.abandon(os.getpid(), recovered=True), 1)
+        self.assertEqual(second.ack(), 0)
+        self.assertEqual(second._execute("SELECT count(*) FROM abandon")[0], [(0,)])
+
+    def test_requeue(self):
+        first, second = self._replicas("requeue")
+        first.put(json.dumps({"task_id": "x", "api": "compute_batch", "items": [{"task_id": "x"}, {"task_id": "y"}]}))
+        first.put(json.dumps({"task_id": "z", "api": "compute"}))
+        first.get_nowait()
+        # Tasks queued alone or in a batch, leased or not, are not queued twice
+        messages = [json.dumps({"task_id": task_id, "api": "compute"}) for task_id in ["x", "y", "z", "w"]]
+        self.assertEqual(second.requeue(messages), 1)
+        self.assertEqual(second.requeue(messages), 0)
+        self.assertEqual(json.loads(second.get_nowait())["task_id"], "z")
+        self.assertEqual(json.loads(second.get_nowait())["task_id"], "w")
+        first.ack()
+        second.ack()
+
+    def test_prune(self):
+        first, second = self._replicas("prune", visibility_timeout=0.3)
+        gone = LeaseQueue(os.path.join(self.tmp_dir.name, "queue.db"), "prune", maxsize=3, visibility_timeout=0.3)
+        gone.put(json.dumps({"task_id": "terminate", "api": "terminate"}))
+        # Terminate message of a replica whose consumer is busy is kept
+        second.put(json.dumps({"task_id": "busy", "api": "compute"}))
+        second.put(json.dumps({"task_id": "terminate", "api": "terminate"}))
+        self.assertEqual(json.loads(second.get_nowait())["task_id"], "busy")
+        self.assertEqual(first.prune(), 0)
+        time.sleep(0.5)
+        self.assertEqual(first.prune(), 1)
+        self.assertEqual(json.loads(second.get_nowait())["api"], "terminate")
+        second.ack()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.tmp_dir.cleanup()
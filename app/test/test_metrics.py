@@ -0,0 +1,73 @@
+import json
+import multiprocessing
+import os
+import tempfile
+import unittest
+
+from app.util.metrics import MetricsRegistry
+
+registry = MetricsRegistry()
+requests = registry.counter("test_requests_total", "Requests", ["endpoint"])
+latency = registry.histogram("test_latency_seconds", "Latency", buckets=(0.1, 1.0))
+depth = registry.gauge("test_queue_depth", "Depth")
+
+
+def work():
+    # Values inherited from the parent are reset in the forked child
+    requests.inc(endpoint="/evaluate")
+    latency.observe(5.0)
+    registry.flush()
+
+
+class TestMetrics(unittest.TestCase):
+    tmp_dir: tempfile.TemporaryDirectory = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        registry.configure(cls.tmp_dir.name, flush_interval=60, clear=True)
+
+    def test_aggregate_processes(self):
+        requests.inc(endpoint="/evaluate")
+        requests.inc(2, endpoint="/status")
+        latency.observe(0.1)
+        latency.observe(0.5)
+        for _ in range(2):
+            process = multiprocessing.Process(target=work)
+            process.start()
+            process.join()
+        collected = registry.collect()
+        self.assertEqual(collected["test_requests_total"], {("/evaluate",): 3.0, ("/status",): 2.0})
+        # Non-cumulative bucket counts, +Inf count and sum
+        self.assertEqual(collected["test_latency_seconds"][()], [1.0, 1.0, 2.0, 10.6])
+
+        depth.set(7)
+        text = registry.render()
+        self.assertIn('# TYPE test_requests_total counter\ntest_requests_total{endpoint="/evaluate"} 3\n', text)
+        self.assertIn('test_latency_seconds_bucket{le="0.1"} 1\n', text)
+        self.assertIn('test_latency_seconds_bucket{le="1.0"} 2\n', text)
+        self.assertIn('test_latency_seconds_bucket{le="+Inf"} 4\n', text)
+        self.assertIn('test_latency_seconds_count 4\n', text)
+        self.assertIn('# TYPE test_queue_depth gauge\ntest_queue_depth 7\n', text)
+
+    def test_reap_exited_process(self):
+        before = registry.collect()["test_requests_total"].get(("/reaped",), 0.0)
+        # Snapshot of an exited process whose pid is reused by the current process
+        path = os.path.join(self.tmp_dir.name, f"{os.getpid()}-0.json")
+        with open(path, "w") as f:
+            json.dump({"test_requests_total": [[["/reaped"], 4.0]]}, f)
+        requests.inc(endpoint="/reaped")
+        registry.flush()
+        self.assertTrue(os.path.exists(registry._own_path()))
+        self.assertNotEqual(registry._own_path(), path)
+
+        for _ in range(2):
+            self.assertEqual(registry.collect()["test_requests_total"][("/reaped",)], before + 5.0)
+            self.assertFalse(os.path.exists(path))
+            self.assertTrue(os.path.exists(registry._own_path()))
+        with open(os.path.join(self.tmp_dir.name, "base.json")) as f:
+            self.assertIn(["/reaped"], [key for key, _ in json.load(f)["test_requests_total"]])
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.tmp_dir.cleanup()
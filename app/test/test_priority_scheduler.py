@@ -0,0 +1,101 @@
+import json
+import unittest
+from queue import Empty, Full
+
+from app.util.priority_scheduler import FairPriorityQueue
+from app.util.process_queue_manager import ProcessQueueManager
+
+
+def message(task_id: str, api: str = "compute", **fields) -> str:
+    return json.dumps({"task_id": task_id, "api": api, **fields})
+
+
+class TestPriorityScheduler(unittest.TestCase):
+
+    def test_priority_classes(self):
+        queue = FairPriorityQueue(maxsize=10)
+        queue.put(message("terminate", api="terminate"))
+        queue.put(message("low", priority=5))
+        queue.put(message("normal-0"))
+        queue.put(message("high", priority=-1))
+        queue.put(message("normal-1"))
+        queue.put(message("kill", api="kill"))
+        order = [json.loads(queue.get_nowait())["task_id"] for _ in range(6)]
+        self.assertEqual(order, ["kill", "high", "normal-0", "normal-1", "low", "terminate"])
+        with self.assertRaises(Empty):
+            queue.get_nowait()
+
+    def test_fair_share(self):
+        queue = FairPriorityQueue(maxsize=100, weights={"gold": 2.0})
+        # Flooding tenant enqueues everything first
+        for i in range(20):
+            queue.put(message(f"flood-{i}", tenant="flood"))
+        for i in range(5):
+            queue.put(message(f"small-{i}", tenant="small"))
+        for i in range(10):
+            queue.put(message(f"gold-{i}", tenant="gold"))
+        first = [json.loads(queue.get_nowait())["tenant"] for _ in range(12)]
+        # Served in proportion to the weights instead of in arrival order
+        self.assertEqual(first.count("flood"), 3)
+        self.assertEqual(first.count("small"), 3)
+        self.assertEqual(first.count("gold"), 6)
+
+    def test_tenant_state_bounded(self):
+        queue = FairPriorityQueue(maxsize=10)
+        for i in range(1005):
+            queue.put(message(f"task-{i}", tenant=f"tenant-{i}"))
+            queue.get_nowait()
+        # Tenants served are forgotten, their counters are capped
+        self.assertEqual(queue._tenant_finish, {})
+        dequeued = queue.stats()["dequeued"]
+        self.assertEqual(len(dequeued), 1001)
+        self.assertEqual(dequeued["compute-p0/other"], 5)
+        queue.put(message("a", tenant="removed"))
+        queue.put(message("b", tenant="kept"))
+        queue.remove(["a"])
+        self.assertEqual(list(queue._tenant_finish), [((1, 0), "kept")])
+
+    def test_fifo_without_fair_share(self):
+        queue = FairPriorityQueue(maxsize=100, fair_share=False)
+        for i in range(5):
+            queue.put(message(f"flood-{i}", tenant="flood"))
+        queue.put(message("small-0", tenant="small"))
+        order = [json.loads(queue.get_nowait())["task_id"] for _ in range(6)]
+        self.assertEqual(order[-1], "small-0")
+
+    def test_remove(self):
+        queue = FairPriorityQueue(maxsize=4)
+        queue.put(message("a", api="compute_shard", shard=0))
+        queue.put(message("b"))
+        queue.put(message("a", api="compute_shard", shard=1))
+        queue.put(message("c", api="compute_batch", items=[{"task_id": "c"}, {"task_id": "a"}]))
+        self.assertTrue(queue.full())
+        # Every shard of the task is dropped, batch messages are trimmed
+        self.assertEqual(queue.remove(["a"]), 2)
+        self.assertEqual(queue.qsize(), 2)
+        self.assertEqual(json.loads(queue.get_nowait())["task_id"], "b")
+        self.assertEqual(json.loads(queue.get_nowait())["items"], [{"task_id": "c"}])
+        self.assertEqual(queue.remove(["missing"]), 0)
+
+    def test_cross_process_stats(self):
+        qm = ProcessQueueManager(service="scheduler", parallelism=1, max_limit=3, queue_block_timeout=0.1,
+                                 transport="priority", tenant_weights={"gold": 2.0})
+        try:
+            qm.enqueue(message("a", priority=1))
+            qm.enqueue(message("b"))
+            qm.enqueue(message("c", api="kill"))
+            with self.assertRaises(Full):
+                qm.enqueue(message("d"))
+            self.assertTrue(qm.is_full())
+            self.assertEqual([json.loads(qm.dequeue())["task_id"] for _ in range(3)], ["c", "b", "a"])
+            stats = qm.scheduler_stats()
+            self.assertEqual(set(stats["queue_wait"]), {"kill", "compute-p0", "compute-p1"})
+            self.assertEqual(stats["queue_wait"]["kill"]["samples"], 1)
+            self.assertGreaterEqual(stats["queue_wait"]["compute-p1"]["p99"],
+                                    stats["queue_wait"]["compute-p1"]["p50"])
+            self.assertEqual(stats["dequeued"]["compute-p0/default"], 1)
+            qm.enqueue(message("e"))
+            self.assertEqual(qm.remove(["e"]), 1)
+            self.assertTrue(qm.is_empty())
+        finally:
+            qm.stop()
@@ -0,0 +1,80 @@
+import tempfile
+import time
+import unittest
+
+from app import Config
+from app.calculator.computation.cache import ResultCache, StatusCache
+from app.calculator.computation.database import CalculatorDatabase
+from app.util.completion_notifier import CompletionNotifier
+
+
+class TestResultCache(unittest.TestCase):
+    db: CalculatorDatabase = None
+    tmp_dir: tempfile.TemporaryDirectory = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        config = Config()
+        config.DB_PATH = cls.tmp_dir.name
+        config.RESULT_CACHE_SIZE = 2
+        cls.config = config
+        cls.db = CalculatorDatabase(config)
+        cls.db.create_table()
+        cls.db.migrate()
+
+    def test_key(self):
+        self.assertEqual(ResultCache.key("sum_math_cos", 1), ResultCache.key("sum_math_cos", 1.0))
+        self.assertNotEqual(ResultCache.key("sum_math_cos", 1), ResultCache.key("sum_math_cos", 2))
+        self.assertIsNone(ResultCache.key("invalid", 1))
+        self.assertIsNone(ResultCache.key("sum_math_cos", "abc"))
+
+    def test_lru_and_persistent_tier(self):
+        cache = ResultCache(self.config, self.db)
+        keys = [ResultCache.key("sum_math_cos", num) for num in range(3)]
+        self.assertIsNone(cache.get(keys[0]))
+        for num, key in enumerate(keys):
+            cache.put(key, "sum_math_cos", float(num))
+        stats = cache.stats()
+        self.assertEqual(stats["misses"], 1)
+        self.assertEqual(stats["evictions"], 1)
+        self.assertEqual(stats["memory_size"], 2)
+
+        # Evicted entry is still served by the database tier
+        self.assertEqual(cache.get(keys[0]), 0.0)
+        self.assertEqual(cache.get(keys[0]), 0.0)
+        stats = cache.stats()
+        self.assertEqual(stats["database_hits"], 1)
+        self.assertEqual(stats["memory_hits"], 1)
+
+    def test_status_cache(self):
+        self.config.STATUS_CACHE_NEGATIVE_TTL = 0.5
+        notifier = CompletionNotifier()
+        cache = StatusCache(self.config, self.db, notifier)
+        self.db.insert_json_message(task_id="polled", json_message="{}")
+        self.assertEqual(cache.get_result("polled"), ("PROCESSING", None, "PROCESSING"))
+        self.assertEqual(cache.get_results(["polled", "missing"]), {"polled": ("PROCESSING", None, "PROCESSING")})
+
+        # Completion pushed by a consumer replaces the negative entry
+        self.db.update_status_output_message(task_id="polled", status="COMPLETED", status_message="COMPLETED",
+                                             output=2.0)
+        self.assertEqual(cache.get_result("polled")[0], "PROCESSING")
+        notifier.publish([("polled", "COMPLETED", "COMPLETED", 2.0)])
+        deadline = time.time() + 5
+        while cache.get_result("polled")[0] == "PROCESSING" and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(cache.get_result("polled"), ("COMPLETED", 2.0, "COMPLETED"))
+
+        # Final status is served from memory, negative entries expire
+        self.db.execute(f"DELETE FROM {self.config.CALCULATOR_SQLITE_TABLE_NAME} WHERE task_id = 'polled'")
+        self.db.insert_json_message(task_id="missing", json_message="{}")
+        self.assertEqual(cache.get_results(["polled", "missing"]), {"polled": ("COMPLETED", 2.0, "COMPLETED")})
+        time.sleep(0.6)
+        self.assertEqual(cache.get_result("missing")[0], "PROCESSING")
+        self.assertEqual(cache.get_result("polled"), ("COMPLETED", 2.0, "COMPLETED"))
+        notifier.stop()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.db.close()
+        cls.tmp_dir.cleanup()
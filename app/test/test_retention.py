@@ -0,0 +1,80 @@
+import json
+import tempfile
+import time
+import unittest
+from types import SimpleNamespace
+
+from app import Config
+from app.calculator.computation.api import handle_result
+from app.calculator.computation.cache import StatusCache
+from app.calculator.computation.database import CalculatorDatabase
+from app.calculator.computation.retention import RetentionJob
+from app.util.completion_notifier import CompletionNotifier
+
+
+class TestRetention(unittest.TestCase):
+    db: CalculatorDatabase = None
+    tmp_dir: tempfile.TemporaryDirectory = None
+    expired = 45
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        config = Config()
+        config.DB_PATH = cls.tmp_dir.name
+        cls.config = config
+        cls.db = CalculatorDatabase(config)
+        cls.db.create_table()
+        cls.db.migrate()
+        padding = "x" * 2000
+        for i in range(cls.expired):
+            cls.db.insert_json_message(task_id=f"old-{i}", json_message=json.dumps({"i": i, "padding": padding}))
+            cls.db.update_status_output_message(task_id=f"old-{i}", status="COMPLETED", status_message="COMPLETED",
+                                                output=float(i))
+        cls.db.insert_json_message(task_id="old-pending", json_message="{}")
+        cls.db.insert_json_message(task_id="recent", json_message="{}")
+        cls.db.update_status_output_message(task_id="recent", status="ERROR", status_message="error", output=-1.0)
+        table = config.CALCULATOR_SQLITE_TABLE_NAME
+        cls.db.execute(f"UPDATE {table} SET event_time = event_time - 100 WHERE task_id LIKE 'old-%'")
+
+    def test_archive(self):
+        page_count = self.db.execute("PRAGMA page_count")[0][0]
+        job = RetentionJob(self.db, ttl=50, interval=60, batch_size=10, pause=0, vacuum_pages=4)
+        self.assertEqual(job.run_once()["archived"], self.expired)
+
+        # Only the final tasks past the TTL are pruned, along with their lifecycle
+        table = self.config.CALCULATOR_SQLITE_TABLE_NAME
+        remaining = [row[0] for row in self.db.execute(f"SELECT task_id FROM {table} ORDER BY task_id")]
+        self.assertEqual(remaining, ["old-pending", "recent"])
+        lifecycle = self.db.execute(f"SELECT count(*) FROM {self.db.query.LIFECYCLE_TABLE_NAME} "
+                                    f"WHERE task_id LIKE 'old-%'")
+        self.assertEqual(lifecycle[0][0], 0)
+        self.assertEqual(self.db.get_archived_result("old-7"), ("COMPLETED", 7.0, "COMPLETED"))
+        self.assertEqual(json.loads(self.db.get_archived_json_message("old-7"))["i"], 7)
+        self.assertEqual(self.db.get_archived_result("recent"), ("NOT FOUND", -1, "NOT FOUND"))
+        self.assertIsNone(self.db.get_archived_json_message("recent"))
+
+        # Pruned pages are returned to the file system
+        self.assertEqual(self.db.execute("PRAGMA freelist_count")[0][0], 0)
+        self.assertLess(self.db.execute("PRAGMA page_count")[0][0], page_count)
+        self.assertEqual(job.run_once(), {"archived": 0, "vacuumed_pages": 0})
+
+        # Archived results are still served
+        notifier = CompletionNotifier()
+        ms = SimpleNamespace(config=self.config, calculator_notifier=notifier,
+                             calculator_status_cache=StatusCache(self.config, self.db, notifier))
+        result = handle_result(task_id="old-3", ms=ms)
+        self.assertEqual((result.response.status, result.output), ("COMPLETED", 3.0))
+
+    def test_stop(self):
+        job = RetentionJob(self.db, ttl=3600, interval=60, batch_size=10, pause=0, vacuum_pages=4)
+        job.start()
+        time.sleep(0.5)
+        job.stop()
+        job.join(timeout=5)
+        self.assertEqual(job.progress(), {"state": "STOPPED", "archived": 0, "vacuumed_pages": 0})
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.db.close()
+        cls.tmp_dir.cleanup()
@@ -0,0 +1,43 @@
+import importlib.util
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+from app.benchmark.load import start_server, post
+from app.util.logger import logger
+
+
+@unittest.skipUnless(all(importlib.util.find_spec(module) for module in ["flask_restplus", "gunicorn", "uvicorn"]),
+                     "flask_restplus, gunicorn and uvicorn are required to load test the servers")
+class TestServerBenchmark(unittest.TestCase):
+    requests = 1000
+    clients = 32
+    workers = 2
+
+    def _load_test(self, server: str) -> Tuple[float, float]:
+        with start_server(server, workers=self.workers) as base_url:
+            task_id = post(f"{base_url}/evaluate", {"model": "sum_math_cos", "number": 0.5})["task_id"]
+            post(f"{base_url}/result?wait=10", {"task_id": task_id})
+
+            def call(i: int) -> float:
+                start = time.perf_counter()
+                # Read heavy mix - status polls and evaluations answered by the result cache
+                if i % 4:
+                    response = post(f"{base_url}/status", {"task_id": task_id})
+                else:
+                    response = post(f"{base_url}/evaluate", {"model": "sum_math_cos", "number": 0.5})
+                self.assertEqual(response["response"]["status"], "COMPLETED")
+                return time.perf_counter() - start
+
+            start = time.perf_counter()
+            with ThreadPoolExecutor(self.clients) as executor:
+                latencies = sorted(executor.map(call, range(self.requests)))
+            elapsed = time.perf_counter() - start
+        return self.requests / elapsed, latencies[int(len(latencies) * 0.99)]
+
+    def test_servers(self):
+        for server in ["dev", "wsgi", "asgi"]:
+            throughput, p99 = self._load_test(server)
+            logger.info(f"Server {server:>4} ({self.clients} clients): {throughput:>7.0f} req/s, "
+                        f"p99 {p99 * 1e3:>7.1f} ms")
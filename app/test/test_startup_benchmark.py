@@ -0,0 +1,73 @@
+import multiprocessing
+import os
+import subprocess
+import sys
+import time
+import unittest
+from queue import Empty
+from typing import Dict
+
+from app.calculator.computation.engine import create_engine
+from app.calculator.computation.model import Model
+from app.util.logger import logger
+from app.util.process_queue_manager import ProcessQueueManager
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def task(queue: multiprocessing.Queue, ready: multiprocessing.Queue):
+    # Startup of the calculator consumers, see service.task
+    Model.use_engine(create_engine("auto"))
+    ready.put(time.monotonic())
+
+
+def import_times(module: str) -> Dict[str, int]:
+    """Cumulative import time in microseconds of every module imported by a cold interpreter importing module"""
+    stderr = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"], cwd=ROOT,
+                            env={**os.environ, "PYTHONPATH": ROOT}, capture_output=True, text=True,
+                            check=True).stderr
+    times = {}
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "cumulative" not in line:
+            _, cumulative, name = line.split("|")
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+class TestStartupBenchmark(unittest.TestCase):
+    runs = 3
+    workers = 4
+    # Budgets, a few times the measured time so that only a regression fails them
+    cold_start_budget = 0.5
+    spawn_budget = 0.05
+    heavy_modules = ["flask", "flask_restplus", "werkzeug", "jinja2", "gunicorn", "uvicorn", "numpy"]
+
+    def _cold_start(self, module: str) -> float:
+        best = min((import_times(module) for _ in range(self.runs)), key=lambda times: times[module])
+        heavy = sorted(name for name in best if name.split(".")[0] in self.heavy_modules)
+        self.assertEqual(heavy, [], msg=f"{module} imports heavy modules")
+        return best[module] / 1e6
+
+    def test_cold_start(self):
+        for module in ["app.worker", "app.asgi"]:
+            elapsed = self._cold_start(module)
+            logger.info(f"Cold start of {module:>10}: {elapsed * 1e3:>6.1f} ms")
+            self.assertLess(elapsed, self.cold_start_budget, msg=module)
+
+    def test_worker_spawn(self):
+        # Engine resolved by the parent, see service.run_calculator_qm_task
+        create_engine("auto")
+        qm = ProcessQueueManager(service="benchmark-spawn", parallelism=self.workers, max_limit=10,
+                                 queue_block_timeout=1, transport="simple")
+        ready = multiprocessing.Queue()
+        try:
+            start = time.monotonic()
+            qm.consumers(task, ready)
+            ready_times = [ready.get(timeout=10) for _ in range(self.workers)]
+        except Empty:
+            self.fail("Consumers are not started")
+        finally:
+            qm.stop()
+        elapsed = (max(ready_times) - start) / self.workers
+        logger.info(f"Spawn of {self.workers} consumers: {elapsed * 1e3:>6.1f} ms per consumer")
+        self.assertLess(elapsed, self.spawn_budget)
@@ -0,0 +1,86 @@
+import json
+import tempfile
+import time
+import unittest
+from datetime import datetime
+
+from app import Config
+from app.calculator.computation.database import CalculatorDatabase
+from app.calculator.computation.recovery import StartupRecovery
+from app.calculator.computation.service import startup_workflow
+from app.util.process_queue_manager import ProcessQueueManager
+
+
+class TestStartupRecovery(unittest.TestCase):
+    db: CalculatorDatabase = None
+    config: Config = None
+    qm: ProcessQueueManager = None
+    tmp_dir: tempfile.TemporaryDirectory = None
+    pending = 7
+    max_limit = 3
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        config = Config()
+        config.DB_PATH = cls.tmp_dir.name
+        cls.config = config
+        cls.db = CalculatorDatabase(config)
+        cls.db.create_table()
+        cls.db.migrate()
+        for i in range(cls.pending):
+            cls.db.insert_json_message(task_id=f"task-{i}", json_message=json.dumps({"task_id": f"task-{i}"}))
+        cls.db.insert_json_message(task_id="completed", json_message="{}")
+        cls.db.update_status_output_message(task_id="completed", status="COMPLETED", status_message="COMPLETED",
+                                            output=1.0)
+        cls.qm = ProcessQueueManager(service="test", parallelism=1, max_limit=cls.max_limit,
+                                     queue_block_timeout=0.1)
+
+    def test_iter_json_messages(self):
+        event_time = int(datetime.now().strftime('%s'))
+        messages = list(self.db.iter_json_messages(event_time=event_time, page_size=2))
+        self.assertEqual(sorted(json.loads(message)["task_id"] for message in messages),
+                         [f"task-{i}" for i in range(self.pending)])
+        self.assertEqual(self.db.count_json_messages(event_time=event_time), self.pending)
+
+    def test_recovery_backpressure(self):
+        recovery = StartupRecovery(self.qm, self.db, event_time=int(datetime.now().strftime('%s')), page_size=2)
+        recovery.start()
+
+        # Replay is blocked by the full queue without failing
+        time.sleep(1)
+        self.assertEqual(recovery.progress(), {"state": "RUNNING", "total": self.pending,
+                                               "replayed": self.max_limit, "remaining": self.pending - self.max_limit})
+
+        replayed = []
+        deadline = time.time() + 10
+        while len(replayed) < self.pending and time.time() < deadline:
+            message = self.qm.dequeue()
+            if message:
+                replayed.append(json.loads(message)["task_id"])
+        recovery.join(timeout=5)
+        self.assertEqual(sorted(replayed), [f"task-{i}" for i in range(self.pending)])
+        self.assertEqual(recovery.progress()["state"], "COMPLETED")
+        self.assertEqual(recovery.progress()["remaining"], 0)
+
+    def test_startup_cutoff(self):
+        recovery = startup_workflow(self.qm, self.db, self.config)
+        # Submitted once the startup is over, enqueued by the API only
+        self.db.insert_json_message(task_id="submitted", json_message=json.dumps({"task_id": "submitted"}))
+        self.assertEqual(self.db.count_json_messages(event_time=recovery.event_time), self.pending)
+        replayed = []
+        deadline = time.time() + 10
+        while (recovery.is_alive() or not self.qm.is_empty()) and time.time() < deadline:
+            message = self.qm.dequeue()
+            if message:
+                replayed.append(json.loads(message)["task_id"])
+        self.assertEqual(sorted(replayed), [f"task-{i}" for i in range(self.pending)])
+        self.assertEqual(recovery.progress()["total"], self.pending)
+        self.db.update_status_output_message(task_id="submitted", status="COMPLETED", status_message="COMPLETED",
+                                            output=1.0)
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.qm.stop()
+        cls.db.close()
+        cls.tmp_dir.cleanup()
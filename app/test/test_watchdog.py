@@ -0,0 +1,60 @@
+import json
+import os
+import time
+import unittest
+from queue import Empty
+
+from app.util.process_queue_manager import ProcessQueueManager
+from app.util.watchdog import WorkerHeartbeats
+
+
+def task(queue, heartbeats: WorkerHeartbeats):
+    heartbeat = heartbeats.register()
+    while True:
+        heartbeat.beat()
+        try:
+            payload = json.loads(queue.get(block=True, timeout=0.2))
+        except Empty:
+            continue
+        if payload["api"] == "terminate":
+            heartbeat.release()
+            break
+        heartbeat.busy([[payload["task_id"], 0]], deadline=time.monotonic() + 0.2)
+        if payload["task_id"] == "crash":
+            os._exit(1)
+        if payload["task_id"] == "hang":
+            time.sleep(3600)
+        heartbeat.idle()
+
+
+class TestWatchdog(unittest.TestCase):
+
+    def test_respawn_lost_workers(self):
+        qm = ProcessQueueManager(service="watchdog", parallelism=2, max_limit=10, queue_block_timeout=0.5,
+                                 watchdog={"interval": 0.1, "heartbeat_timeout": 5, "grace": 0.2})
+        lost = []
+        try:
+            qm.consumers(task, qm.heartbeats)
+            qm.supervise(lambda inflight, reason: lost.append((inflight, reason)) or (len(inflight), 0))
+            for task_id, count in [("crash", 1), ("hang", 2)]:
+                qm.enqueue(json.dumps({"task_id": task_id, "api": "compute"}))
+                deadline = time.monotonic() + 10
+                while len(lost) < count:
+                    self.assertLess(time.monotonic(), deadline, msg=f"{task_id} consumer is not recovered")
+                    time.sleep(0.05)
+            # In-flight tasks are handed over along with the reason, the consumers are respawned
+            self.assertEqual(lost, [([["crash", 0]], "crashed"), ([["hang", 0]], "timeout")])
+            self.assertEqual(len(qm.processes), 2)
+            self.assertTrue(all(qm.is_running(process.pid) for process in qm.processes))
+            self.assertEqual(qm.watchdog_stats(), {"enabled": True, "requeued": 2, "failed": 0,
+                                                   "restarts": {"crashed": 1, "timeout": 1, "unresponsive": 0}})
+            # Consumer exiting gracefully is not respawned
+            qm.enqueue(json.dumps({"task_id": "exit", "api": "terminate"}))
+            deadline = time.monotonic() + 10
+            while len(qm.heartbeats.workers()) > 1:
+                self.assertLess(time.monotonic(), deadline, msg="consumer has not exited")
+                time.sleep(0.05)
+            time.sleep(0.3)
+            self.assertEqual(qm.watchdog_stats()["restarts"]["crashed"], 1)
+        finally:
+            qm.stop()
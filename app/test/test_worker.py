@@ -0,0 +1,84 @@
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import urllib.error
+import urllib.request
+
+from app import Config
+from app.benchmark.load import free_port
+from app.calculator.computation.database import CalculatorDatabase
+from app.util.lease_queue import LeaseQueue
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class TestWorker(unittest.TestCase):
+    tmp_dir: tempfile.TemporaryDirectory = None
+
+    @classmethod
+    def setUpClass(cls) -> None:
+        cls.tmp_dir = tempfile.TemporaryDirectory()
+        cls.env = {**os.environ, "FLASK_MICROSERVICE_QUEUE_TRANSPORT": "lease", "PYTHONPATH": ROOT,
+                   "FLASK_MICROSERVICE_METRICS_DIR": os.path.join(cls.tmp_dir.name, "metrics")}
+
+    def test_worker_without_flask(self):
+        code = "import sys, app.worker; print(sorted(m for m in sys.modules if m.split('.')[0] in " \
+               "['flask', 'flask_restplus', 'werkzeug', 'gunicorn']))"
+        output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, env=self.env, capture_output=True,
+                                text=True, check=True).stdout
+        self.assertEqual(output.strip(), "[]")
+
+    def test_role_needs_lease_transport(self):
+        result = subprocess.run([sys.executable, os.path.join(ROOT, "manage.py"), "--role", "api"],
+                                cwd=self.tmp_dir.name, env={**self.env, "FLASK_MICROSERVICE_QUEUE_TRANSPORT": "simple"},
+                                capture_output=True, text=True)
+        self.assertEqual(result.returncode, 2)
+        self.assertIn("needs the lease queue transport", result.stderr)
+
+    def test_worker_role(self):
+        config = Config()
+        config.DB_PATH = self.tmp_dir.name
+        db = CalculatorDatabase(config)
+        db.create_table()
+        db.migrate()
+        queue = LeaseQueue(os.path.join(config.DB_PATH, f"{config.LEASE_QUEUE_DB_NAME}.db"), "calculator_queue",
+                           maxsize=config.QUEUE_SIZE)
+        port = free_port()
+        worker = subprocess.Popen([sys.executable, os.path.join(ROOT, "manage.py"), "--role", "worker"],
+                                  cwd=self.tmp_dir.name, env={**self.env, "FLASK_MICROSERVICE_METRICS_PORT": str(port)},
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            # Enqueued by an API process of another pod
+            message = json.dumps({"task_id": "worker-task", "api": "compute", "model": "sum_math_cos", "number": 2})
+            db.insert_json_message(task_id="worker-task", json_message=message)
+            queue.put(message)
+            deadline = time.time() + 30
+            while db.get_status(task_id="worker-task")[0] == "PROCESSING" and time.time() < deadline:
+                time.sleep(0.1)
+            self.assertEqual(db.get_status(task_id="worker-task"), ("COMPLETED", "COMPLETED"))
+            # Scraped on the worker pod, the consumers have no API process of their own - their snapshots are
+            # flushed every METRICS_FLUSH_INTERVAL
+            deadline = time.time() + 10
+            while True:
+                with urllib.request.urlopen(f"http://localhost:{port}/metrics", timeout=5) as response:
+                    metrics = response.read().decode()
+                if "calculator_compute_seconds_count" in metrics or time.time() > deadline:
+                    break
+                time.sleep(0.2)
+            self.assertIn("calculator_consumer_workers", metrics)
+            self.assertIn('calculator_compute_seconds_count{model="sum_math_cos"}', metrics)
+            with self.assertRaises(urllib.error.HTTPError):
+                urllib.request.urlopen(f"http://localhost:{port}/evaluate", timeout=5)
+        finally:
+            worker.send_signal(signal.SIGTERM)
+            self.assertEqual(worker.wait(timeout=30), 0)
+            db.close()
+
+    @classmethod
+    def tearDownClass(cls) -> None:
+        cls.tmp_dir.cleanup()
@@ -0,0 +1,136 @@
+import math
+import os
+import threading
+import time
+from typing import Optional, Tuple
+
+from app.util.logger import logger
+
+CGROUP_ROOT = "/sys/fs/cgroup"
+
+
+def cgroup_cpu_limit(root: str = CGROUP_ROOT) -> Optional[float]:
+    """CPUs granted by the cgroup CPU quota (v2 cpu.max or v1 cfs quota), None if unlimited"""
+    try:
+        with open(os.path.join(root, "cpu.max")) as f:
+            quota, period = f.read().split()[:2]
+        return None if quota == "max" else int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        with open(os.path.join(root, "cpu", "cpu.cfs_quota_us")) as f:
+            quota = int(f.read())
+        with open(os.path.join(root, "cpu", "cpu.cfs_period_us")) as f:
+            period = int(f.read())
+    except (OSError, ValueError):
+        return None
+    return quota / period if quota > 0 else None
+
+
+def available_cpus(root: str = CGROUP_ROOT) -> float:
+    """CPUs usable by the consumers, the cgroup quota if lower than the CPUs the process may run on"""
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count() or 1
+    limit = cgroup_cpu_limit(root)
+    return min(limit, cpus) if limit else cpus
+
+
+class Autoscaler(threading.Thread):
+    """
+    Grow and shrink the consumers of a ProcessQueueManager between its min and max parallelism
+
+    A worker is added when the backlog per worker or the estimated queue wait is above target, and
+    drained through a terminate message once the queue has stayed empty for idle_delay seconds. The
+    max parallelism is capped to cpu_overcommit workers per CPU of the cgroup quota.
+    """
+
+    def __init__(self, qm, interval: float = 2.0, target_wait: float = 1.0, backlog: int = 4,
+                 idle_delay: float = 30.0, cpu_overcommit: float = 2.0, cgroup_root: str = CGROUP_ROOT):
+        super().__init__(name=f"Autoscaler-{qm.service}", daemon=True)
+        self.qm = qm
+        self.interval = interval
+        self.target_wait = target_wait
+        self.backlog = backlog
+        self.idle_delay = idle_delay
+        self.cpu_overcommit = cpu_overcommit
+        self.cgroup_root = cgroup_root
+        self._stopped = threading.Event()
+        self._last_busy = time.monotonic()
+        # (time, dequeued) of the latest dequeue progress, for the queue-wait estimate
+        self._progress: Optional[Tuple[float, int]] = None
+
+    def max_workers(self, cpus: float) -> int:
+        return min(self.qm.max_parallelism,
+                   max(self.qm.min_parallelism, math.floor(cpus * self.cpu_overcommit)))
+
+    def queue_wait(self, qsize: int, now: float) -> Optional[float]:
+        """
+        Estimated wait of a message enqueued now - the backlog over the drain rate since the latest check
+        (Little's law), or the time since the last dequeue if the consumers made no progress; None if the
+        transport does not count dequeued messages
+        """
+        dequeued = self.qm.dequeued_count()
+        if dequeued is None:
+            return None
+        if self._progress is None or dequeued < self._progress[1]:
+            self._progress = (now, dequeued)
+            return 0.0
+        since, last_dequeued = self._progress
+        if dequeued == last_dequeued:
+            return now - since if qsize else 0.0
+        self._progress = (now, dequeued)
+        return qsize * (now - since) / (dequeued - last_dequeued)
+
+    def decide(self, workers: int, qsize: int, wait: Optional[float], max_workers: int,
+               now: float) -> Tuple[int, str]:
+        """(+1, -1 or 0 worker, reason) of the scaling decision"""
+        if qsize:
+            self._last_busy = now
+        if workers < self.qm.min_parallelism:
+            return 1, f"below min {self.qm.min_parallelism} workers"
+        if workers > max_workers:
+            return -1, f"above max {max_workers} workers"
+        if workers < max_workers and qsize > workers * self.backlog:
+            return 1, f"backlog {qsize} over {workers} workers"
+        if workers < max_workers and wait is not None and wait > self.target_wait:
+            return 1, f"estimated queue wait {wait:.2f}s"
+        if workers > self.qm.min_parallelism and now - self._last_busy >= self.idle_delay:
+            # Next worker is drained idle_delay later at the earliest
+            self._last_busy = now
+            return -1, f"queue idle for {self.idle_delay}s"
+        return 0, ""
+
+    def step(self) -> int:
+        """One scaling decision, returns the change in workers"""
+        now = time.monotonic()
+        self.qm.reap()
+        workers = self.qm.workers()
+        qsize = self.qm.qsize()
+        cpus = available_cpus(self.cgroup_root)
+        max_workers = self.max_workers(cpus)
+        wait = self.queue_wait(qsize, now)
+        delta, reason = self.decide(workers, qsize, wait, max_workers, now)
+        if delta > 0:
+            self.qm.scale_up()
+        elif delta < 0 and not self.qm.scale_down():
+            delta = 0
+        if delta:
+            logger.info(f"Autoscaler-{self.qm.service} scales {'up' if delta > 0 else 'down'} to "
+                        f"{workers + delta} workers ({reason}; qsize {qsize}, {cpus:g} CPUs) "
+                        f"by Process-{os.getpid()}")
+        self.qm.record_autoscale(workers + delta, max_workers, cpus, wait, delta)
+        return delta
+
+    def run(self) -> None:
+        logger.info(f"Autoscaler-{self.qm.service} between {self.qm.min_parallelism} and "
+                    f"{self.qm.max_parallelism} workers is started by Process-{os.getpid()}")
+        while not self._stopped.wait(self.interval):
+            try:
+                self.step()
+            except Exception as e:
+                # The manager may be shutting down, the next check retries
+                logger.error(f"Autoscaler-{self.qm.service} check failed by Process-{os.getpid()} - {e}")
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
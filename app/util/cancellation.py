@@ -0,0 +1,62 @@
+import hashlib
+import multiprocessing
+import os
+from typing import Callable, Iterable, Set
+
+from app.util.logger import logger
+
+
+class CancellationBoard:
+    """
+    Task ids cancelled by the API processes, checked by the consumer processes between the chunks
+    of a computation
+
+    Shared memory ring of the latest `slots` cancelled task id hashes along with a generation counter,
+    so that a running computation only rescans the ring when something has been cancelled since its
+    last check. A task id pushed out of the ring is simply computed to the end - its result is
+    discarded by the database, which only updates tasks still PROCESSING.
+    """
+
+    def __init__(self, slots: int = 1024):
+        self.slots = slots
+        # Hash of the cancelled task ids, 0 if the slot is free
+        self._hashes = multiprocessing.Array('q', slots)
+        # Cancellations so far - the next slot is generation % slots
+        self._generation = multiprocessing.Value('q', 0)
+
+    @staticmethod
+    def _hash(task_id: str) -> int:
+        value = int.from_bytes(hashlib.blake2b(task_id.encode(), digest_size=8).digest(), "little", signed=True)
+        return value or 1
+
+    def cancel(self, task_ids: Iterable[str]) -> None:
+        with self._generation.get_lock():
+            for task_id in task_ids:
+                self._hashes[self._generation.value % self.slots] = self._hash(task_id)
+                self._generation.value += 1
+                logger.info(f"Task task_id={task_id} is cancelled by Process-{os.getpid()}")
+
+    def cancelled(self, task_ids: Iterable[str]) -> Set[str]:
+        """Subset of the task ids which have been cancelled"""
+        if self._generation.value == 0:
+            return set()
+        hashes = set(self._hashes[:])
+        return {task_id for task_id in task_ids if self._hash(task_id) in hashes}
+
+    def is_cancelled(self, task_id: str) -> bool:
+        return bool(self.cancelled([task_id]))
+
+    def watcher(self, task_ids: Iterable[str]) -> Callable[[], bool]:
+        """Cheap check of whether all the task ids have been cancelled, meant to be called once per chunk"""
+        hashes = {self._hash(task_id) for task_id in task_ids}
+        seen = 0
+
+        def cancelled() -> bool:
+            nonlocal seen
+            generation = self._generation.value
+            if generation == seen:
+                return False
+            seen = generation
+            return hashes <= set(self._hashes[:])
+
+        return cancelled
@@ -0,0 +1,162 @@
+import multiprocessing
+import os
+import threading
+from collections import defaultdict
+from queue import Queue, Empty
+from typing import Dict, Set, List, Tuple, Optional, Iterable, Callable
+
+from app.util.logger import logger
+
+# (task_id, status, status_message, output)
+Notice = Tuple[str, str, str, float]
+
+
+class Subscription:
+    """Completion notices of a set of task_ids, delivered to a single waiter of the API process"""
+
+    def __init__(self, notifier: "CompletionNotifier", task_ids: Iterable[str]):
+        self.notifier = notifier
+        self.task_ids = set(task_ids)
+        self.notices: Queue = Queue()
+
+    def get(self, timeout: float) -> Optional[Notice]:
+        try:
+            return self.notices.get(block=True, timeout=max(timeout, 0))
+        except Empty:
+            return None
+
+    def close(self) -> None:
+        self.notifier.unsubscribe(self)
+
+    def __enter__(self) -> "Subscription":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+
+class CompletionNotifier:
+    """
+    Consumer processes publish the status transitions they have committed, a listener thread of the
+    API process dispatches them to the subscribed waiters (long-poll and server-sent events) so that
+    nobody has to poll the database
+
+    Every notice is published on one channel per API process (pre-fork server workers), a serving
+    process claims a free channel when its listener starts.
+    """
+
+    def __init__(self, channels: int = 1):
+        self.__init_state([multiprocessing.Queue() for _ in range(channels)], multiprocessing.Array('i', channels))
+
+    def __getstate__(self):
+        # Consumer processes only publish, the subscribers and the listener stay in the API process
+        return {"queues": self.queues, "owners": self._owners}
+
+    def __setstate__(self, state):
+        self.__init_state(state["queues"], state["owners"])
+
+    def __init_state(self, queues: List[multiprocessing.Queue], owners):
+        self.queues = queues
+        self._owners = owners  # pid of the API process listening on every channel, 0 if free
+        self._pid = os.getpid()
+        self._subscribers: Dict[str, Set[Subscription]] = defaultdict(set)
+        self._observers: List[Callable[[List[Notice]], None]] = []
+        self._lock = threading.Lock()
+        self._listener: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def publish(self, notices: List[Notice]) -> None:
+        if not notices:
+            return
+        for channel, owner in enumerate(self._owners):
+            # Channels without a listener are skipped, nobody would drain them (worker role, single process server)
+            if owner == 0:
+                continue
+            if not self._is_alive(owner):
+                # The exiting consumer does not wait to flush what it has put for a listener which has gone
+                self.queues[channel].cancel_join_thread()
+                continue
+            self.queues[channel].put(list(notices))
+
+    def start(self) -> None:
+        if self._pid != os.getpid():
+            # Forked server worker - the subscribers and listener of the parent are not inherited
+            self.__init_state(self.queues, self._owners)
+        with self._lock:
+            if self._listener is None:
+                channel = self._claim()
+                if channel is None:
+                    logger.warning(f"CompletionNotifier has no free channel for Process-{os.getpid()}")
+                    return
+                self._listener = threading.Thread(target=self._listen, args=(self.queues[channel],),
+                                                  name="CompletionNotifier", daemon=True)
+                self._listener.start()
+                logger.info(f"CompletionNotifier listener on channel {channel} is started by Process-{os.getpid()}")
+
+    def _claim(self) -> Optional[int]:
+        with self._owners.get_lock():
+            for channel, owner in enumerate(self._owners):
+                if owner == 0 or not self._is_alive(owner):
+                    self._owners[channel] = os.getpid()
+                    return channel
+        return None
+
+    @staticmethod
+    def _is_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._listener is not None:
+            self._listener.join()
+        with self._owners.get_lock():
+            for channel, owner in enumerate(self._owners):
+                if owner == os.getpid():
+                    self._owners[channel] = 0
+
+    def subscribe(self, task_ids: Iterable[str]) -> Subscription:
+        """Subscribe before reading the current status from the database so that no transition is missed"""
+        self.start()
+        subscription = Subscription(self, task_ids)
+        with self._lock:
+            for task_id in subscription.task_ids:
+                self._subscribers[task_id].add(subscription)
+        return subscription
+
+    def observe(self, callback: Callable[[List[Notice]], None]) -> None:
+        """Call back with every batch of notices received by the API process, from the listener thread"""
+        with self._lock:
+            self._observers.append(callback)
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        with self._lock:
+            for task_id in subscription.task_ids:
+                subscribers = self._subscribers.get(task_id)
+                if subscribers is not None:
+                    subscribers.discard(subscription)
+                    if not subscribers:
+                        del self._subscribers[task_id]
+
+    def _listen(self, queue: multiprocessing.Queue) -> None:
+        while not self._stopped.is_set():
+            try:
+                notices = queue.get(block=True, timeout=1)
+            except Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            with self._lock:
+                observers = list(self._observers)
+            # Observers are called back before the subscribers wake up
+            for observer in observers:
+                observer(notices)
+            with self._lock:
+                for notice in notices:
+                    for subscription in self._subscribers.get(notice[0], ()):
+                        subscription.notices.put(notice)
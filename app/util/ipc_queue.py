@@ -0,0 +1,187 @@
+import multiprocessing
+import os
+import sys
+from multiprocessing.reduction import ForkingPickler
+from queue import Full, Empty
+from typing import Optional
+
+from app.util.logger import logger
+
+
+class MessageTooLarge(ValueError):
+    """Message larger than a slot of the queue, rejected whatever the depth of the queue"""
+
+
+class BoundedSimpleQueue:
+    """
+    Bounded queue on top of a multiprocessing pipe - no manager process and no feeder thread,
+    messages are written straight into the pipe by the producer.
+    The queue is bounded by messages and by the bytes the pipe buffers, a write is only started once the
+    pipe has room for it so that a producer never blocks on the pipe past its timeout
+    """
+
+    # struct "!i" length header written by Connection.send_bytes before the payload
+    _header = 4
+
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._reader, self._writer = multiprocessing.Pipe(duplex=False)
+        self.capacity = pipe_capacity(self._writer.fileno())
+        self._rlock = multiprocessing.Lock()
+        self._wlock = multiprocessing.Lock()
+        self._items = multiprocessing.Semaphore(0)
+        # [size, buffered bytes] guarded by _room
+        self._state = multiprocessing.Array('q', 2, lock=False)
+        self._room = multiprocessing.Condition()
+
+    def put(self, data, block: bool = True, timeout: Optional[float] = None) -> None:
+        payload = ForkingPickler.dumps(data)
+        frame = len(payload) + self._header
+        if frame > self.capacity:
+            raise MessageTooLarge(f"Message of {frame} bytes exceeds the pipe capacity of {self.capacity} bytes")
+        with self._room:
+            if not self._room.wait_for(lambda: self._state[0] < self.maxsize
+                                       and self._state[1] + frame <= self.capacity,
+                                       timeout=timeout if block else 0):
+                raise Full
+            self._state[0] += 1
+            self._state[1] += frame
+        # The pipe has room for the frame, the write does not block on the consumer
+        with self._wlock:
+            self._writer.send_bytes(payload)
+        self._items.release()
+
+    def put_nowait(self, data) -> None:
+        self.put(data, block=False)
+
+    def get(self, block: bool = True, timeout: Optional[float] = None):
+        if not self._items.acquire(block, timeout):
+            raise Empty
+        with self._rlock:
+            payload = self._reader.recv_bytes()
+        with self._room:
+            self._state[0] -= 1
+            self._state[1] -= len(payload) + self._header
+            self._room.notify_all()
+        return ForkingPickler.loads(payload)
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def qsize(self) -> int:
+        return self._state[0]
+
+    def full(self) -> bool:
+        return self.qsize() >= self.maxsize
+
+    def empty(self) -> bool:
+        return self.qsize() <= 0
+
+    def close(self) -> None:
+        self._reader.close()
+        self._writer.close()
+
+
+def pipe_capacity(fd: int, size: int = 2 ** 20) -> int:
+    """
+    Bytes a pipe buffers before a write blocks. On Linux the pipe is grown up to size, or the
+    unprivileged limit of /proc/sys/fs/pipe-max-size, elsewhere the smallest default buffer is assumed
+    """
+    if not sys.platform.startswith("linux"):
+        return 2 ** 14
+    import fcntl
+    # F_SETPIPE_SZ and F_GETPIPE_SZ, only exported by fcntl from python 3.10
+    set_pipe_size, get_pipe_size = getattr(fcntl, "F_SETPIPE_SZ", 1031), getattr(fcntl, "F_GETPIPE_SZ", 1032)
+    try:
+        fcntl.fcntl(fd, set_pipe_size, size)
+    except OSError as e:
+        logger.warning(f"Pipe kept its default capacity, could not grow it to {size} bytes - {e}")
+    return fcntl.fcntl(fd, get_pipe_size)
+
+
+class ShmRingQueue:
+    """
+    Bounded queue of str messages stored in a shared memory ring buffer of fixed size slots,
+    a message is copied once into shared memory instead of being pickled through a pipe
+    """
+
+    def __init__(self, maxsize: int, slot_size: int = 4096):
+        self.maxsize = maxsize
+        self.slot_size = slot_size
+        from multiprocessing import shared_memory
+        self._shm = shared_memory.SharedMemory(create=True, size=maxsize * slot_size)
+        self._lengths = multiprocessing.Array('i', maxsize, lock=False)
+        # [head, tail, size] guarded by _lock
+        self._cursor = multiprocessing.Array('l', 3, lock=False)
+        self._lock = multiprocessing.Lock()
+        self._slots = multiprocessing.BoundedSemaphore(maxsize)
+        self._items = multiprocessing.Semaphore(0)
+        self._owner_pid = os.getpid()
+        logger.info(f"ShmRingQueue {self._shm.name} with {maxsize} slots of {slot_size} bytes "
+                    f"created by Process-{os.getpid()}")
+
+    def put(self, data: str, block: bool = True, timeout: Optional[float] = None) -> None:
+        payload = data.encode("utf-8")
+        if len(payload) > self.slot_size:
+            raise MessageTooLarge(f"Message of {len(payload)} bytes exceeds the slot size of {self.slot_size} bytes")
+        if not self._slots.acquire(block, timeout):
+            raise Full
+        with self._lock:
+            tail = self._cursor[1]
+            offset = tail * self.slot_size
+            self._shm.buf[offset:offset + len(payload)] = payload
+            self._lengths[tail] = len(payload)
+            self._cursor[1] = (tail + 1) % self.maxsize
+            self._cursor[2] += 1
+        self._items.release()
+
+    def put_nowait(self, data: str) -> None:
+        self.put(data, block=False)
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> str:
+        if not self._items.acquire(block, timeout):
+            raise Empty
+        with self._lock:
+            head = self._cursor[0]
+            offset = head * self.slot_size
+            data = bytes(self._shm.buf[offset:offset + self._lengths[head]]).decode("utf-8")
+            self._cursor[0] = (head + 1) % self.maxsize
+            self._cursor[2] -= 1
+        self._slots.release()
+        return data
+
+    def get_nowait(self) -> str:
+        return self.get(block=False)
+
+    def qsize(self) -> int:
+        return self._cursor[2]
+
+    def full(self) -> bool:
+        return self.qsize() >= self.maxsize
+
+    def empty(self) -> bool:
+        return self.qsize() <= 0
+
+    def close(self) -> None:
+        self._shm.close()
+        # Only the creator removes the shared memory block
+        if os.getpid() == self._owner_pid:
+            self._shm.unlink()
+
+
+transports = ["manager", "queue", "simple", "shm_ring", "priority", "lease"]
+
+
+def create_ipc_queue(transport: str, maxsize: int, slot_size: int = 4096):
+    """
+    Build a process-shared queue without manager process, see ProcessQueueManager for 'manager'
+    and 'priority'
+    """
+    if transport == "queue":
+        return multiprocessing.Queue(maxsize)
+    elif transport == "simple":
+        return BoundedSimpleQueue(maxsize)
+    elif transport == "shm_ring":
+        return ShmRingQueue(maxsize, slot_size)
+    raise ValueError(f"Invalid queue transport - {transport}; available transports are [{','.join(transports)}]")
+
@@ -0,0 +1,293 @@
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import threading
+import time
+from queue import Full, Empty
+from sqlite3 import Error as SQLiteError
+from typing import Dict, List, Optional, Tuple
+
+from app.util.logger import logger
+from app.util.sqlite_pool import SQLiteConnectionPool
+
+
+class LeaseQueue:
+    """
+    Durable work queue on a database table shared by several replicas of the service
+
+    A message is claimed by a guarded UPDATE which leases it to the claiming process for
+    visibility_timeout seconds - a keeper thread of that process renews the lease until the message
+    is acknowledged, which deletes it. The message of a process which has died without acknowledging
+    it becomes visible again when its lease expires and is delivered to another consumer (at-least-once).
+
+    Terminate messages only drain the consumers of the replica which enqueued them, the ones of a replica gone
+    are pruned. Idle consumers
+    of the replica are woken up by its own puts, messages of the other replicas are picked up by
+    polling every poll_interval seconds.
+    """
+
+    def __init__(self, database: str, table: str, maxsize: int, visibility_timeout: float = 30.0,
+                 poll_interval: float = 0.2, pragmas: Dict = None):
+        self.database = database
+        self.table = table
+        self.maxsize = maxsize
+        self.visibility_timeout = visibility_timeout
+        self.poll_interval = poll_interval
+        self.replica = f"{socket.gethostname()}-{os.urandom(4).hex()}"
+        self.pool = SQLiteConnectionPool(database, size=1, pragmas=pragmas)
+        # Set by the local puts to wake up the idle consumers of the replica, cleared before every claim
+        self._ready = multiprocessing.Event()
+        self._pid: Optional[int] = None
+        self._held: Dict[int, float] = {}
+        self._lock = threading.Lock()
+        self._keeper: Optional[threading.Thread] = None
+        self._execute(f"""
+            CREATE TABLE IF NOT EXISTS {table} (
+                message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                task_id TEXT,
+                replica TEXT,
+                message TEXT,
+                enqueued_time FLOAT,
+                lease_owner TEXT,
+                lease_expiry FLOAT DEFAULT 0,
+                deliveries INTEGER DEFAULT 0
+            )
+        """)
+        # No index - acknowledged messages are deleted, claims walk the few rows from the oldest one by rowid
+        logger.info(f"LeaseQueue {table} of replica {self.replica} with {maxsize} size initialized by "
+                    f"Process-{os.getpid()}")
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_pid=None, _held={}, _lock=None, _keeper=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def owner(self) -> str:
+        return f"{self.replica}:{os.getpid()}"
+
+    def _ensure_process(self) -> None:
+        if self._pid != os.getpid():
+            # Leases held by the parent are renewed by the parent only
+            self._held = {}
+            self._lock = threading.Lock()
+            self._keeper = None
+            self._pid = os.getpid()
+
+    def _execute(self, statement: str, parameters: Tuple = ()) -> Tuple[List[tuple], int]:
+        conn = self.pool.acquire()
+        broken = False
+        try:
+            cur = conn.execute(statement, parameters)
+            rows = cur.fetchall()
+            conn.commit()
+            return rows, cur.rowcount
+        except SQLiteError:
+            try:
+                conn.rollback()
+            except SQLiteError:
+                broken = True
+            raise
+        finally:
+            self.pool.release(conn, discard=broken)
+
+    def put(self, data: str, block: bool = True, timeout: Optional[float] = None) -> None:
+        deadline = time.monotonic() + timeout if timeout is not None else float("inf")
+        message = json.loads(data)
+        replica = self.replica if message.get("api") == "terminate" else None
+        while True:
+            # Size check and insert in one transaction, the queue is bounded across the replicas
+            now = time.time()
+            _, inserted = self._execute(f"""
+                INSERT INTO {self.table}(task_id, replica, message, enqueued_time)
+                SELECT ?, ?, ?, ?
+                WHERE ? IS NOT NULL OR (
+                    SELECT count(*) FROM {self.table} WHERE lease_expiry < ? AND replica IS NULL
+                ) < ?
+            """, (message.get("task_id"), replica, data, now, replica, now, self.maxsize))
+            if inserted:
+                break
+            if not block or time.monotonic() >= deadline:
+                raise Full
+            time.sleep(min(self.poll_interval, max(deadline - time.monotonic(), 0)))
+        self._ready.set()
+
+    def put_nowait(self, data: str) -> None:
+        self.put(data, block=False)
+
+    def _claim(self) -> Optional[str]:
+        if sqlite3.sqlite_version_info >= (3, 35):
+            # Select and lease in one write transaction
+            now = time.time()
+            expiry = now + self.visibility_timeout
+            rows, _ = self._execute(f"""
+                UPDATE {self.table} SET lease_owner = ?, lease_expiry = ?, deliveries = deliveries + 1
+                WHERE message_id = (
+                    SELECT message_id FROM {self.table}
+                    WHERE lease_expiry < ? AND (replica IS NULL OR replica = ?)
+                    ORDER BY message_id
+                    LIMIT 1
+                )
+                RETURNING message_id, message
+            """, (self.owner, expiry, now, self.replica))
+            if not rows:
+                return None
+            self._hold(rows[0][0], expiry)
+            return rows[0][1]
+        while True:
+            now = time.time()
+            rows, _ = self._execute(f"""
+                SELECT message_id, message FROM {self.table}
+                WHERE lease_expiry < ? AND (replica IS NULL OR replica = ?)
+                ORDER BY message_id
+                LIMIT 1
+            """, (now, self.replica))
+            if not rows:
+                return None
+            message_id, message = rows[0]
+            expiry = now + self.visibility_timeout
+            # Claimed by another consumer in between if no row is updated
+            _, updated = self._execute(f"""
+                UPDATE {self.table} SET lease_owner = ?, lease_expiry = ?, deliveries = deliveries + 1
+                WHERE message_id = ? AND lease_expiry < ?
+            """, (self.owner, expiry, message_id, now))
+            if updated:
+                self._hold(message_id, expiry)
+                return message
+
+    def _hold(self, message_id: int, expiry: float) -> None:
+        self._ensure_process()
+        with self._lock:
+            self._held[message_id] = expiry
+            if self._keeper is None:
+                self._keeper = threading.Thread(target=self._keep, name="LeaseQueue-keeper", daemon=True)
+                self._keeper.start()
+
+    def _keep(self) -> None:
+        """Renew the leases of the messages held by the process until they are acknowledged"""
+        while True:
+            time.sleep(self.visibility_timeout / 3)
+            with self._lock:
+                message_ids = list(self._held)
+            if not message_ids:
+                continue
+            try:
+                self._execute(f"""
+                    UPDATE {self.table} SET lease_expiry = ?
+                    WHERE message_id IN (SELECT value FROM json_each(?)) AND lease_owner = ?
+                """, (time.time() + self.visibility_timeout, json.dumps(message_ids), self.owner))
+            except SQLiteError as e:
+                logger.error(f"LeaseQueue {self.table} failed to renew {len(message_ids)} leases by "
+                             f"Process-{os.getpid()} - {e}")
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> str:
+        deadline = time.monotonic() + timeout if timeout is not None else float("inf")
+        while True:
+            # A put in between the clear and the wait is claimed by the claim or wakes up the wait
+            self._ready.clear()
+            message = self._claim()
+            if message is not None:
+                return message
+            remaining = deadline - time.monotonic()
+            if not block or remaining <= 0:
+                raise Empty
+            self._ready.wait(timeout=min(self.poll_interval, remaining))
+
+    def get_nowait(self) -> str:
+        return self.get(block=False)
+
+    def ack(self) -> int:
+        """Delete the messages claimed by the process since its last ack, returns how many"""
+        self._ensure_process()
+        with self._lock:
+            message_ids = list(self._held)
+            self._held.clear()
+        if not message_ids:
+            return 0
+        _, deleted = self._execute(f"""
+            DELETE FROM {self.table} WHERE message_id IN (SELECT value FROM json_each(?)) AND lease_owner = ?
+        """, (json.dumps(message_ids), self.owner))
+        return deleted
+
+    def abandon(self, pid: int, recovered: bool) -> int:
+        """
+        Messages leased by a lost consumer of the replica - deleted when its in-flight tasks are recovered by the
+        watchdog, otherwise released to be redelivered (claimed before the consumer recorded them, or left out of
+        its in-flight tasks). Returns how many
+        """
+        owner = f"{self.replica}:{pid}"
+        if recovered:
+            _, count = self._execute(f"DELETE FROM {self.table} WHERE lease_owner = ?", (owner,))
+        else:
+            _, count = self._execute(f"""
+                UPDATE {self.table} SET lease_owner = NULL, lease_expiry = 0 WHERE lease_owner = ?
+            """, (owner,))
+        return count
+
+    def requeue(self, messages: List[str]) -> int:
+        """
+        Put the messages of the tasks no replica has queued, alone or in a batch, whatever the size of the queue.
+        Returns how many
+        """
+        _, inserted = self._execute(f"""
+            INSERT INTO {self.table}(task_id, message, enqueued_time)
+            SELECT json_extract(pending.value, '$.task_id'), pending.value, ?
+            FROM json_each(?) AS pending
+            WHERE json_extract(pending.value, '$.task_id') NOT IN (
+                SELECT task_id FROM {self.table} WHERE task_id IS NOT NULL
+                UNION ALL
+                SELECT json_extract(item.value, '$.task_id')
+                FROM {self.table}, json_each({self.table}.message, '$.items') AS item
+            )
+        """, (time.time(), json.dumps(messages)))
+        if inserted:
+            self._ready.set()
+        return inserted
+
+    def prune(self) -> int:
+        """
+        Delete the terminate messages of the replicas gone - left unclaimed for visibility_timeout seconds while
+        no consumer of their replica holds a lease. Returns how many
+        """
+        now = time.time()
+        _, deleted = self._execute(f"""
+            DELETE FROM {self.table}
+            WHERE replica IS NOT NULL AND replica != ? AND lease_expiry < ? AND enqueued_time < ?
+            AND NOT EXISTS (
+                SELECT 1 FROM {self.table} AS held
+                WHERE substr(held.lease_owner, 1, length({self.table}.replica) + 1) = {self.table}.replica || ':'
+                AND held.lease_expiry >= ?
+            )
+        """, (self.replica, now, now - self.visibility_timeout, now))
+        return deleted
+
+    def remove(self, task_ids: List[str]) -> int:
+        """Drop the messages of the task_ids not claimed yet, returns how many"""
+        _, deleted = self._execute(f"""
+            DELETE FROM {self.table}
+            WHERE task_id IN (SELECT value FROM json_each(?)) AND lease_expiry < ?
+        """, (json.dumps(task_ids), time.time()))
+        return deleted
+
+    def qsize(self) -> int:
+        """Messages waiting for a consumer of any replica, terminate messages left out"""
+        rows, _ = self._execute(f"SELECT count(*) FROM {self.table} WHERE lease_expiry < ? AND replica IS NULL",
+                                (time.time(),))
+        return rows[0][0]
+
+    def full(self) -> bool:
+        return self.qsize() >= self.maxsize
+
+    def empty(self) -> bool:
+        return self.qsize() <= 0
+
+    def close(self) -> None:
+        # Terminate messages left are addressed to the consumers of this replica only
+        self._execute(f"DELETE FROM {self.table} WHERE replica = ?", (self.replica,))
+        self.pool.close()
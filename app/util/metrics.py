@@ -0,0 +1,304 @@
+import bisect
+import fcntl
+import glob
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Tuple, Sequence, Optional, List, Union
+
+from app.util.logger import logger
+
+# Seconds, from sub-millisecond IPC/SQLite calls up to long computations
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelValues = Tuple[str, ...]
+
+# Totals of the reaped processes, summed like the snapshot of a live process
+BASE_SNAPSHOT = "base.json"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str, label_names: Sequence[str]):
+        self.registry = registry
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.values: Dict[LabelValues, Union[float, List[float]]] = {}
+
+    def _key(self, labels: Dict[str, object]) -> LabelValues:
+        return tuple(str(labels[name]) for name in self.label_names)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = self.values.get(key, 0.0) + amount
+        self.registry.touch()
+
+
+class Gauge(_Metric):
+    """Sampled by the scraping process only, gauges are neither flushed nor aggregated across processes"""
+    kind = "gauge"
+
+    def set(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.registry.lock:
+            self.values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, registry: "MetricsRegistry", name: str, documentation: str, label_names: Sequence[str],
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(registry, name, documentation, label_names)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self.registry.lock:
+            # Per bucket (non-cumulative) counts, +Inf count, then the sum of the observations
+            counts = self.values.get(key)
+            if counts is None:
+                counts = self.values[key] = [0.0] * (len(self.buckets) + 2)
+            counts[bisect.bisect_left(self.buckets, value)] += 1
+            counts[-1] += value
+        self.registry.touch()
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+
+class MetricsRegistry:
+    """
+    Metrics of the current process, aggregated across processes through a collector directory
+
+    Every process holding counter or histogram values writes a snapshot file named by its pid and start
+    time at most once per flush interval from a background thread, so that a reused pid never overwrites
+    the snapshot of an exited process; the scraping process sums the snapshot files of all processes with
+    its own values. Snapshots of exited processes are folded into a base snapshot when they are reaped
+    so that the totals stay monotonic, the directory is cleared when the microservice starts.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.metrics: Dict[str, _Metric] = {}
+        self.directory: Optional[str] = None
+        self.flush_interval = 1.0
+        self._dirty = False
+        self._flusher_pid: Optional[int] = None
+        self._start: Optional[str] = None
+        # Forked children start from empty values so that the parent values are not counted twice
+        os.register_at_fork(after_in_child=self._reset)
+
+    def _register(self, metric: _Metric) -> _Metric:
+        with self.lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Counter:
+        return self._register(Counter(self, name, documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> Gauge:
+        return self._register(Gauge(self, name, documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram(self, name, documentation, labels, buckets))
+
+    def configure(self, directory: str, flush_interval: float = 1.0, clear: bool = False) -> None:
+        os.makedirs(directory, exist_ok=True)
+        if clear:
+            for path in glob.glob(os.path.join(directory, "*.json")):
+                os.remove(path)
+        self.directory = directory
+        self.flush_interval = flush_interval
+        logger.info(f"Metrics collector directory {directory} is configured by Process-{os.getpid()}")
+
+    def touch(self) -> None:
+        self._dirty = True
+        if self.directory and self._flusher_pid != os.getpid():
+            self._flusher_pid = os.getpid()
+            threading.Thread(target=self._flush_loop, name="metrics-flusher", daemon=True).start()
+
+    def _flush_loop(self) -> None:
+        pid = os.getpid()
+        while self._flusher_pid == pid:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def _own_path(self) -> str:
+        if self._start is None:
+            # Clock ticks since boot, or the wall clock where /proc is not available
+            self._start = _process_start(os.getpid()) or str(time.time_ns())
+        return os.path.join(self.directory, f"{os.getpid()}-{self._start}.json")
+
+    def _snapshot(self) -> Dict[str, List]:
+        with self.lock:
+            self._dirty = False
+            return {name: [[list(key), value] for key, value in metric.values.items()]
+                    for name, metric in self.metrics.items() if metric.kind != "gauge" and metric.values}
+
+    def flush(self) -> None:
+        """Write the snapshot of the current process, a no-op if nothing changed since the last flush"""
+        if not self.directory or not self._dirty:
+            return
+        path = self._own_path()
+        try:
+            with open(f"{path}.tmp", "w") as f:
+                json.dump(self._snapshot(), f)
+            # Readers never see a partially written snapshot
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.error(f"Failed to flush metrics by Process-{os.getpid()} - {e}")
+
+    def _reset(self) -> None:
+        self.lock = threading.Lock()
+        for metric in self.metrics.values():
+            metric.values = {}
+        self._dirty = False
+        self._flusher_pid = None
+        self._start = None
+
+    def reap(self) -> None:
+        """Fold the snapshots of the exited processes into the base snapshot and remove them"""
+        if not self.directory:
+            return
+        own_path = self._own_path()
+        base_path = os.path.join(self.directory, BASE_SNAPSHOT)
+        try:
+            # Concurrent scrapers never fold the same snapshot twice
+            with open(os.path.join(self.directory, "base.lock"), "w") as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                exited = [path for path in glob.glob(os.path.join(self.directory, "*-*.json"))
+                          if path != own_path and not _is_running(path)]
+                if not exited:
+                    return
+                base = {}
+                for path in [base_path, *exited]:
+                    for name, values in _read(path).items():
+                        _add(base.setdefault(name, {}), values)
+                with open(f"{base_path}.tmp", "w") as f:
+                    json.dump({name: [[list(key), value] for key, value in values.items()]
+                               for name, values in base.items()}, f)
+                os.replace(f"{base_path}.tmp", base_path)
+                for path in exited:
+                    os.remove(path)
+        except OSError as e:
+            logger.error(f"Failed to reap metrics by Process-{os.getpid()} - {e}")
+            return
+        logger.info(f"Metrics of {len(exited)} exited processes are folded by Process-{os.getpid()}")
+
+    def collect(self) -> Dict[str, Dict[LabelValues, Union[float, List[float]]]]:
+        """Values of every metric summed over the snapshots of the other processes and the current process"""
+        snapshots = []
+        if self.directory:
+            self.reap()
+            own_path = self._own_path()
+            snapshots = [_read(path) for path in glob.glob(os.path.join(self.directory, "*.json")) if path != own_path]
+        with self.lock:
+            collected = {name: {key: list(value) if isinstance(value, list) else value
+                                for key, value in metric.values.items()}
+                         for name, metric in self.metrics.items()}
+        for snapshot in snapshots:
+            for name, values in snapshot.items():
+                metric_values = collected.get(name)
+                if metric_values is not None:
+                    _add(metric_values, values)
+        return collected
+
+    @staticmethod
+    def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)"""
+        lines = []
+        for name, values in sorted(self.collect().items()):
+            metric = self.metrics[name]
+            lines.append(f"# HELP {name} {metric.documentation}")
+            lines.append(f"# TYPE {name} {metric.kind}")
+            for key, value in sorted(values.items()):
+                if metric.kind != "histogram":
+                    lines.append(f"{name}{self._labels(metric.label_names, key)} {_number(value)}")
+                    continue
+                cumulative = 0.0
+                for bound, count in zip([*metric.buckets, "+Inf"], value[:-1]):
+                    cumulative += count
+                    le = 'le="+Inf"' if bound == "+Inf" else f'le="{bound}"'
+                    lines.append(f"{name}_bucket{self._labels(metric.label_names, key, le)} {_number(cumulative)}")
+                lines.append(f"{name}_sum{self._labels(metric.label_names, key)} {_number(value[-1])}")
+                lines.append(f"{name}_count{self._labels(metric.label_names, key)} {_number(cumulative)}")
+        return "\n".join(lines) + "\n"
+
+
+def _process_start(pid: int) -> Optional[str]:
+    """Start time of a process in clock ticks since boot, None if it is not running or /proc is not available"""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name between parentheses may contain spaces, the start time is the 22nd field
+    return stat[stat.rindex(")") + 2:].split()[19]
+
+
+def _is_running(path: str) -> bool:
+    """Whether the process that wrote a snapshot named by its pid and start time is still running"""
+    pid, start = os.path.basename(path)[:-len(".json")].split("-", 1)
+    if os.path.isdir("/proc/self"):
+        return _process_start(int(pid)) == start
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _read(path: str) -> Dict[str, List]:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        # Snapshot removed while being listed
+        return {}
+
+
+def _add(metric_values: Dict[LabelValues, Union[float, List[float]]], values: List) -> None:
+    for key, value in values:
+        key = tuple(key)
+        current = metric_values.get(key)
+        if current is None:
+            metric_values[key] = value
+        elif isinstance(current, list):
+            metric_values[key] = [a + b for a, b in zip(current, value)]
+        else:
+            metric_values[key] = current + value
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+# Process-wide registry
+registry = MetricsRegistry()
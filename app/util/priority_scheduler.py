@@ -0,0 +1,176 @@
+import heapq
+import itertools
+import json
+import threading
+import time
+from collections import deque, defaultdict
+from multiprocessing.managers import BaseManager
+from queue import Full, Empty
+from typing import Dict, List, Tuple, Optional, Deque, Set
+
+
+class FairPriorityQueue:
+    """
+    Priority queue with weighted fair sharing between tenants, hosted in a manager server process
+    so that it is shared by every producer and consumer process
+
+    Messages are JSON strings, scheduled by
+        1. api - kill first, compute next and terminate last (as ThreadPriorityQueueManager)
+        2. priority - optional compute field, lower value is served first (default 0)
+        3. tenant - optional compute field, tenants of the same priority share the consumers in
+           proportion to their weights (weighted fair queuing on virtual finish times)
+    """
+    __API_RANKS: Dict[str, int] = {"kill": 0, "compute": 1, "terminate": 2}
+    __WAIT_WINDOW = 1000  # queue-wait samples kept per class
+    __TENANT_STATS = 1000  # dequeued counters kept per class/tenant, the tenants beyond are counted as "other"
+
+    def __init__(self, maxsize: int, weights: Dict[str, float] = None, fair_share: bool = True):
+        self.maxsize = maxsize
+        self.weights = weights or {}
+        self.fair_share = fair_share
+        # class -> heap of (virtual finish time, sequence, enqueue time, tenant, data)
+        self._classes: Dict[Tuple[int, int], List] = defaultdict(list)
+        self._virtual_time: Dict[Tuple[int, int], float] = defaultdict(float)
+        # Finish time of the latest message of a tenant, only kept while it is ahead of the virtual time
+        self._tenant_finish: Dict[Tuple[Tuple[int, int], str], float] = {}
+        self._waits: Dict[str, Deque[float]] = defaultdict(lambda: deque(maxlen=self.__WAIT_WINDOW))
+        self._dequeued: Dict[str, int] = defaultdict(int)
+        self._sequence = itertools.count()
+        self._size = 0
+        self._mutex = threading.Lock()
+        self._not_empty = threading.Condition(self._mutex)
+        self._not_full = threading.Condition(self._mutex)
+
+    def _schedule(self, data: str) -> Tuple[Tuple[int, int], str]:
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            payload = {}
+        api_rank = self.__API_RANKS.get(payload.get("api"), self.__API_RANKS["compute"])
+        try:
+            priority = int(payload.get("priority") or 0) if api_rank == self.__API_RANKS["compute"] else 0
+        except (TypeError, ValueError):
+            priority = 0
+        return (api_rank, priority), str(payload.get("tenant") or "default")
+
+    @staticmethod
+    def _class_label(cls: Tuple[int, int]) -> str:
+        api = ["kill", "compute", "terminate"][cls[0]]
+        return f"{api}-p{cls[1]}" if api == "compute" else api
+
+    def put(self, data: str, block: bool = True, timeout: Optional[float] = None) -> None:
+        cls, tenant = self._schedule(data)
+        with self._not_full:
+            if not self._not_full.wait_for(lambda: self._size < self.maxsize, timeout if block else 0):
+                raise Full
+            if self.fair_share:
+                start = max(self._virtual_time[cls], self._tenant_finish.get((cls, tenant), 0.0))
+                finish = start + 1.0 / self.weights.get(tenant, 1.0)
+                self._tenant_finish[(cls, tenant)] = finish
+            else:
+                finish = 0.0
+            heapq.heappush(self._classes[cls], (finish, next(self._sequence), time.monotonic(), tenant, data))
+            self._size += 1
+            self._not_empty.notify()
+
+    def put_nowait(self, data: str) -> None:
+        self.put(data, block=False)
+
+    def get(self, block: bool = True, timeout: Optional[float] = None) -> str:
+        with self._not_empty:
+            if not self._not_empty.wait_for(lambda: self._size > 0, timeout if block else 0):
+                raise Empty
+            cls = min(cls for cls, heap in self._classes.items() if heap)
+            finish, _, enqueue_time, tenant, data = heapq.heappop(self._classes[cls])
+            self._virtual_time[cls] = max(self._virtual_time[cls], finish)
+            if self._tenant_finish.get((cls, tenant), 0.0) <= self._virtual_time[cls]:
+                # Latest message of the tenant is served, its next one starts from the virtual time anyway
+                self._tenant_finish.pop((cls, tenant), None)
+            self._size -= 1
+            label = self._class_label(cls)
+            self._waits[label].append(time.monotonic() - enqueue_time)
+            key = f"{label}/{tenant}"
+            if key not in self._dequeued and len(self._dequeued) >= self.__TENANT_STATS:
+                key = f"{label}/other"
+            self._dequeued[key] += 1
+            self._not_full.notify()
+            return data
+
+    def get_nowait(self) -> str:
+        return self.get(block=False)
+
+    @staticmethod
+    def _without(data: str, task_ids: Set[str]) -> Optional[str]:
+        """Message without the computations of the task_ids, None if nothing is left to compute"""
+        try:
+            payload = json.loads(data)
+        except ValueError:
+            return data
+        if payload.get("api") == "compute_batch":
+            items = [item for item in payload.get("items", []) if item.get("task_id") not in task_ids]
+            if not items:
+                return None
+            return data if len(items) == len(payload["items"]) else json.dumps({**payload, "items": items})
+        if payload.get("api") in ["compute", "compute_shard"] and payload.get("task_id") in task_ids:
+            return None
+        return data
+
+    def remove(self, task_ids: List[str]) -> int:
+        """Drop the queued computations of the task_ids, returns the number of messages removed"""
+        task_ids = set(task_ids)
+        removed = 0
+        with self._mutex:
+            for cls, heap in self._classes.items():
+                kept = []
+                for finish, sequence, enqueue_time, tenant, data in heap:
+                    data = self._without(data, task_ids)
+                    if data is not None:
+                        kept.append((finish, sequence, enqueue_time, tenant, data))
+                if len(kept) < len(heap):
+                    removed += len(heap) - len(kept)
+                    heapq.heapify(kept)
+                # Trimmed batch messages are replaced as well
+                self._classes[cls] = kept
+            # Tenants left without message in their class are not charged for the ones removed
+            queued = {(cls, tenant) for cls, heap in self._classes.items() for _, _, _, tenant, _ in heap}
+            for key in [key for key in self._tenant_finish if key not in queued]:
+                del self._tenant_finish[key]
+            self._size -= removed
+            if removed:
+                self._not_full.notify(removed)
+        return removed
+
+    def qsize(self) -> int:
+        return self._size
+
+    def full(self) -> bool:
+        return self._size >= self.maxsize
+
+    def empty(self) -> bool:
+        return self._size <= 0
+
+    def stats(self) -> Dict[str, Dict]:
+        """Queue-wait percentiles (seconds) over the latest dequeued messages per class"""
+        with self._mutex:
+            waits = {label: sorted(samples) for label, samples in self._waits.items()}
+            dequeued = dict(self._dequeued)
+            queued = {self._class_label(cls): len(heap) for cls, heap in self._classes.items()}
+        classes = {}
+        for label, samples in waits.items():
+            classes[label] = {
+                "samples": len(samples),
+                "p50": samples[int(len(samples) * 0.50)],
+                "p95": samples[min(int(len(samples) * 0.95), len(samples) - 1)],
+                "p99": samples[min(int(len(samples) * 0.99), len(samples) - 1)],
+            }
+        return {"queue_wait": classes, "queued": queued, "dequeued": dequeued}
+
+
+class SchedulerManager(BaseManager):
+    """Manager server process hosting the shared FairPriorityQueue"""
+    pass
+
+
+SchedulerManager.register("FairPriorityQueue", FairPriorityQueue,
+                          exposed=["put", "put_nowait", "get", "get_nowait", "remove", "qsize", "full", "empty",
+                                   "stats"])
@@ -1,58 +1,135 @@
+import json
 import multiprocessing
+import multiprocessing.queues
 import os
+import re
+import signal
+import threading
+import time
 from queue import Full, Empty
-from typing import List, Optional
+from typing import List, Optional, Dict
 
+from app.util.autoscaler import Autoscaler, available_cpus
+from app.util.ipc_queue import create_ipc_queue, ShmRingQueue
+from app.util.lease_queue import LeaseQueue
 from app.util.logger import logger
+from app.util.metrics import registry
+from app.util.watchdog import Watchdog, WorkerHeartbeats
+
+QUEUE_ENQUEUE_SECONDS = registry.histogram("calculator_queue_enqueue_seconds",
+                                           "Time to put a message on the process queue, blocking included")
+QUEUE_DEQUEUE_SECONDS = registry.histogram("calculator_queue_dequeue_seconds",
+                                           "Time to get a message ready on the process queue")
+QUEUE_FULL = registry.counter("calculator_queue_full_total", "Messages rejected by the full process queue")
 
 
 class ProcessQueueManager:
     def __init__(self, service: str = None, parallelism: int = None, max_limit: int = None,
-                 queue_block_timeout: float = None):
+                 queue_block_timeout: float = None, transport: str = "manager", slot_size: int = 4096,
+                 tenant_weights: Dict[str, float] = None, fair_share: bool = True,
+                 min_parallelism: int = None, max_parallelism: int = None, autoscale: Dict = None,
+                 watchdog: Dict = None, lease: Dict = None):
         self.service = service
         self.parallelism = parallelism
+        # Consumers are autoscaled between min and max parallelism when max is above min
+        self.min_parallelism = min_parallelism or parallelism or 0
+        self.max_parallelism = max(max_parallelism or parallelism or 0, self.min_parallelism)
+        # Autoscaler settings, see Autoscaler
+        self.autoscale = autoscale or {}
         self.max_limit = max_limit
         self.queue_block_timeout = queue_block_timeout
-        self.manager: Optional[multiprocessing.managers.SyncManager] = None
+        # manager (proxied through a manager server process), queue, simple, shm_ring,
+        # priority (FairPriorityQueue proxied through a manager server process) or
+        # lease (LeaseQueue on a database shared by the replicas of the service)
+        self.transport = transport
+        # LeaseQueue settings (database, visibility_timeout, poll_interval, pragmas), lease transport only
+        self.lease = lease or {}
+        self.slot_size = slot_size
+        self.tenant_weights = tenant_weights or {}
+        self.fair_share = fair_share
+        self.manager: Optional[multiprocessing.managers.BaseManager] = None
         self.queue: Optional[multiprocessing.Queue] = None
         self.processes: List[multiprocessing.Process] = []
+        self.autoscaler: Optional[Autoscaler] = None
+        # Watchdog settings, see Watchdog - the consumers are not supervised if not set
+        self.watchdog: Optional[Watchdog] = Watchdog(self, **watchdog) if watchdog is not None else None
+        # Guards the consumer processes, changed by both the autoscaler and the watchdog
+        self._lock = threading.RLock()
+        # Consumer target and arguments, reused for the workers added by the autoscaler
+        self._consumer = None
+        # Terminate messages sent by the autoscaler whose worker has not exited yet
+        self._draining = 0
+        # workers, max workers, CPUs, queue wait (-1 if unknown), scale ups, scale downs -
+        # shared with the API processes forked after the manager
+        self._autoscale_stats = multiprocessing.Array("d", [parallelism or 0, self.max_parallelism,
+                                                                    available_cpus(), -1, 0, 0])
         self.queue_setup = False
         self.task_setup = False
         logger.info(
             f"ProcessQueueManager-{service} with {self.parallelism} parallelism and {self.max_limit} queue size "
-            f"initialized by Process-{os.getpid()}")
+            f"on {self.transport} transport initialized by Process-{os.getpid()}")
         self._start()
 
     def _start(self):
         if not self.queue_setup:
             logger.info(f"ProcessQueueManager-{self.service} manager, queues are started by Process-{os.getpid()}")
-            # New child process will get spawn on top of parent process for manager
-            self.manager = multiprocessing.Manager()
-            self.queue = self.manager.Queue(self.max_limit)
+            if self.transport == "manager":
+                # New child process will get spawn on top of parent process for manager
+                self.manager = multiprocessing.Manager()
+                self.queue = self.manager.Queue(self.max_limit)
+            elif self.transport == "priority":
+                # Imported on use, multiprocessing.managers stays out of the startup of the other transports
+                from app.util.priority_scheduler import SchedulerManager
+                self.manager = SchedulerManager()
+                self.manager.start()
+                self.queue = self.manager.FairPriorityQueue(self.max_limit, self.tenant_weights, self.fair_share)
+            elif self.transport == "lease":
+                table = re.sub(r"\W", "_", f"{self.service}_queue")
+                self.queue = LeaseQueue(table=table, maxsize=self.max_limit, **self.lease)
+            else:
+                self.queue = create_ipc_queue(self.transport, self.max_limit, self.slot_size)
             self.queue_setup = True
 
     def stop(self):
+        if self.watchdog:
+            self.watchdog.stop()
+        if self.autoscaler:
+            self.autoscaler.stop()
         if self.manager:
             logger.info(f'ProcessQueueManager-{self.service} manager is shut down by Process-{os.getpid()}')
             self.manager.shutdown()
         for i, process in enumerate(self.processes):
             logger.info(f'ProcessQueueManager-{self.service} process-{i} is cancelled by Process-{os.getpid()}')
             process.terminate()
+        if isinstance(self.queue, multiprocessing.queues.Queue):
+            # Do not wait for the feeder thread to flush messages nobody will consume
+            self.queue.cancel_join_thread()
+        elif isinstance(self.queue, ShmRingQueue):
+            for process in self.processes:
+                process.join()
+            self.queue.close()
+        elif isinstance(self.queue, LeaseQueue):
+            self.queue.close()
 
     def enqueue(self, data: str):
+        start = time.perf_counter()
         try:
             if not self.queue_block_timeout:
                 self.queue.put_nowait(data)
             else:
                 self.queue.put(data, block=True, timeout=self.queue_block_timeout)
         except Full:
+            QUEUE_FULL.inc()
             logger.info(f"Queue is full, please try again later")
             raise Full
+        QUEUE_ENQUEUE_SECONDS.observe(time.perf_counter() - start)
 
     def dequeue(self):
         try:
             if not self.queue_block_timeout:
+                start = time.perf_counter()
                 output = self.queue.get_nowait()
+                QUEUE_DEQUEUE_SECONDS.observe(time.perf_counter() - start)
             else:
                 output = self.queue.get(block=True, timeout=self.queue_block_timeout)
             return output
@@ -69,14 +146,162 @@ class ProcessQueueManager:
     def qsize(self) -> int:
         return self.queue.qsize()
 
+    def remove(self, task_ids: List[str]) -> int:
+        """
+        Drop the queued computations of the task_ids, returns the number of messages removed - only the priority
+        and lease transports support it, messages of the other transports are skipped by the consumers
+        """
+        if self.transport not in ["priority", "lease"]:
+            return 0
+        return self.queue.remove(task_ids)
+
+    def scheduler_stats(self) -> Dict:
+        """Queue-wait percentiles per priority class, empty unless on the priority transport"""
+        if self.transport != "priority":
+            return {}
+        return self.queue.stats()
+
+    def dequeued_count(self) -> Optional[int]:
+        """Messages dequeued so far, None unless on the priority transport"""
+        if self.transport != "priority":
+            return None
+        return sum(self.queue.stats()["dequeued"].values())
+
     def consumers(self, fn, *args):
         if not self.task_setup:
             logger.info(f"ProcessQueueManager-{self.service} processes are started by Process-{os.getpid()}")
+            self._consumer = (fn, args)
             for _ in range(self.parallelism):
-                # New child process will get spawn on top of parent process
-                process = multiprocessing.Process(target=fn, args=(self.queue, *args))
-                process.start()
-                self.processes.append(process)
+                self._spawn()
+            self._autoscale_stats[0] = self.workers()
             self.task_setup = True
+            if self.max_parallelism > self.min_parallelism:
+                self.autoscaler = Autoscaler(self, **self.autoscale)
+                self.autoscaler.start()
         else:
             logger.info(f"ProcessQueueManager-{self.service} processes have been started already")
+
+    def _spawn(self):
+        fn, args = self._consumer
+        # New child process will get spawn on top of parent process
+        process = multiprocessing.Process(target=fn, args=(self.queue, *args))
+        process.start()
+        with self._lock:
+            self.processes.append(process)
+
+    @property
+    def heartbeats(self) -> Optional[WorkerHeartbeats]:
+        """Board the consumers beat on, None if they are not supervised"""
+        return self.watchdog.heartbeats if self.watchdog else None
+
+    def supervise(self, on_lost):
+        """Start the watchdog, on_lost(inflight, reason) recovers the in-flight tasks of a lost consumer"""
+        if self.watchdog and not self.watchdog.is_alive():
+            self.watchdog.on_lost = on_lost
+            self.watchdog.start()
+
+    @staticmethod
+    def _is_alive(process: multiprocessing.Process) -> bool:
+        if not process.is_alive():
+            return False
+        # A pre-fork server master may have reaped the exited process already
+        try:
+            os.kill(process.pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
+
+    def reap(self) -> int:
+        """Forget the consumers which have exited, returns how many - crashed ones are left to the watchdog"""
+        with self._lock:
+            exited = [process for process in self.processes if not self._is_alive(process)
+                      and not (self.watchdog and process.exitcode)]
+            for process in exited:
+                process.join(timeout=0)
+                self.processes.remove(process)
+            self._draining = max(0, self._draining - len(exited))
+        return len(exited)
+
+    def is_running(self, pid: int) -> bool:
+        with self._lock:
+            for process in self.processes:
+                if process.pid == pid:
+                    return self._is_alive(process)
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        return True
+
+    def crashed(self) -> List[int]:
+        """Pids of the consumers which have exited with an error"""
+        with self._lock:
+            return [process.pid for process in self.processes if not self._is_alive(process) and process.exitcode]
+
+    def kill(self, pid: int):
+        """Kill a hung consumer, it is not able to exit gracefully"""
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            return
+        with self._lock:
+            for process in self.processes:
+                if process.pid == pid:
+                    process.join(timeout=5)
+
+    def respawn(self, pid: int, recovered: bool = False):
+        """Replace a lost consumer with a new one, recovered if its in-flight tasks are recovered by the caller"""
+        if self.transport == "lease":
+            # Messages of the tasks recovered by the watchdog are not redelivered, the others are
+            self.queue.abandon(pid, recovered)
+        with self._lock:
+            for process in self.processes:
+                if process.pid == pid:
+                    process.join(timeout=0)
+                    self.processes.remove(process)
+                    break
+            self._spawn()
+
+    def workers(self) -> int:
+        """Consumers running and not yet asked to terminate"""
+        return len(self.processes) - self._draining
+
+    def scale_up(self):
+        self._spawn()
+
+    def scale_down(self) -> bool:
+        """Drain one consumer gracefully, it exits once the messages queued ahead are processed"""
+        try:
+            self.queue.put_nowait(json.dumps({"task_id": "autoscaler", "api": "terminate"}))
+        except Full:
+            return False
+        self._draining += 1
+        return True
+
+    def record_autoscale(self, workers: int, max_workers: int, cpus: float, queue_wait: Optional[float],
+                         delta: int):
+        with self._autoscale_stats.get_lock():
+            self._autoscale_stats[0] = workers
+            self._autoscale_stats[1] = max_workers
+            self._autoscale_stats[2] = cpus
+            self._autoscale_stats[3] = -1 if queue_wait is None else queue_wait
+            if delta > 0:
+                self._autoscale_stats[4] += delta
+            elif delta < 0:
+                self._autoscale_stats[5] -= delta
+
+    def watchdog_stats(self) -> Dict:
+        """Consumers respawned per reason and in-flight tasks recovered by the watchdog"""
+        if not self.watchdog:
+            return {"enabled": False, "restarts": {reason: 0 for reason in Watchdog.REASONS}, "requeued": 0,
+                    "failed": 0}
+        return {"enabled": True, **self.watchdog.stats()}
+
+    def autoscaler_stats(self) -> Dict:
+        """Consumers and scaling decisions as of the latest autoscaler check"""
+        with self._autoscale_stats.get_lock():
+            workers, max_workers, cpus, queue_wait, scale_ups, scale_downs = self._autoscale_stats[:]
+        return {"enabled": self.max_parallelism > self.min_parallelism, "workers": int(workers),
+                "min_workers": self.min_parallelism, "max_workers": int(max_workers), "cpus": cpus,
+                "queue_wait": None if queue_wait < 0 else queue_wait,
+                "scale_ups": int(scale_ups), "scale_downs": int(scale_downs)}
@@ -0,0 +1,114 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from sqlite3 import Connection, Error as SQLiteError
+from typing import Dict, Optional, List, Union
+
+from app.util.logger import logger
+
+
+class SQLiteConnectionPool:
+    """
+    Per-process pool of persistent SQLite connections
+
+    Connections are never shared across processes: the pool is reset when it is used in a
+    forked child and is not pickled into spawned children. Idle connections are health checked
+    before reuse when they have been idle for longer than health_check_interval seconds.
+    """
+
+    def __init__(self, database: str, size: int = 4, pragmas: Dict[str, Union[str, int]] = None,
+                 timeout: float = 5.0, health_check_interval: float = 30.0, cached_statements: int = 128):
+        self.database = database
+        self.size = size
+        self.pragmas = pragmas or {}
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.cached_statements = cached_statements
+        self._pid: Optional[int] = None
+        self._idle: Optional[queue.LifoQueue] = None
+        # Connections inherited through fork belong to the parent, they are kept referenced but never used
+        self._inherited: List[Connection] = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.update(_pid=None, _idle=None, _inherited=[], _lock=None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _ensure_process(self) -> None:
+        if self._pid != os.getpid():
+            if self._idle is not None:
+                self._inherited.extend(conn for conn, _ in self._idle.queue)
+            self._lock = threading.Lock()
+            self._idle = queue.LifoQueue()
+            self._pid = os.getpid()
+            logger.info(f"SQLiteConnectionPool for {self.database} with {self.size} size "
+                        f"initialized by Process-{os.getpid()}")
+
+    def _connect(self) -> Connection:
+        conn = sqlite3.connect(self.database, timeout=self.timeout, check_same_thread=False,
+                               cached_statements=self.cached_statements)
+        for pragma, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        return conn
+
+    @staticmethod
+    def _is_healthy(conn: Connection) -> bool:
+        try:
+            conn.execute("SELECT 1").fetchone()
+            return True
+        except SQLiteError:
+            return False
+
+    @staticmethod
+    def _close(conn: Connection) -> None:
+        try:
+            conn.close()
+        except SQLiteError as e:
+            logger.error(f"Failed to close SQLite connection - {repr(e)}")
+
+    def acquire(self) -> Connection:
+        self._ensure_process()
+        while True:
+            try:
+                conn, released_time = self._idle.get_nowait()
+            except queue.Empty:
+                return self._connect()
+            if time.monotonic() - released_time < self.health_check_interval or self._is_healthy(conn):
+                return conn
+            logger.info(f"Discarding unhealthy SQLite connection by Process-{os.getpid()}")
+            self._close(conn)
+
+    def release(self, conn: Connection, discard: bool = False) -> None:
+        if self._pid != os.getpid():
+            return
+        if not discard and conn.in_transaction:
+            # Never hand out a connection with a pending transaction
+            try:
+                conn.rollback()
+            except SQLiteError:
+                discard = True
+        with self._lock:
+            if not discard and self._idle.qsize() < self.size:
+                self._idle.put((conn, time.monotonic()))
+                return
+        self._close(conn)
+
+    def close(self) -> None:
+        if self._pid != os.getpid():
+            return
+        while True:
+            try:
+                conn, _ = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._close(conn)
+
+    def stats(self) -> Dict[str, int]:
+        return {"size": self.size, "idle": self._idle.qsize() if self._pid == os.getpid() else 0}
@@ -0,0 +1,182 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+from typing import Callable, List, Optional, Tuple, Dict
+
+from app.util.logger import logger
+from app.util.metrics import registry
+
+WORKER_RESTARTS = registry.counter("calculator_worker_restarts_total",
+                                   "Consumers lost and respawned by the watchdog", ["reason"])
+
+# (pid, heartbeat, deadline, in-flight length) per slot
+_FIELDS = 4
+
+
+class Heartbeat:
+    """Slot of a consumer process on the WorkerHeartbeats board, written by that consumer only"""
+
+    def __init__(self, board: "WorkerHeartbeats", slot: int):
+        self.board = board
+        self.slot = slot
+
+    def beat(self) -> None:
+        self.board._state[self.slot * _FIELDS + 1] = time.monotonic()
+
+    def busy(self, inflight: List[list], deadline: float) -> None:
+        """In-flight tasks of the consumer, expected to be done by the monotonic deadline"""
+        self.board._write_inflight(self.slot, inflight)
+        self.board._state[self.slot * _FIELDS + 2] = deadline
+        self.beat()
+
+    def idle(self) -> None:
+        self.board._state[self.slot * _FIELDS + 2] = 0
+        self.board._state[self.slot * _FIELDS + 3] = 0
+        self.beat()
+
+    def release(self) -> None:
+        """Graceful exit - the slot is left to the next consumer"""
+        self.board.free(self.slot)
+
+
+class WorkerHeartbeats:
+    """
+    Shared memory board of the consumer processes - every consumer claims a slot where it beats and
+    records its in-flight tasks as a JSON list, so that the tasks of a consumer which has died or hung
+    can be recovered by the supervising process
+    """
+
+    def __init__(self, slots: int, slot_size: int = 2 ** 16):
+        self.slots = slots
+        self.slot_size = slot_size
+        self._state = multiprocessing.Array('d', slots * _FIELDS)
+        self._inflight = multiprocessing.Array('c', slots * slot_size)
+
+    def register(self) -> Optional[Heartbeat]:
+        with self._state.get_lock():
+            for slot in range(self.slots):
+                if self._state[slot * _FIELDS] == 0:
+                    self._state[slot * _FIELDS:(slot + 1) * _FIELDS] = [os.getpid(), time.monotonic(), 0, 0]
+                    return Heartbeat(self, slot)
+        logger.warning(f"WorkerHeartbeats has no free slot for Process-{os.getpid()}")
+        return None
+
+    def free(self, slot: int) -> None:
+        with self._state.get_lock():
+            self._state[slot * _FIELDS:(slot + 1) * _FIELDS] = [0, 0, 0, 0]
+
+    def _write_inflight(self, slot: int, inflight: List[list]) -> None:
+        data = json.dumps(inflight).encode()
+        if len(data) > self.slot_size:
+            # Tasks left out are not recovered by the watchdog - replayed by the next startup recovery, or
+            # redelivered by the lease queue
+            logger.warning(f"In-flight tasks of Process-{os.getpid()} exceed {self.slot_size} bytes, "
+                           f"{len(inflight)} tasks are not supervised")
+            data = b"[]"
+        start = slot * self.slot_size
+        self._inflight[start:start + len(data)] = data
+        self._state[slot * _FIELDS + 3] = len(data)
+
+    def workers(self) -> List[Tuple[int, int, float, float]]:
+        """(slot, pid, heartbeat, deadline) of the registered consumers, deadline is 0 while idle"""
+        with self._state.get_lock():
+            state = self._state[:]
+        return [(slot, int(state[slot * _FIELDS]), state[slot * _FIELDS + 1], state[slot * _FIELDS + 2])
+                for slot in range(self.slots) if state[slot * _FIELDS]]
+
+    def inflight(self, slot: int) -> List[list]:
+        length = int(self._state[slot * _FIELDS + 3])
+        if not length:
+            return []
+        start = slot * self.slot_size
+        return json.loads(self._inflight[start:start + length])
+
+
+class Watchdog(threading.Thread):
+    """
+    Supervise the consumers of a ProcessQueueManager through their heartbeats
+
+    A consumer is lost when its process has died, when it is busy past its deadline plus grace seconds
+    (a computation not preempted by its own timeout) or when it has not beaten for heartbeat_timeout
+    seconds; a hung consumer is killed. Every lost consumer is respawned and its in-flight tasks are
+    handed over to on_lost(inflight, reason), which returns how many were re-enqueued and failed.
+    """
+    REASONS = ["crashed", "timeout", "unresponsive"]
+
+    def __init__(self, qm, interval: float = 1.0, heartbeat_timeout: float = 30.0, grace: float = 5.0,
+                 slot_size: int = 2 ** 16):
+        super().__init__(name=f"Watchdog-{qm.service}", daemon=True)
+        self.qm = qm
+        self.interval = interval
+        self.heartbeat_timeout = heartbeat_timeout
+        self.grace = grace
+        # Draining consumers hold their slot until they exit, hence the headroom
+        self.heartbeats = WorkerHeartbeats(slots=max(qm.max_parallelism, 1) * 2, slot_size=slot_size)
+        self.on_lost: Optional[Callable[[List[list], str], Tuple[int, int]]] = None
+        self._stopped = threading.Event()
+        # restarts per reason, then re-enqueued and failed tasks - shared with the API processes
+        self._stats = multiprocessing.Array("d", len(self.REASONS) + 2)
+
+    def lost_workers(self, now: float) -> List[Tuple[Optional[int], int, str]]:
+        """(slot or None, pid, reason) of the consumers lost as of now, hung ones are killed"""
+        lost = []
+        registered = set()
+        for slot, pid, heartbeat, deadline in self.heartbeats.workers():
+            registered.add(pid)
+            if not self.qm.is_running(pid):
+                lost.append((slot, pid, "crashed"))
+                continue
+            if deadline and now > deadline + self.grace:
+                reason = "timeout"
+            elif now - heartbeat > self.heartbeat_timeout:
+                reason = "unresponsive"
+            else:
+                continue
+            logger.warning(f"Watchdog-{self.qm.service} kills consumer Process-{pid} ({reason}) "
+                           f"by Process-{os.getpid()}")
+            self.qm.kill(pid)
+            lost.append((slot, pid, reason))
+        # Consumers which died before registering
+        lost.extend((None, pid, "crashed") for pid in self.qm.crashed() if pid not in registered)
+        return lost
+
+    def step(self) -> int:
+        """One check of the consumers, returns the number of consumers respawned"""
+        lost = self.lost_workers(time.monotonic())
+        for slot, pid, reason in lost:
+            inflight = self.heartbeats.inflight(slot) if slot is not None else []
+            if slot is not None:
+                self.heartbeats.free(slot)
+            recovered = bool(self.on_lost and inflight)
+            self.qm.respawn(pid, recovered)
+            WORKER_RESTARTS.inc(reason=reason)
+            requeued, failed = self.on_lost(inflight, reason) if recovered else (0, 0)
+            logger.warning(f"Watchdog-{self.qm.service} respawned consumer Process-{pid} ({reason}) - "
+                           f"{requeued} in-flight tasks re-enqueued, {failed} failed by Process-{os.getpid()}")
+            with self._stats.get_lock():
+                self._stats[self.REASONS.index(reason)] += 1
+                self._stats[-2] += requeued
+                self._stats[-1] += failed
+        return len(lost)
+
+    def stats(self) -> Dict:
+        with self._stats.get_lock():
+            stats = self._stats[:]
+        restarts = {reason: int(count) for reason, count in zip(self.REASONS, stats)}
+        return {"restarts": restarts, "requeued": int(stats[-2]), "failed": int(stats[-1])}
+
+    def run(self) -> None:
+        logger.info(f"Watchdog-{self.qm.service} is started by Process-{os.getpid()}")
+        while not self._stopped.wait(self.interval):
+            try:
+                self.step()
+            except Exception as e:
+                # The manager may be shutting down, the next check retries
+                logger.error(f"Watchdog-{self.qm.service} check failed by Process-{os.getpid()} - {e}")
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
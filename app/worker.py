@@ -0,0 +1,75 @@
+import os
+import signal
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from app import CalculatorMicroservice
+from app.calculator.computation.service import run_calculator_qm_task
+from app.util.logger import logger
+
+# Processes started by manage.py - api (HTTP server only), worker (consumers only) or all
+roles = ["all", "api", "worker"]
+
+
+def metrics_server(ms: CalculatorMicroservice, port: int) -> ThreadingHTTPServer:
+    """Serve GET /metrics of the consumers in a daemon thread, the worker has no HTTP server of its own"""
+    # Import after the microservice initialization
+    from app.calculator.computation.api import handle_metrics
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = handle_metrics(ms).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    logger.info(f"Worker metrics are served at port {port} by Process-{os.getpid()}")
+    return server
+
+
+def run_worker(ms: CalculatorMicroservice) -> None:
+    """
+    Run the consumers, their watchdog and autoscaler and the retention job without the HTTP server
+
+    Flask and the server packages are never imported, the tasks are claimed from the lease queue shared
+    with the API processes. Their metrics are served at METRICS_PORT. Blocks until SIGTERM or SIGINT, then
+    stops the consumers.
+    """
+    stopped = threading.Event()
+    pid = os.getpid()
+
+    def shutdown(signum, _frame):
+        if os.getpid() != pid:
+            # Consumer forked with the handler, terminated by its manager
+            signal.signal(signum, signal.SIG_DFL)
+            os.kill(os.getpid(), signum)
+            return
+        stopped.set()
+
+    for signum in [signal.SIGTERM, signal.SIGINT]:
+        signal.signal(signum, shutdown)
+    ms.calculator_db.create_table()
+    ms.calculator_db.migrate()
+    run_calculator_qm_task(ms)
+    server = metrics_server(ms, ms.config.METRICS_PORT)
+    logger.info(f"Worker with {ms.calculator_qm.workers()} consumers is started by Process-{os.getpid()}")
+    stopped.wait()
+    logger.info(f"Worker is shut down by Process-{os.getpid()}")
+    server.shutdown()
+    server.server_close()
+    if ms.calculator_recovery:
+        ms.calculator_recovery.stop()
+    if ms.calculator_retention:
+        ms.calculator_retention.stop()
+    ms.calculator_qm.stop()
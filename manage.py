@@ -3,6 +3,8 @@ import os
 import unittest
 
 from app import CalculatorMicroservice, initialize_calculator_micro_service
+from app.server import servers, run_prefork
+from app.worker import roles, run_worker
 
 
 def test():
@@ -14,13 +16,26 @@ def test():
         return 1
 
 
-def run(ms: CalculatorMicroservice):
+def run(ms: CalculatorMicroservice, server: str, role: str):
+    ms.config.ROLE = role
+    if role == "worker":
+        run_worker(ms)
+        return
+    port = int(os.getenv("FLASK_MICROSERVICE_PORT") or 5000)
+    if server == "asgi":
+        # Import after the microservice initialization
+        from app.asgi import create_asgi_app
+        run_prefork(ms, create_asgi_app(ms), server, port)
+        return
     # Import after the microservice initialization
     from app.main import start_app
     app = start_app(ms)
     app.app_context().push()
-    port = int(os.getenv("FLASK_MICROSERVICE_PORT") or 5000)
-    app.run(host="0.0.0.0", port=port, debug=False, use_reloader=False)
+    if server == "wsgi":
+        run_prefork(ms, app, server, port)
+    else:
+        ms.calculator_notifier.start()
+        app.run(host="0.0.0.0", port=port, debug=False, use_reloader=False)
 
 
 if __name__ == "__main__":
@@ -30,6 +45,14 @@ if __name__ == "__main__":
 
     # For setting up production
     python3 manage.py
+
+    # For setting up production with pre-fork workers (FLASK_MICROSERVICE_WORKERS)
+    python3 manage.py --server wsgi
+    python3 manage.py --server asgi
+
+    # For scaling the API and the consumers separately (lease queue transport)
+    python3 manage.py --role api --server asgi
+    python3 manage.py --role worker
     """
     # Initialize process queue manager child process in entry point to prevent spawn error
     # Protecting the entry point ensures that the program is only started once,
@@ -40,9 +63,15 @@ if __name__ == "__main__":
                                      usage=usage)
     parser.add_argument('--test', action='store_true', default=False,
                         help='Test Flask microservice')
+    parser.add_argument('--server', choices=servers, default=calculator_ms.config.SERVER,
+                        help='Serve with the Flask development server, pre-fork WSGI or pre-fork ASGI workers')
+    parser.add_argument('--role', choices=roles, default=calculator_ms.config.ROLE,
+                        help='Run the HTTP server, the consumers or both in this process tree')
     args = parser.parse_args()
+    if args.role != "all" and calculator_ms.config.QUEUE_TRANSPORT != "lease":
+        parser.error(f"--role {args.role} needs the lease queue transport shared by the API and the workers")
 
     if args.test:
         test()
     else:
-        run(calculator_ms)
+        run(calculator_ms, args.server, args.role)